@@ -0,0 +1,130 @@
+# Maslin Farrell
+# Computer Networks Project 1
+import asyncio
+import json
+import logging
+
+from urllib.parse import parse_qs, urlsplit
+
+from PrefixIndex import PURGE_KINDS, cacheKeyFor
+
+
+class AdminServer:
+    """
+    The admin interface, served on its own port on localhost so clients of the proxy can never reach it.
+    Cached files are purged with a POST to /purge with exactly one of these query parameters:
+    - url: purges one URL, for example /purge?url=http://zhiju.me/networks/valid.html
+    - prefix: purges every URL starting with it, for example /purge?prefix=http://zhiju.me/networks/
+    - host: purges every URL on a host on any port, for example /purge?host=zhiju.me
+    The answer is the purge result as JSON. The purge only applies to this proxy, not to its siblings,
+    so it can't be used with several workers sharing a cache directory.
+    """
+
+    def __init__(self, proxy, readTimeout: float = 15.0):
+        """
+        Parameters:
+        proxy (Proxy): The proxy whose cache is being purged.
+        readTimeout (float): How many seconds we wait for each line of the request head.
+        """
+        self.proxy = proxy
+        self.readTimeout = readTimeout
+
+        # Counters for the admin requests
+        self.purges = 0
+        self.badRequests = 0
+
+    @staticmethod
+    def parsePurge(target: str):
+        """
+        Reads what to purge from the request target.
+
+        Parameters:
+        target (str): The request target, for example '/purge?host=zhiju.me'
+
+        Returns:
+        kind (str): 'url', 'prefix' or 'host'.
+        value (str): The cache key, key prefix or host name to purge.
+
+        Raises:
+        ValueError: If the target isn't /purge with exactly one known, non-empty parameter.
+        """
+        parsedTarget = urlsplit(target)
+        if parsedTarget.path != "/purge":
+            raise ValueError(f"Unknown admin path {parsedTarget.path}, expected /purge")
+
+        query = parse_qs(parsedTarget.query)
+        kinds = [kind for kind in PURGE_KINDS if kind in query]
+        if len(kinds) != 1 or len(query) != 1 or len(query[kinds[0]]) != 1 or not query[kinds[0]][0]:
+            raise ValueError(f"A purge needs exactly one of the {', '.join(PURGE_KINDS)} parameters")
+
+        kind = kinds[0]
+        value = query[kind][0]
+
+        # Cache keys are the host and path of the URL, so URLs and prefixes are turned into keys the same way
+        if kind == "host":
+            return kind, value.strip().lower()
+        return kind, cacheKeyFor(value)
+
+    async def handleClient(self, reader, writer):
+        """
+        Answers one admin request and closes the connection.
+
+        Parameters:
+        reader (StreamReader): StreamReader object for reading from the admin client.
+        writer (StreamWriter): StreamWriter object for writing to the admin client.
+        """
+        try:
+            requestLine = (await asyncio.wait_for(reader.readline(), self.readTimeout)).decode("latin-1").split()
+
+            # Read and ignore the rest of the request head
+            while True:
+                line = await asyncio.wait_for(reader.readline(), self.readTimeout)
+                if not line.strip():
+                    break
+
+            if len(requestLine) != 3:
+                self.badRequests += 1
+                await self.respond(writer, "400 Bad Request", {"error": "Malformed request line"})
+            elif requestLine[0] != "POST":
+                self.badRequests += 1
+                await self.respond(writer, "405 Method Not Allowed", {"error": "Purges must be sent as a POST"})
+            else:
+                try:
+                    kind, value = self.parsePurge(requestLine[1])
+                except ValueError as e:
+                    self.badRequests += 1
+                    await self.respond(writer, "400 Bad Request", {"error": str(e)})
+                else:
+                    self.purges += 1
+                    result = await self.proxy.purge(kind, value)
+                    await self.respond(writer, "200 OK", {"kind": kind, "value": value, **result})
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            logging.error(f"ERROR: Failed to answer an admin request! {e!r}")
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def respond(writer: asyncio.StreamWriter, status: str, body: dict):
+        """
+        Sends a JSON response.
+
+        Parameters:
+        writer (StreamWriter): StreamWriter object for writing to the admin client.
+        status (str): The status code and reason, for example '200 OK'
+        body (dict): The response body, sent as JSON.
+        """
+        payload = json.dumps(body).encode("utf-8")
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode("utf-8") + payload)
+        await writer.drain()
+
+    def stats(self) -> dict:
+        """
+        Returns the counters for the admin interface.
+
+        Returns:
+        stats (dict): How many purges were run and how many admin requests were rejected.
+        """
+        return {
+            "purges": self.purges,
+            "badRequests": self.badRequests,
+        }
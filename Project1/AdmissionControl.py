@@ -0,0 +1,106 @@
+# Maslin Farrell
+# Computer Networks Project 1
+import asyncio
+import collections
+
+
+class AdmissionControl:
+    """
+    Caps how many requests the proxy works on at once so it degrades predictably under overload instead of collapsing.
+    Requests over the cap wait in a bounded queue for a slot, in arrival order.
+    Once the queue is full, or a request has waited too long, the request is rejected so the client can be sent a 503 right away.
+    """
+
+    def __init__(self, maxInFlight: int = 1000, maxQueued: int = 1000, queueTimeout: float = 5.0):
+        """
+        Parameters:
+        maxInFlight (int): The most requests we work on at once.
+        maxQueued (int): The most requests that may wait for a slot, any more are rejected straight away.
+        queueTimeout (float): How many seconds a request may wait for a slot before it is rejected.
+        """
+        self.maxInFlight = maxInFlight
+        self.maxQueued = maxQueued
+        self.queueTimeout = queueTimeout
+
+        self.active = 0
+
+        # Futures for the requests waiting for a slot, the oldest is at the front
+        self.waiters = collections.deque()
+
+        # Counters for how requests were admitted or rejected
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timedOut = 0
+
+    async def acquire(self) -> bool:
+        """
+        Takes a slot for a request, waiting in the queue if every slot is taken.
+
+        Returns:
+        bool: True if the request was admitted and must call release when it is done; False if it was rejected.
+        """
+        if self.active < self.maxInFlight and not self.waiters:
+            self.active += 1
+            self.admitted += 1
+            return True
+
+        if len(self.waiters) >= self.maxQueued:
+            self.rejected += 1
+            return False
+
+        # The slot is handed over by release, so the request that was admitted owns it as soon as the future is done
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queueTimeout)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # A slot was handed to us just as we gave up on it, so use it
+                self.admitted += 1
+                return True
+            waiter.cancel()
+            self.waiters.remove(waiter)
+            self.timedOut += 1
+            self.rejected += 1
+            return False
+        except asyncio.CancelledError:
+            # Pass on a slot that was handed to us while we were being cancelled
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+                self.waiters.remove(waiter)
+            raise
+
+        self.admitted += 1
+        return True
+
+    def release(self):
+        """
+        Gives a request's slot back, handing it straight to the oldest waiting request if there is one.
+        """
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        """
+        Returns the counters for admission control.
+
+        Returns:
+        stats (dict): Admitted, queued, rejected and timed out requests, and how many requests are active and waiting right now.
+        """
+        return {
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timedOut": self.timedOut,
+            "active": self.active,
+            "waiting": len(self.waiters),
+            "maxInFlight": self.maxInFlight,
+        }
@@ -0,0 +1,204 @@
+# Maslin Farrell
+# Computer Networks Project 1
+import asyncio
+import logging
+import time
+
+from CacheIndex import CacheIndex
+from MemoryCache import MemoryCache
+
+
+class CacheEvictor:
+    """
+    Keeps the disk cache under a total-bytes and entry-count quota by evicting files in the background.
+    Files are picked by LRU (oldest last access) or LFU (fewest accesses, oldest last access breaking ties).
+    The victims are chosen and the files deleted in a worker thread so a sweep never blocks request handling on the event loop.
+    """
+
+    POLICIES = ("lru", "lfu")
+
+    def __init__(self, cacheIndex: CacheIndex, memoryCache: MemoryCache, maxBytes: int, maxEntries: int,
+                 policy: str = "lru", interval: float = 30.0, lowWatermark: float = 0.9, sharedCache: bool = False):
+        """
+        Parameters:
+        cacheIndex (CacheIndex): The index of the disk cache we are keeping under quota.
+        memoryCache (MemoryCache): The memory tier, evicted files are dropped from it as well.
+        maxBytes (int): The most bytes the disk cache may hold.
+        maxEntries (int): The most files the disk cache may hold.
+        policy (str): Either 'lru' or 'lfu'.
+        interval (float): How many seconds we wait between sweeps.
+        lowWatermark (float): Once over quota we evict down to this fraction of it, so we don't have to sweep again right away.
+        sharedCache (bool): True if other processes write to the same cache directory, the index is synced with the disk before every sweep.
+        Workers that share the directory but don't evict sync their index on the same interval with runSync.
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown eviction policy {policy}, expected one of {', '.join(self.POLICIES)}")
+
+        self.cacheIndex = cacheIndex
+        self.memoryCache = memoryCache
+        self.maxBytes = maxBytes
+        self.maxEntries = maxEntries
+        self.policy = policy
+        self.interval = interval
+        self.lowWatermark = lowWatermark
+        self.sharedCache = sharedCache
+
+        # Counters for how much the evictor has done
+        self.sweeps = 0
+        self.evictions = 0
+        self.bytesReclaimed = 0
+        self.lastSweepBytes = 0
+        self.syncs = 0
+        self.filesGone = 0
+
+    def overQuota(self) -> bool:
+        """
+        Checks if the disk cache is over either of its quotas.
+
+        Returns:
+        bool: True if we need to evict; False otherwise.
+        """
+        return self.cacheIndex.totalBytes > self.maxBytes or len(self.cacheIndex.entries) > self.maxEntries
+
+    def selectVictims(self, snapshot: list, bytesToFree: int, entriesToFree: int) -> list:
+        """
+        Picks the files to evict from a snapshot of the index. This runs in a worker thread.
+
+        Parameters:
+        snapshot (list): (digest, CacheEntry) pairs copied out of the index.
+        bytesToFree (int): How many bytes we need to reclaim.
+        entriesToFree (int): How many files we need to remove.
+
+        Returns:
+        victims (list): The (digest, CacheEntry) pairs to evict, coldest first.
+        """
+        if self.policy == "lfu":
+            rank = lambda item: (item[1].accessCount, item[1].lastAccess)
+        else:
+            rank = lambda item: item[1].lastAccess
+
+        victims = []
+        freedBytes = 0
+
+        # Walk the entries coldest first until both quotas are satisfied
+        for item in sorted(snapshot, key=rank):
+            if freedBytes >= bytesToFree and len(victims) >= entriesToFree:
+                break
+            victims.append(item)
+            freedBytes += item[1].size
+
+        return victims
+
+    def deleteFiles(self, victims: list):
+        """
+        Deletes the body and metadata of every evicted file. This runs in a worker thread.
+
+        Parameters:
+        victims (list): The (digest, CacheEntry) pairs that were evicted.
+        """
+        for _, entry in victims:
+            try:
+                self.cacheIndex.deleteStored(entry)
+            except OSError as e:
+                logging.error(f"ERROR: Failed to delete an evicted file from the cache! {e}")
+
+    async def sync(self):
+        """
+        Brings the index up to date with the files other processes sharing the cache directory wrote or deleted.
+        Files that are gone are dropped from the memory tier as well, so no tier keeps serving a file the evicting worker removed.
+        """
+        known = dict(self.cacheIndex.entries)
+        scanned = await asyncio.to_thread(self.cacheIndex.scan)
+        removed = self.cacheIndex.merge(scanned, known)
+        for entry in removed:
+            if entry.key is not None:
+                self.memoryCache.remove(entry.key)
+        self.syncs += 1
+        self.filesGone += len(removed)
+
+    async def sweep(self) -> int:
+        """
+        Evicts files until the disk cache is back under its low watermark.
+
+        Returns:
+        reclaimed (int): How many bytes this sweep freed.
+        """
+        self.sweeps += 1
+        self.lastSweepBytes = 0
+
+        # Other workers only write to the disk, so pick up their files before checking the quota
+        if self.sharedCache:
+            await self.sync()
+
+        if not self.overQuota():
+            return 0
+
+        startTime = time.perf_counter()
+        bytesToFree = self.cacheIndex.totalBytes - int(self.maxBytes * self.lowWatermark)
+        entriesToFree = len(self.cacheIndex.entries) - int(self.maxEntries * self.lowWatermark)
+
+        # Copy the index on the loop, then do the sorting in a thread so requests keep being served
+        snapshot = list(self.cacheIndex.entries.items())
+        victims = await asyncio.to_thread(self.selectVictims, snapshot, bytesToFree, entriesToFree)
+
+        # Drop the victims from the index first so no new request can find them, skipping any that were rewritten in the meantime
+        evicted = []
+        for digest, entry in victims:
+            if self.cacheIndex.entries.get(digest) is entry:
+                self.cacheIndex.removeDigest(digest)
+                if entry.key is not None:
+                    self.memoryCache.remove(entry.key)
+                evicted.append((digest, entry))
+
+        await asyncio.to_thread(self.deleteFiles, evicted)
+
+        reclaimed = sum(entry.size for _, entry in evicted)
+        self.evictions += len(evicted)
+        self.bytesReclaimed += reclaimed
+        self.lastSweepBytes = reclaimed
+
+        logging.info(f"Cache eviction ({self.policy}) removed {len(evicted)} files and reclaimed {reclaimed} bytes in {(time.perf_counter() - startTime) * 1000:.1f}ms")
+        return reclaimed
+
+    async def run(self):
+        """
+        Runs a sweep every interval seconds, forever. This is started as a background task by the proxy.
+        """
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logging.error(f"ERROR: Cache eviction sweep failed! {e}")
+            await asyncio.sleep(self.interval)
+
+    async def runSync(self):
+        """
+        Syncs the index with the disk every interval seconds, forever.
+        This is started as a background task instead of run by the workers sharing a cache directory that don't evict.
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                logging.error(f"ERROR: Syncing the cache index with the disk failed! {e}")
+
+    def stats(self) -> dict:
+        """
+        Returns the counters for the evictor.
+
+        Returns:
+        stats (dict): How many sweeps ran, how many files were evicted, how many bytes were reclaimed in total and by the last sweep,
+        and how many times the index was synced with a shared cache directory and how many files were found gone.
+        """
+        return {
+            "policy": self.policy,
+            "sweeps": self.sweeps,
+            "evictions": self.evictions,
+            "bytesReclaimed": self.bytesReclaimed,
+            "lastSweepBytes": self.lastSweepBytes,
+            "syncs": self.syncs,
+            "filesGone": self.filesGone,
+            "maxBytes": self.maxBytes,
+            "maxEntries": self.maxEntries,
+        }
@@ -0,0 +1,500 @@
+# Maslin Farrell
+# Computer Networks Project 1
+import hashlib
+import json
+import os
+import time
+
+from pathlib import Path
+
+from PrefixIndex import PrefixIndex
+
+
+class ReplacedFileError(FileNotFoundError):
+    """
+    Raised when the file on disk is no longer the one an index entry describes, because another worker sharing the cache replaced it.
+    It counts as the file being missing, the entry's body is gone even though the path still exists.
+    """
+
+
+def fileIdentity(stat: os.stat_result) -> tuple:
+    """
+    Picks out what changes when a cached file is replaced, a rename keeps all of it so the temporary file's stat can be taken before the rename.
+
+    Parameters:
+    stat (stat_result): The result of stat or fstat on the file.
+
+    Returns:
+    identity (tuple): The inode, size and modification time in nanoseconds.
+    """
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class CacheEntry:
+    """
+    Everything the index knows about a single file in the disk cache.
+    """
+
+    def __init__(self, path: Path, size: int, storedTime: float, headers: dict = None, key: str = None,
+                 storedEncoding: str = None, identitySize: int = None, segment: int = None, offset: int = 0, fileStat: tuple = None):
+        """
+        Parameters:
+        path (Path): Where the cached body is stored on disk, the segment file for a body packed into a segment.
+        size (int): The size of the cached body on disk in bytes.
+        storedTime (float): When the body was stored or last revalidated, as a unix timestamp.
+        headers (dict): The origin headers stored next to the body, used for freshness and revalidation.
+        key (str): The cache key, None for files that were loaded without metadata.
+        storedEncoding (str): 'gzip' if we compressed the body when storing it, None if it is stored as the origin sent it.
+        identitySize (int): The size of the body once decompressed, the same as size when it isn't compressed.
+        segment (int): The segment the body is packed into, None if it has a file of its own.
+        offset (int): Where the body starts in its file, always 0 for a file of its own.
+        fileStat (tuple): The fileIdentity of the body's own file, None for a body in a segment.
+        """
+        self.path = path
+        self.size = size
+        self.storedTime = storedTime
+        self.headers = headers if headers is not None else {}
+        self.key = key
+        self.storedEncoding = storedEncoding
+        self.identitySize = identitySize if identitySize is not None else size
+        self.segment = segment
+        self.offset = offset
+        self.fileStat = fileStat
+
+        # Access tracking used by the evictor for LRU and LFU
+        self.lastAccess = storedTime
+        self.accessCount = 0
+
+    def touch(self):
+        """
+        Records an access to this entry.
+        """
+        self.lastAccess = time.time()
+        self.accessCount += 1
+
+    def matches(self, stat: os.stat_result) -> bool:
+        """
+        Checks that an opened file is still the body this entry describes.
+        Segments are only ever appended to, so a body in a segment can't change under its entry.
+
+        Parameters:
+        stat (stat_result): The fstat of the opened file.
+
+        Returns:
+        bool: True if the file holds this entry's body; False if it was replaced.
+        """
+        if self.segment is not None:
+            return True
+        if self.fileStat is None:
+            return stat.st_size == self.size
+        return fileIdentity(stat) == self.fileStat
+
+    def movedTo(self, path: Path, segment: int, offset: int):
+        """
+        Builds a copy of this entry for its body at a new location, keeping its access history.
+        Entries are never moved in place, a reader that already looked one up keeps reading the body where it was.
+
+        Parameters:
+        path (Path): The file the body was moved to.
+        segment (int): The segment the body was moved to.
+        offset (int): Where the body starts in its new segment.
+
+        Returns:
+        entry (CacheEntry): The entry for the moved body.
+        """
+        moved = CacheEntry(path, self.size, self.storedTime, self.headers, self.key, self.storedEncoding, self.identitySize, segment, offset)
+        moved.lastAccess = self.lastAccess
+        moved.accessCount = self.accessCount
+        return moved
+
+    @property
+    def metaPath(self) -> Path:
+        """
+        Where the metadata for this entry is stored, next to the body with a '.meta' suffix.
+        """
+        return self.path.with_name(self.path.name + ".meta")
+
+
+class CacheIndex:
+    """
+    In-memory index of the disk cache so cache lookups never have to touch the disk.
+    Files are stored under hash-sharded names, '.cache/ab/cd/abcd...' where the name is the sha256 of the cache key.
+    This keeps every directory small no matter how many files come from one host or how long the paths are.
+    Each body has a JSON '.meta' file next to it holding the cache key, the stored origin headers and the stored time.
+    The index is built once at startup by scanning the cache and is kept up to date as we write to it.
+    With a SegmentStore small bodies are packed into segments instead, and the index is loaded from the store's journal rather than a scan.
+    """
+
+    def __init__(self, cacheDir: str = ".cache", segments=None):
+        """
+        Parameters:
+        cacheDir (str): The directory the cache is stored in.
+        segments (SegmentStore): The store small bodies are packed into, or None to give every body its own file.
+        """
+        self.cacheDir = Path(cacheDir)
+        self.segments = segments
+
+        # Maps the sha256 of the cache key to its CacheEntry
+        self.entries = {}
+        self.totalBytes = 0
+
+        # The cache keys as a trie over the host and path, so purges find the keys under a prefix without a full scan
+        self.prefixes = PrefixIndex()
+
+        # How long the last startup scan took in seconds
+        self.buildTime = 0.0
+
+    @staticmethod
+    def digest(key: str) -> str:
+        """
+        Hashes a cache key into the name of its file.
+
+        Parameters:
+        key (str): The cache key, the host and path of the requested URL.
+
+        Returns:
+        digest (str): The hex sha256 of the key.
+        """
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def pathFor(self, key: str) -> Path:
+        """
+        Builds the location of a cache key's file on disk.
+        The first two pairs of hex digits are used as directories, giving 65536 shards.
+
+        Parameters:
+        key (str): The cache key, the host and path of the requested URL.
+
+        Returns:
+        path (Path): The location of the file for this key.
+        """
+        digest = self.digest(key)
+        return self.cacheDir / digest[0:2] / digest[2:4] / digest
+
+    def build(self):
+        """
+        Scans the cache directory and loads every cached file and its metadata into the index, or replays the segment store's journal.
+        This is blocking, so it is meant to be run in a thread before we start serving.
+        """
+        startTime = time.perf_counter()
+
+        if self.segments is not None:
+            self.entries = {self.digest(entry.key): entry for entry in self.segments.load(self.pathFor)}
+        else:
+            self.entries = self.scan()
+        self.totalBytes = sum(entry.size for entry in self.entries.values())
+
+        self.prefixes.clear()
+        for entry in self.entries.values():
+            if entry.key is not None:
+                self.prefixes.add(entry.key)
+
+        self.buildTime = time.perf_counter() - startTime
+
+    def scan(self) -> dict:
+        """
+        Loads every cached file and its metadata from the cache directory without changing the index.
+        This is blocking, so it is meant to be run in a thread.
+        Only the hash-sharded layout is picked up, anything else under the cache directory is ignored.
+
+        Returns:
+        entries (dict): Maps the sha256 of each cache key to its CacheEntry.
+        """
+        entries = {}
+        if self.cacheDir.is_dir():
+            for firstShard in os.scandir(self.cacheDir):
+                if not self.isShard(firstShard):
+                    continue
+                for secondShard in os.scandir(firstShard.path):
+                    if not self.isShard(secondShard):
+                        continue
+                    for file in os.scandir(secondShard.path):
+                        # Skip anything that isn't one of our files, for example a temporary file that is still being written
+                        if not file.is_file() or len(file.name) != 64 or not file.name.startswith(firstShard.name + secondShard.name):
+                            continue
+                        entry = self.loadEntry(Path(file.path))
+                        if entry is not None:
+                            entries[file.name] = entry
+        return entries
+
+    @staticmethod
+    def loadEntry(path: Path):
+        """
+        Loads a single cached file and its metadata from the disk. This is blocking.
+        Files without metadata are loaded with no headers and their modification time as the stored time, as are files whose metadata is for an older body.
+
+        Parameters:
+        path (Path): Where the cached body is stored on disk.
+
+        Returns:
+        entry (CacheEntry): The entry for the file, or None if the file doesn't exist.
+        """
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        entry = CacheEntry(path, stat.st_size, stat.st_mtime, fileStat=fileIdentity(stat))
+
+        try:
+            with open(entry.metaPath, 'rb') as metaFile:
+                metadata = json.load(metaFile)
+
+            # The body is renamed into place before its metadata, so for a moment the metadata can belong to the body that was replaced
+            if "fileStat" in metadata and tuple(metadata["fileStat"]) != entry.fileStat:
+                return entry
+            entry.headers = metadata.get("headers", {})
+            entry.storedTime = metadata.get("storedTime", entry.storedTime)
+            entry.key = metadata.get("key")
+            entry.storedEncoding = metadata.get("storedEncoding")
+            entry.identitySize = metadata.get("identitySize", entry.size)
+        except (OSError, ValueError):
+            pass
+
+        return entry
+
+    def loadKey(self, key: str):
+        """
+        Loads a cache key's file from the disk if another process wrote it. This is blocking, so it is meant to be run in a thread.
+        The index isn't changed, the caller adds the entry with insert.
+
+        Parameters:
+        key (str): The cache key, the host and path of the requested URL.
+
+        Returns:
+        entry (CacheEntry): The entry for the key, or None if it isn't on disk or its metadata belongs to another key.
+        """
+        entry = self.loadEntry(self.pathFor(key))
+        if entry is None or entry.key != key:
+            return None
+        return entry
+
+    def insert(self, entry: CacheEntry):
+        """
+        Adds an entry that was loaded from the disk, unless we already know about its file.
+
+        Parameters:
+        entry (CacheEntry): The entry loaded by scan or loadKey.
+
+        Returns:
+        entry (CacheEntry): The entry now in the index for this file.
+        """
+        digest = entry.path.name
+        existing = self.entries.get(digest)
+        if existing is not None:
+            return existing
+        self.entries[digest] = entry
+        self.totalBytes += entry.size
+        if entry.key is not None:
+            self.prefixes.add(entry.key)
+        return entry
+
+    def merge(self, scanned: dict, known: dict):
+        """
+        Brings the index up to date with a scan of the disk, for when other processes share the cache directory.
+        Files written by other processes are added, files they rewrote replace our entries and files they deleted are dropped.
+        Entries we added or rewrote ourselves while the scan ran are kept, the scan may simply have missed them.
+
+        Parameters:
+        scanned (dict): The entries returned by scan.
+        known (dict): A copy of the index entries taken just before the scan started.
+
+        Returns:
+        removed (list): The entries that were dropped because their files are gone.
+        """
+        for digest, entry in scanned.items():
+            existing = self.entries.get(digest)
+
+            # Another process replaced a file we knew about, a file whose new metadata isn't in place yet waits for the next scan
+            if existing is not None and existing is known.get(digest) and existing.segment is None \
+                    and entry.key is not None and entry.fileStat != existing.fileStat:
+                entry.lastAccess = existing.lastAccess
+                entry.accessCount = existing.accessCount
+                self.removeDigest(digest)
+            self.insert(entry)
+
+        removed = []
+        for digest, entry in known.items():
+            if digest not in scanned and self.entries.get(digest) is entry:
+                self.removeDigest(digest)
+                removed.append(entry)
+        return removed
+
+    @staticmethod
+    def isShard(entry: os.DirEntry) -> bool:
+        """
+        Checks if a directory entry is one of our two hex digit shard directories.
+
+        Parameters:
+        entry (DirEntry): The directory entry from os.scandir.
+
+        Returns:
+        bool: True if this is a shard directory; False otherwise.
+        """
+        return entry.is_dir() and len(entry.name) == 2 and all(c in "0123456789abcdef" for c in entry.name)
+
+    def lookup(self, key: str):
+        """
+        Looks up a cache key without touching the disk.
+
+        Parameters:
+        key (str): The cache key, the host and path of the requested URL.
+
+        Returns:
+        entry (CacheEntry): The entry for this key, or None if it isn't cached.
+        """
+        return self.entries.get(self.digest(key))
+
+    def add(self, key: str, size: int, headers: dict = None, storedTime: float = None,
+            storedEncoding: str = None, identitySize: int = None, segment: int = None, offset: int = 0, fileStat: tuple = None) -> CacheEntry:
+        """
+        Records a file that was just written or revalidated.
+
+        Parameters:
+        key (str): The cache key, the host and path of the requested URL.
+        size (int): The size of the cached body on disk in bytes.
+        headers (dict): The origin headers stored next to the body.
+        storedTime (float): When the response was stored, defaults to now.
+        storedEncoding (str): 'gzip' if we compressed the body when storing it.
+        identitySize (int): The size of the body once decompressed.
+        segment (int): The segment the body was packed into, None if it has a file of its own.
+        offset (int): Where the body starts in its segment.
+        fileStat (tuple): The fileIdentity of the body's own file, None for a body in a segment.
+
+        Returns:
+        entry (CacheEntry): The new entry.
+        """
+        # A revalidated entry keeps its access history
+        previous = self.lookup(key)
+        self.remove(key)
+
+        path = self.segments.segmentPath(segment) if segment is not None else self.pathFor(key)
+        entry = CacheEntry(path, size, storedTime if storedTime is not None else time.time(), headers, key,
+                           storedEncoding, identitySize, segment, offset, fileStat)
+        if previous is not None:
+            entry.lastAccess = previous.lastAccess
+            entry.accessCount = previous.accessCount
+        self.entries[self.digest(key)] = entry
+        self.totalBytes += size
+        self.prefixes.add(key)
+        return entry
+
+    @staticmethod
+    def serializeMetadata(key: str, entry: CacheEntry) -> bytes:
+        """
+        Builds the contents of an entry's '.meta' file.
+
+        Parameters:
+        key (str): The cache key, the host and path of the requested URL.
+        entry (CacheEntry): The entry to serialize.
+
+        Returns:
+        metadata (bytes): The JSON metadata.
+        """
+        metadata = {
+            "key": key,
+            "storedTime": entry.storedTime,
+            "headers": entry.headers,
+            "storedEncoding": entry.storedEncoding,
+            "identitySize": entry.identitySize,
+        }
+
+        # Records which body the metadata is for, so a worker loading it can tell if the body was replaced since
+        if entry.fileStat is not None:
+            metadata["fileStat"] = list(entry.fileStat)
+        return json.dumps(metadata).encode("utf-8")
+
+    @staticmethod
+    def openBody(entry: CacheEntry):
+        """
+        Opens the file holding an entry's body and checks that it is still the body the entry describes. This is blocking.
+
+        Parameters:
+        entry (CacheEntry): The cache index entry for the file.
+
+        Returns:
+        file (file): The file, opened for reading in binary mode.
+
+        Raises:
+        FileNotFoundError: If the file is gone.
+        ReplacedFileError: If another worker replaced the file since the entry was loaded.
+        """
+        file = open(entry.path, 'rb')
+        if not entry.matches(os.fstat(file.fileno())):
+            file.close()
+            raise ReplacedFileError(f"Cached file {entry.path} was replaced")
+        return file
+
+    def deleteStored(self, entry: CacheEntry):
+        """
+        Deletes the body and metadata of an entry that was removed from the index. This is blocking.
+        A body packed into a segment is only marked as dead space, the compactor reclaims it later.
+
+        Parameters:
+        entry (CacheEntry): The removed entry.
+        """
+        if self.segments is not None:
+            self.segments.forget(entry)
+        else:
+            entry.path.unlink(missing_ok=True)
+            entry.metaPath.unlink(missing_ok=True)
+
+    def replace(self, entry: CacheEntry):
+        """
+        Swaps an entry for one with the same key and body at a different location, for example when the compactor moved the body.
+
+        Parameters:
+        entry (CacheEntry): The entry to index in place of the current one for its key.
+        """
+        self.entries[self.digest(entry.key)] = entry
+
+    def remove(self, key: str):
+        """
+        Removes a cache key from the index, the file itself is left for the caller to delete.
+
+        Parameters:
+        key (str): The cache key, the host and path of the requested URL.
+        """
+        self.removeDigest(self.digest(key))
+
+    def find(self, kind: str, value: str) -> list:
+        """
+        Finds the entries a purge removes using the prefix index, files loaded without metadata have no key and are never found.
+
+        Parameters:
+        kind (str): 'url', 'prefix' or 'host'.
+        value (str): The cache key, key prefix or host name.
+
+        Returns:
+        entries (list): (digest, CacheEntry) pairs for the matching entries.
+        """
+        found = []
+        for key in self.prefixes.find(kind, value):
+            digest = self.digest(key)
+            found.append((digest, self.entries[digest]))
+        return found
+
+    def removeDigest(self, digest: str):
+        """
+        Removes an entry from the index by the hash of its key, for entries whose key we don't know.
+
+        Parameters:
+        digest (str): The hex sha256 of the cache key.
+        """
+        entry = self.entries.pop(digest, None)
+        if entry is not None:
+            self.totalBytes -= entry.size
+            if entry.key is not None:
+                self.prefixes.remove(entry.key)
+
+    def stats(self) -> dict:
+        """
+        Returns the size of the index.
+
+        Returns:
+        stats (dict): The number of entries, the total bytes on disk and how long the startup scan took.
+        """
+        return {
+            "entries": len(self.entries),
+            "bytes": self.totalBytes,
+            "buildTime": self.buildTime,
+        }
@@ -0,0 +1,122 @@
+# Maslin Farrell
+# Computer Networks Project 1
+import asyncio
+import collections
+import logging
+import re
+import time
+
+
+# Finds the requested URL in a URL list line, one of our own log lines or a common log format line
+URL_PATTERN = re.compile(r'(?:^|\s|")(http://[^\s"]+)')
+
+
+class CacheWarmer:
+    """
+    Fills a cold cache from a list of URLs, so the first wave of traffic after a restart doesn't all go to the origins.
+    The list can be a plain file of URLs or a previous node's access log, in which case the most requested URLs are warmed first.
+    A fixed number of fetches run at once so warming can't flood the origins or starve the clients being served alongside it.
+    """
+
+    def __init__(self, proxy, concurrency: int = 8):
+        """
+        Parameters:
+        proxy (Proxy): The proxy whose cache is being warmed.
+        concurrency (int): The most URLs fetched at once.
+        """
+        self.proxy = proxy
+        self.concurrency = concurrency
+
+        # Counters for how each URL was warmed
+        self.total = 0
+        self.fetched = 0
+        self.alreadyCached = 0
+        self.failed = 0
+        self.elapsed = 0.0
+        self.running = False
+
+    @staticmethod
+    def loadUrls(path: str) -> list:
+        """
+        Reads the URLs to warm from a file, one per line. Lines from an access log work too, the URL is picked out of the line.
+
+        Parameters:
+        path (str): The URL list or access log.
+
+        Returns:
+        urls (list): Each URL once, the most often listed first and otherwise in the order they first appear.
+        """
+        counts = collections.Counter()
+        with open(path) as urlFile:
+            for line in urlFile:
+                match = URL_PATTERN.search(line)
+                if match is not None:
+                    counts[match.group(1)] += 1
+
+        # Counter keeps the order URLs were first seen in and sorted is stable, so ties stay in file order
+        return sorted(counts, key=counts.get, reverse=True)
+
+    async def warm(self, urls: list):
+        """
+        Fetches every URL into the cache that isn't already fresh in it, with at most concurrency fetches running at once.
+
+        Parameters:
+        urls (list): The URLs to warm.
+        """
+        self.total += len(urls)
+        self.running = True
+        startTime = time.perf_counter()
+
+        queue = asyncio.Queue()
+        for url in urls:
+            queue.put_nowait(url)
+
+        workers = [asyncio.create_task(self.worker(queue)) for _ in range(min(self.concurrency, len(urls)))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.running = False
+            self.elapsed += time.perf_counter() - startTime
+
+        logging.info(f"Warmed the cache with {self.fetched} of {len(urls)} URLs in {self.elapsed:.1f}s, "
+                     f"{self.alreadyCached} were already cached and {self.failed} failed")
+
+    async def worker(self, queue: asyncio.Queue):
+        """
+        Takes URLs off the queue and fetches them one at a time until the queue is empty.
+
+        Parameters:
+        queue (Queue): The URLs still to warm.
+        """
+        while not queue.empty():
+            url = queue.get_nowait()
+            try:
+                result = await self.proxy.prefetch(url)
+            except Exception as e:
+                logging.error(f"ERROR: Failed to warm {url}! {e}")
+                result = None
+
+            if result is None:
+                self.failed += 1
+            elif result:
+                self.fetched += 1
+            else:
+                self.alreadyCached += 1
+
+    def stats(self) -> dict:
+        """
+        Returns the counters for cache warming.
+
+        Returns:
+        stats (dict): How many URLs were listed, fetched, already cached and failed, and how long warming took.
+        """
+        return {
+            "total": self.total,
+            "fetched": self.fetched,
+            "alreadyCached": self.alreadyCached,
+            "failed": self.failed,
+            "elapsedSeconds": self.elapsed,
+            "running": self.running,
+        }
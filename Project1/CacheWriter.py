@@ -0,0 +1,437 @@
+# Maslin Farrell
+# Computer Networks Project 1
+import asyncio
+import logging
+import os
+import time
+from pathlib import Path
+
+from CacheIndex import fileIdentity
+
+
+class CacheWrite:
+    """
+    A single body being written to the cache in the background.
+    The body goes to a temporary file that is renamed over the cache file once it is complete, so a reader never sees a partial file.
+    With a segment store, a body small enough for a segment is buffered instead and appended to a segment in one go once it is complete.
+    """
+
+    def __init__(self, key: str, path: Path, queue: asyncio.Queue, compressor=None, segmentLimit: int = 0):
+        """
+        Parameters:
+        key (str): The cache key for the file.
+        path (Path): Where the file is stored in the cache.
+        queue (Queue): The queue of the writer task this body is handed to, every chunk of a body goes through the same one.
+        compressor: A zlib compressor for compressed-at-rest bodies, or None to store the body as-is.
+        segmentLimit (int): The largest stored body that is buffered for a segment, 0 to always write a file.
+        """
+        self.key = key
+        self.path = path
+        self.queue = queue
+
+        # Named after our pid so workers sharing the cache never write to the same temporary file
+        self.tempPath = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        self.compressor = compressor
+        self.file = None
+
+        # The stored body while it still fits in a segment, None once it has gone to a file instead
+        self.segmentLimit = segmentLimit
+        self.buffer = bytearray() if segmentLimit > 0 else None
+
+        # Where the body was appended, if it went to a segment, or the fileIdentity of its own file
+        self.segment = None
+        self.offset = 0
+        self.fileStat = None
+
+        # Filled in as the body arrives and when it is finished
+        self.headers = None
+        self.storedTime = None
+        self.bodyBytes = 0
+        self.storedBytes = 0
+
+        # A copy of the stored body for the memory tier, dropped once it is too big to be admitted
+        self.memoryChunks = []
+
+        # How long the writer spent on this file, for the cacheWrite metric
+        self.writeTime = 0.0
+
+        # ended is set once the end of the body has been queued, dropped if we gave up on writing it
+        self.ended = False
+        self.complete = False
+        self.dropped = False
+        self.committed = False
+
+        # Set once the file has been committed or thrown away
+        self.finished = asyncio.Event()
+        self.doneCallbacks = []
+
+    def onDone(self, callback):
+        """
+        Calls a function once the write has been committed or thrown away, straight away if it already has been.
+
+        Parameters:
+        callback (function): Called with no arguments.
+        """
+        if self.finished.is_set():
+            callback()
+        else:
+            self.doneCallbacks.append(callback)
+
+    async def wait(self) -> bool:
+        """
+        Waits until the write has been committed or thrown away.
+
+        Returns:
+        bool: True if the file is now in the cache; False otherwise.
+        """
+        await self.finished.wait()
+        return self.committed
+
+
+class CacheWriter:
+    """
+    Write-behind persistence for the disk cache, so clients never wait on mkdir, open or a disk write.
+    Bodies are handed over chunk by chunk and queued, a few background tasks write them out and commit each file with an atomic rename.
+    Each body is given to one task, so its chunks are written in order while other bodies are written and committed alongside it.
+    The queue is bounded by the bytes waiting to be written and by the number of files being written.
+    When it is full the write is dropped rather than making the origin fetch, and so the clients, wait for the disk.
+    """
+
+    def __init__(self, onCommit, admits, maxQueuedBytes: int = 64 * 1024 * 1024, maxPendingWrites: int = 1000, segments=None, writers: int = 4):
+        """
+        Parameters:
+        onCommit (coroutine function): Called with the CacheWrite the moment its file is in place, it must add the file to the index before its first await.
+        admits (function): Tells us if a stored body of a given size would be kept by the memory tier.
+        maxQueuedBytes (int): The most body bytes waiting to be written, a write that would go over is dropped.
+        maxPendingWrites (int): The most files being written at once, a new write over the limit is dropped.
+        segments (SegmentStore): The store small bodies are packed into, or None to give every body its own file.
+        writers (int): How many bodies are written at once.
+        """
+        self.onCommit = onCommit
+        self.segments = segments
+        self.admits = admits
+        self.maxQueuedBytes = maxQueuedBytes
+        self.maxPendingWrites = maxPendingWrites
+
+        # Chunks waiting to be written as (write, chunk), a chunk of None ends the write
+        # Each writer task works through its own queue in order, so the chunks of a file are always written in order
+        self.queues = [asyncio.Queue() for _ in range(writers)]
+        self.queuedBytes = 0
+        self.pending = 0
+        self.tasks = []
+
+        # Counters for what happened to each write
+        self.started = 0
+        self.committed = 0
+        self.dropped = 0
+        self.aborted = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.peakQueuedBytes = 0
+
+    def begin(self, key: str, path: Path, compressor=None):
+        """
+        Starts writing a body to the cache.
+
+        Parameters:
+        key (str): The cache key for the file.
+        path (Path): Where the file is stored in the cache.
+        compressor: A zlib compressor for compressed-at-rest bodies, or None to store the body as-is.
+
+        Returns:
+        write (CacheWrite): The write to hand the body to, or None if too many files are being written already.
+        """
+        # Start the writers the first time they are needed
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self.run(queue)) for queue in self.queues]
+
+        if self.pending >= self.maxPendingWrites:
+            self.dropped += 1
+            return None
+
+        # Bodies are dealt out to the writers in turn
+        queue = self.queues[self.started % len(self.queues)]
+        self.pending += 1
+        self.started += 1
+        return CacheWrite(key, path, queue, compressor, self.segments.maxObjectBytes if self.segments is not None else 0)
+
+    def append(self, write: CacheWrite, chunk: bytes):
+        """
+        Queues the next chunk of a body, dropping the whole write if the queue is full.
+
+        Parameters:
+        write (CacheWrite): The write the chunk belongs to.
+        chunk (bytes): The next piece of the body as the origin sent it.
+        """
+        if write.dropped or write.ended:
+            return
+        write.bodyBytes += len(chunk)
+
+        if self.queuedBytes + len(chunk) > self.maxQueuedBytes:
+            # The disk isn't keeping up, so give up on this file rather than stall the fetch
+            write.dropped = True
+            self.dropped += 1
+            self.end(write)
+            return
+
+        self.queuedBytes += len(chunk)
+        self.peakQueuedBytes = max(self.peakQueuedBytes, self.queuedBytes)
+        write.queue.put_nowait((write, chunk))
+
+    def finish(self, write: CacheWrite, complete: bool, headers: dict = None, storedTime: float = None):
+        """
+        Marks the end of a body. A complete body is committed into the cache once it has been written, an incomplete one is thrown away.
+
+        Parameters:
+        write (CacheWrite): The write that is finished.
+        complete (bool): True if the whole body was received from the origin; False otherwise.
+        headers (dict): The response headers with lower-cased names.
+        storedTime (float): When the response was generated, as a unix timestamp.
+        """
+        write.complete = complete
+        write.headers = headers
+        write.storedTime = storedTime
+        self.end(write)
+
+    def cancel(self, write: CacheWrite):
+        """
+        Throws away a write whose key was purged, so the old body never makes it back into the cache.
+        A write that is being committed right now is taken back out of the store before it reaches the index.
+
+        Parameters:
+        write (CacheWrite): The write to throw away.
+        """
+        if write.dropped or write.committed:
+            return
+        write.dropped = True
+        self.cancelled += 1
+        self.end(write)
+
+    def end(self, write: CacheWrite):
+        """
+        Queues the end of a write, at most once.
+
+        Parameters:
+        write (CacheWrite): The write that is ending.
+        """
+        if not write.ended:
+            write.ended = True
+            write.queue.put_nowait((write, None))
+
+    async def run(self, queue: asyncio.Queue):
+        """
+        Writes out the queued chunks and commits or throws away each file when its end is reached.
+
+        Parameters:
+        queue (Queue): This writer's queue.
+        """
+        while True:
+            write, chunk = await queue.get()
+            if chunk is not None:
+                self.queuedBytes -= len(chunk)
+                if not write.dropped:
+                    await self.writeChunk(write, chunk)
+                continue
+
+            if write.complete and not write.dropped:
+                await self.commit(write)
+            else:
+                if not write.dropped:
+                    self.aborted += 1
+                await self.discard(write)
+
+            self.pending -= 1
+            write.finished.set()
+            for callback in write.doneCallbacks:
+                callback()
+
+    async def writeChunk(self, write: CacheWrite, chunk: bytes):
+        """
+        Writes one chunk to a file's temporary file in a worker thread, compressing it first for compressed-at-rest bodies.
+
+        Parameters:
+        write (CacheWrite): The write the chunk belongs to.
+        chunk (bytes): The chunk as the origin sent it.
+        """
+        startTime = time.perf_counter()
+        try:
+            storedChunk = await asyncio.to_thread(self.writeStored, write, chunk)
+        except Exception as e:
+            logging.error(f"ERROR: Failed to write to the cache file! {e}")
+            write.dropped = True
+            self.failed += 1
+            return
+        finally:
+            write.writeTime += time.perf_counter() - startTime
+        self.keepInMemory(write, storedChunk)
+
+    @staticmethod
+    def writeStored(write: CacheWrite, chunk: bytes) -> bytes:
+        """
+        Blocking part of writeChunk, run in a worker thread. The temporary file is created with the first chunk,
+        or once the body no longer fits in a segment.
+
+        Parameters:
+        write (CacheWrite): The write the chunk belongs to.
+        chunk (bytes): The chunk as the origin sent it, or b'' to just make sure the file exists.
+
+        Returns:
+        storedChunk (bytes): The chunk as it was written to disk.
+        """
+        storedChunk = write.compressor.compress(chunk) if write.compressor is not None else chunk
+        write.storedBytes += len(storedChunk)
+
+        # Keep buffering while the body still fits in a segment
+        if write.buffer is not None and write.storedBytes <= write.segmentLimit:
+            write.buffer += storedChunk
+            return storedChunk
+
+        if write.file is None:
+            write.path.parent.mkdir(parents=True, exist_ok=True)
+            write.file = open(write.tempPath, 'wb')
+            if write.buffer is not None:
+                write.file.write(write.buffer)
+                write.buffer = None
+        write.file.write(storedChunk)
+        return storedChunk
+
+    def keepInMemory(self, write: CacheWrite, storedChunk: bytes):
+        """
+        Keeps a copy of a stored chunk for the memory tier while the stored body is small enough to be admitted.
+
+        Parameters:
+        write (CacheWrite): The write the chunk belongs to.
+        storedChunk (bytes): The chunk as it was written to disk.
+        """
+        if write.memoryChunks is not None:
+            if self.admits(write.storedBytes):
+                write.memoryChunks.append(storedChunk)
+            else:
+                write.memoryChunks = None
+
+    async def commit(self, write: CacheWrite):
+        """
+        Flushes and closes a complete file and renames it into place, or appends it to a segment, then hands it to onCommit.
+        A file is renamed on the event loop right before onCommit runs, so no lookup can pair the new file with the entry for the old one.
+
+        Parameters:
+        write (CacheWrite): The write that is complete.
+        """
+        startTime = time.perf_counter()
+        try:
+            # A body that fit in a segment is appended to one, along with the end of the compressed stream
+            if write.buffer is not None:
+                if write.compressor is not None:
+                    storedChunk = write.compressor.flush()
+                    write.buffer += storedChunk
+                    write.storedBytes += len(storedChunk)
+                    self.keepInMemory(write, storedChunk)
+                write.segment, write.offset = await asyncio.to_thread(self.segments.append, bytes(write.buffer))
+                write.buffer = None
+            else:
+                storedChunk = await asyncio.to_thread(self.closeFile, write)
+                self.keepInMemory(write, storedChunk)
+
+                # The key was purged while the body was being written, so the file never replaces the one in the cache
+                if write.dropped:
+                    await self.discard(write)
+                    return
+
+                # Swap the new body in atomically, a reader that already opened the old file keeps reading it
+                # A rename is only a metadata change, and doing it here means onCommit updates the index before anything else runs
+                os.replace(write.tempPath, write.path)
+        except Exception as e:
+            logging.error(f"ERROR: Failed to move the new file into the cache! {e}")
+            self.failed += 1
+            await self.discard(write)
+            return
+        finally:
+            write.writeTime += time.perf_counter() - startTime
+
+        # The key was purged while the body was being stored, so take it back out instead of committing it
+        if write.dropped:
+            await self.unstore(write)
+            return
+
+        write.committed = True
+        self.committed += 1
+        try:
+            await self.onCommit(write)
+        except Exception as e:
+            logging.error(f"ERROR: Failed to record the new file in the cache index! {e}")
+
+    @staticmethod
+    def closeFile(write: CacheWrite) -> bytes:
+        """
+        Blocking part of committing a file, run in a single worker thread call: the end of the body is written, the file is closed and its stat is taken.
+
+        Parameters:
+        write (CacheWrite): The write that is complete.
+
+        Returns:
+        storedChunk (bytes): The end of the compressed stream that was written, b'' for a body stored as-is.
+        """
+        # An empty body still needs its file, and a compressor still holds the end of the stream
+        if write.file is None:
+            CacheWriter.writeStored(write, b'')
+        storedChunk = write.compressor.flush() if write.compressor is not None else b''
+        write.file.write(storedChunk)
+        write.storedBytes += len(storedChunk)
+        write.file.close()
+
+        # The rename keeps the inode and modification time, so this is the identity of the file once it is in place
+        write.fileStat = fileIdentity(os.stat(write.tempPath))
+        return storedChunk
+
+    async def unstore(self, write: CacheWrite):
+        """
+        Removes a body that was stored but never committed, from its segment or its file.
+
+        Parameters:
+        write (CacheWrite): The write being thrown away.
+        """
+        write.memoryChunks = None
+        try:
+            if write.segment is not None:
+                await asyncio.to_thread(self.segments.abandon, write.segment)
+            else:
+                await asyncio.to_thread(write.path.unlink, missing_ok=True)
+        except OSError as e:
+            logging.error(f"ERROR: Failed to remove a cancelled file from the cache! {e}")
+
+    async def discard(self, write: CacheWrite):
+        """
+        Closes and deletes the temporary file of a write we are throwing away, so a truncated body is never left in the cache.
+
+        Parameters:
+        write (CacheWrite): The write being thrown away.
+        """
+        write.memoryChunks = None
+        try:
+            if write.file is not None:
+                await asyncio.to_thread(write.file.close)
+            await asyncio.to_thread(write.tempPath.unlink, missing_ok=True)
+        except OSError as e:
+            logging.error(f"ERROR: Failed to remove a temporary cache file! {e}")
+
+    def stats(self) -> dict:
+        """
+        Returns the counters for the write-behind queue.
+
+        Returns:
+        stats (dict): Writes started, committed, dropped, aborted, failed and cancelled by purges, how many files and bytes are waiting to be written
+        and how many writer tasks there are.
+        """
+        return {
+            "started": self.started,
+            "committed": self.committed,
+            "dropped": self.dropped,
+            "aborted": self.aborted,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "pendingWrites": self.pending,
+            "writers": len(self.queues),
+            "queuedBytes": self.queuedBytes,
+            "peakQueuedBytes": self.peakQueuedBytes,
+            "maxQueuedBytes": self.maxQueuedBytes,
+        }
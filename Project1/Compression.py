@@ -0,0 +1,86 @@
+# Maslin Farrell
+# Computer Networks Project 1
+import zlib
+
+
+# Content types that are worth compressing, anything already compressed like images and archives is stored as-is
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/xml", "application/xhtml+xml", "image/svg+xml")
+
+# wbits value that makes zlib read and write the gzip format
+GZIP_WBITS = 31
+
+
+def isCompressible(headers: dict) -> bool:
+    """
+    Checks if a response body is worth compressing when we store it.
+
+    Parameters:
+    headers (dict): The origin response headers with lower-cased names.
+
+    Returns:
+    bool: True if the body is a text-like type and the origin didn't already encode it; False otherwise.
+    """
+    if headers.get("content-encoding", "identity").lower() != "identity":
+        return False
+    contentType = headers.get("content-type", "").lower()
+    return contentType.startswith(COMPRESSIBLE_TYPES)
+
+
+def acceptsGzip(requestHeaders: dict) -> bool:
+    """
+    Checks if the client said it can take a gzip encoded body.
+
+    Parameters:
+    requestHeaders (dict): The client's request headers with lower-cased names.
+
+    Returns:
+    bool: True if Accept-Encoding lists gzip (or *) without q=0; False otherwise.
+    """
+    for coding in requestHeaders.get("accept-encoding", "").split(','):
+        name, _, parameters = coding.strip().partition(';')
+        if name.strip().lower() not in ("gzip", "*"):
+            continue
+        quality = parameters.strip().lower()
+        if quality.startswith("q="):
+            try:
+                return float(quality[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def newCompressor(level: int):
+    """
+    Creates a streaming gzip compressor.
+
+    Parameters:
+    level (int): The zlib compression level from 1 (fastest) to 9 (smallest).
+
+    Returns:
+    compressor (zlib.Compress): Feed it chunks with compress() and finish with flush().
+    """
+    return zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+
+
+def newDecompressor():
+    """
+    Creates a streaming gzip decompressor.
+
+    Returns:
+    decompressor (zlib.Decompress): Feed it chunks with decompress() and finish with flush().
+    """
+    return zlib.decompressobj(GZIP_WBITS)
+
+
+def decompress(body: bytes) -> bytes:
+    """
+    Decompresses a whole gzip body.
+
+    Parameters:
+    body (bytes): The gzip encoded body.
+
+    Returns:
+    body (bytes): The decoded body.
+    """
+    return zlib.decompress(body, GZIP_WBITS)
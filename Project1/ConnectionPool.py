@@ -0,0 +1,277 @@
+# Maslin Farrell
+# Computer Networks Project 1
+import asyncio
+import time
+
+from DnsCache import DnsCache
+
+
+class OriginBusyError(Exception):
+    """
+    Raised when an origin already has as many active connections as we allow and none became free in time.
+    """
+
+
+class OriginConnection:
+    """
+    A single connection to an origin server that can be handed back to the pool once a response has been fully read.
+    """
+
+    def __init__(self, host: str, port: int, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, reused: bool = False,
+                 address: str = None):
+        """
+        Parameters:
+        host (str): The origin host this connection is for.
+        port (int): The origin port this connection is for.
+        reader (StreamReader): StreamReader object for the origin connection.
+        writer (StreamWriter): StreamWriter object for the origin connection.
+        reused (bool): True if this connection came out of the pool instead of being freshly opened.
+        address (str): The resolved address of the origin the connection goes to.
+        """
+        self.host = host
+        self.port = port
+        self.address = address
+        self.reader = reader
+        self.writer = writer
+        self.reused = reused
+        self.lastUsed = time.monotonic()
+
+        # True while the connection is checked out and holds one of its origin's active connection slots
+        self.active = True
+
+    def close(self):
+        """
+        Closes the underlying connection.
+        """
+        self.writer.close()
+
+
+class ConnectionPool:
+    """
+    Keeps persistent HTTP/1.1 connections to origin servers so a miss doesn't have to pay for TCP setup every time.
+    Idle connections are kept per (host, port) with a cap on how many we keep and how long they may sit idle.
+    The number of connections checked out to one origin at a time is capped too, so a burst of misses can't flood a single origin.
+    """
+
+    def __init__(self, maxIdlePerOrigin: int = 8, idleTimeout: float = 30.0, resolver: DnsCache = None,
+                 maxActivePerOrigin: int = 64, connectTimeout: float = 5.0):
+        """
+        Parameters:
+        maxIdlePerOrigin (int): The most idle connections we keep for a single (host, port).
+        idleTimeout (float): How many seconds a connection may sit idle in the pool before we throw it away.
+        resolver (DnsCache): Resolves origin hosts before connecting, a default DnsCache is used if none is given.
+        maxActivePerOrigin (int): The most connections checked out to a single (host, port) at once.
+        connectTimeout (float): How many seconds we wait for a free slot and then for the TCP connection before giving up.
+        """
+        self.maxIdlePerOrigin = maxIdlePerOrigin
+        self.idleTimeout = idleTimeout
+        self.resolver = resolver if resolver is not None else DnsCache()
+        self.maxActivePerOrigin = maxActivePerOrigin
+        self.connectTimeout = connectTimeout
+
+        # Maps (host, port) to the semaphore that limits its checked out connections
+        self.slots = {}
+
+        # Maps (host, port) to a list of idle connections, the most recently released connection is at the end
+        self.idle = {}
+
+        # Counters used for working out how often we reuse a connection
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self.expired = 0
+        self.busy = 0
+        self.timeouts = 0
+
+    def isHealthy(self, connection: OriginConnection) -> bool:
+        """
+        Health check done on checkout, makes sure the origin hasn't closed the connection while it was idle.
+
+        Parameters:
+        connection (OriginConnection): The idle connection we want to reuse.
+
+        Returns:
+        bool: True if the connection can be used for another request; False otherwise.
+        """
+        if connection.writer.is_closing() or connection.reader.at_eof():
+            return False
+        return time.monotonic() - connection.lastUsed < self.idleTimeout
+
+    async def acquire(self, host: str, port: int, avoidAddress: str = None) -> OriginConnection:
+        """
+        Checks out a connection to the origin, reusing a healthy idle one if we have one.
+
+        Parameters:
+        host (str): The origin host.
+        port (int): The origin port.
+        avoidAddress (str): Prefer any other resolved address of the origin over this one, for example the one a slow request went to.
+
+        Returns:
+        connection (OriginConnection): A connection that is ready for a request.
+
+        Raises:
+        OriginBusyError: If the origin is at its active connection limit and no slot became free within connectTimeout.
+        """
+        # Wait for one of the origin's active connection slots
+        slots = self.slots.get((host, port))
+        if slots is None:
+            slots = self.slots[(host, port)] = asyncio.Semaphore(self.maxActivePerOrigin)
+        # A free slot is taken straight away, without wait_for, which can lose a slot it already took if the caller is cancelled
+        # at the same moment, for example a hedged request that lost
+        if slots.locked():
+            try:
+                await asyncio.wait_for(slots.acquire(), self.connectTimeout)
+            except asyncio.TimeoutError:
+                self.busy += 1
+                raise OriginBusyError(f"{host}:{port} already has {self.maxActivePerOrigin} active connections")
+        else:
+            await slots.acquire()
+
+        try:
+            return await self.checkout(host, port, avoidAddress)
+        except BaseException:
+            slots.release()
+            raise
+
+    async def checkout(self, host: str, port: int, avoidAddress: str = None) -> OriginConnection:
+        """
+        Takes a healthy idle connection to the origin, or opens a new one. The caller already holds an active connection slot.
+
+        Parameters:
+        host (str): The origin host.
+        port (int): The origin port.
+        avoidAddress (str): Idle connections to this address are left in the pool, and it is tried last for a new connection.
+
+        Returns:
+        connection (OriginConnection): A connection that is ready for a request.
+        """
+        idleConnections = self.idle.get((host, port), [])
+
+        # Take the most recently used connection first as it is the least likely to have been closed by the origin
+        for index in range(len(idleConnections) - 1, -1, -1):
+            connection = idleConnections[index]
+            if avoidAddress is not None and connection.address == avoidAddress:
+                continue
+
+            del idleConnections[index]
+            if self.isHealthy(connection):
+                connection.reused = True
+                connection.active = True
+                self.reused += 1
+                return connection
+
+            self.expired += 1
+            connection.close()
+
+        reader, writer, address = await self.connect(host, port, avoidAddress)
+        self.created += 1
+        return OriginConnection(host, port, reader, writer, address=address)
+
+    async def connect(self, host: str, port: int, avoidAddress: str = None):
+        """
+        Opens a new connection to the origin, trying each of its resolved addresses in turn.
+        Connecting to an address skips the getaddrinfo that open_connection would otherwise run in the executor.
+
+        Parameters:
+        host (str): The origin host.
+        port (int): The origin port.
+        avoidAddress (str): An address to try only after all of the others.
+
+        Returns:
+        reader (StreamReader): StreamReader object for the new connection.
+        writer (StreamWriter): StreamWriter object for the new connection.
+        address (str): The address we connected to.
+        """
+        addresses = await self.resolver.resolve(host)
+        if avoidAddress in addresses:
+            addresses = [address for address in addresses if address != avoidAddress] + [avoidAddress]
+
+        lastError = None
+        for address in addresses:
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(address, port), self.connectTimeout)
+                return reader, writer, address
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                lastError = OSError(f"Timed out connecting to {host} at {address}:{port}")
+            except OSError as e:
+                lastError = e
+
+        # None of the addresses work, so look the host up again next time in case it moved
+        self.resolver.invalidate(host)
+        raise lastError if lastError is not None else OSError(f"No addresses found for {host}")
+
+    def release(self, connection: OriginConnection):
+        """
+        Hands a connection back to the pool once its response has been fully read.
+        If we already have enough idle connections for this origin the connection is closed instead.
+
+        Parameters:
+        connection (OriginConnection): The connection we are done with.
+        """
+        self.checkIn(connection)
+        idleConnections = self.idle.setdefault((connection.host, connection.port), [])
+
+        # Drop any connections that have been idle for too long while we are here
+        now = time.monotonic()
+        while idleConnections and now - idleConnections[0].lastUsed >= self.idleTimeout:
+            self.expired += 1
+            idleConnections.pop(0).close()
+
+        if connection.writer.is_closing() or len(idleConnections) >= self.maxIdlePerOrigin:
+            self.discard(connection)
+            return
+
+        connection.lastUsed = now
+        idleConnections.append(connection)
+
+    def discard(self, connection: OriginConnection):
+        """
+        Closes a connection that can't be reused, for example after an error or a 'Connection: close' response.
+
+        Parameters:
+        connection (OriginConnection): The connection we are done with.
+        """
+        self.checkIn(connection)
+        self.discarded += 1
+        connection.close()
+
+    def checkIn(self, connection: OriginConnection):
+        """
+        Gives back the active connection slot held by a checked out connection, only the first time it is called for a checkout.
+
+        Parameters:
+        connection (OriginConnection): The connection we are done with.
+        """
+        if connection.active:
+            connection.active = False
+            self.slots[(connection.host, connection.port)].release()
+
+    def closeAll(self):
+        """
+        Closes every idle connection in the pool.
+        """
+        for idleConnections in self.idle.values():
+            for connection in idleConnections:
+                connection.close()
+        self.idle.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns the counters for the connection pool.
+
+        Returns:
+        stats (dict): created, reused, discarded and expired connections, the reuse rate, how often an origin was at its connection limit,
+        how many connects timed out and how many connections are idle.
+        """
+        checkouts = self.created + self.reused
+        return {
+            "created": self.created,
+            "reused": self.reused,
+            "discarded": self.discarded,
+            "expired": self.expired,
+            "reuseRate": self.reused / checkouts if checkouts else 0.0,
+            "busy": self.busy,
+            "connectTimeouts": self.timeouts,
+            "idle": sum(len(idleConnections) for idleConnections in self.idle.values()),
+        }
@@ -0,0 +1,177 @@
+# Maslin Farrell
+# Computer Networks Project 1
+import asyncio
+import ipaddress
+import socket
+import time
+
+
+class DnsCache:
+    """
+    Caches origin host lookups so a miss doesn't send a getaddrinfo to the executor every time it connects.
+    Answers are kept for a fixed TTL since getaddrinfo doesn't tell us the record's real TTL, and failed lookups are kept for a shorter TTL.
+    Concurrent lookups for the same host share a single getaddrinfo call.
+    A static hosts override resolves names without asking DNS at all, like an /etc/hosts just for the proxy.
+    """
+
+    def __init__(self, ttl: float = 60.0, negativeTtl: float = 5.0, maxEntries: int = 10000, hosts: dict = None):
+        """
+        Parameters:
+        ttl (float): How many seconds a successful lookup is cached for.
+        negativeTtl (float): How many seconds a failed lookup is cached for.
+        maxEntries (int): The most hosts we keep answers for.
+        hosts (dict): Maps a host name to an address or a list of addresses, these are never looked up.
+        """
+        self.ttl = ttl
+        self.negativeTtl = negativeTtl
+        self.maxEntries = maxEntries
+        self.hosts = {name.lower(): [addresses] if isinstance(addresses, str) else list(addresses)
+                      for name, addresses in (hosts or {}).items()}
+
+        # Maps the lower-cased host to (expiry time, list of addresses or the error the lookup failed with)
+        self.cache = {}
+
+        # Maps the lower-cased host to the lookup in flight for it
+        self.inFlight = {}
+
+        # Counters for how the lookups were answered
+        self.hits = 0
+        self.negativeHits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.overrides = 0
+
+    @staticmethod
+    def loadHostsFile(path: str) -> dict:
+        """
+        Reads an /etc/hosts style file into a hosts override.
+
+        Parameters:
+        path (str): The file to read, each line is an address followed by one or more names.
+
+        Returns:
+        hosts (dict): Maps each name to the list of addresses listed for it.
+        """
+        hosts = {}
+        with open(path) as hostsFile:
+            for line in hostsFile:
+                fields = line.split('#', 1)[0].split()
+                if len(fields) < 2:
+                    continue
+                for name in fields[1:]:
+                    hosts.setdefault(name.lower(), []).append(fields[0])
+        return hosts
+
+    async def resolve(self, host: str) -> list:
+        """
+        Resolves a host to its addresses, from the hosts override, the cache or a single shared lookup.
+
+        Parameters:
+        host (str): The origin host name or address.
+
+        Returns:
+        addresses (list): The addresses to try, in the order getaddrinfo returned them.
+
+        Raises:
+        OSError: If the lookup failed, or failed recently and the failure is still cached.
+        """
+        # Addresses don't need resolving
+        try:
+            ipaddress.ip_address(host)
+            return [host]
+        except ValueError:
+            pass
+
+        name = host.lower()
+        if name in self.hosts:
+            self.overrides += 1
+            return self.hosts[name]
+
+        cached = self.cache.get(name)
+        if cached is not None:
+            expires, answer = cached
+            if time.monotonic() < expires:
+                if isinstance(answer, OSError):
+                    self.negativeHits += 1
+                    # Drop the old traceback so it doesn't grow every time the cached error is raised
+                    raise answer.with_traceback(None)
+                self.hits += 1
+                return answer
+            del self.cache[name]
+
+        # Share a lookup that is already running for this host
+        lookup = self.inFlight.get(name)
+        if lookup is not None:
+            self.coalesced += 1
+            return await asyncio.shield(lookup)
+
+        self.misses += 1
+        lookup = asyncio.get_running_loop().create_future()
+        self.inFlight[name] = lookup
+        try:
+            addressInfo = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+
+            # Keep the addresses in the order they came back, without the duplicates getaddrinfo can return
+            addresses = list(dict.fromkeys(info[4][0] for info in addressInfo))
+            self.store(name, addresses, self.ttl)
+            lookup.set_result(addresses)
+            return addresses
+        except OSError as e:
+            self.failures += 1
+            self.store(name, e, self.negativeTtl)
+            lookup.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting on the lookup
+            lookup.exception()
+            raise
+        except Exception as e:
+            # Anything else, for example a UnicodeError for a host name that can't be encoded, is passed on to the waiting callers as-is
+            # It isn't cached since it isn't a lookup failure
+            lookup.set_exception(e)
+            lookup.exception()
+            raise
+        finally:
+            # Only left unfinished if this lookup itself was cancelled, then the callers sharing it are cancelled too
+            if not lookup.done():
+                lookup.cancel()
+            del self.inFlight[name]
+
+    def store(self, name: str, answer, ttl: float):
+        """
+        Caches a lookup result, making room by dropping the oldest answer if the cache is full.
+
+        Parameters:
+        name (str): The lower-cased host.
+        answer: The list of addresses, or the error the lookup failed with.
+        ttl (float): How many seconds to keep the answer for.
+        """
+        if name not in self.cache and len(self.cache) >= self.maxEntries:
+            # Dicts keep insertion order, so the first key is the oldest answer
+            del self.cache[next(iter(self.cache))]
+        self.cache[name] = (time.monotonic() + ttl, answer)
+
+    def invalidate(self, host: str):
+        """
+        Forgets the cached answer for a host, for example when none of its addresses accepted a connection.
+
+        Parameters:
+        host (str): The origin host.
+        """
+        self.cache.pop(host.lower(), None)
+
+    def stats(self) -> dict:
+        """
+        Returns the counters for the DNS cache.
+
+        Returns:
+        stats (dict): Cache hits, cached failures, lookups, coalesced lookups, failed lookups, override answers and cached hosts.
+        """
+        return {
+            "hits": self.hits,
+            "negativeHits": self.negativeHits,
+            "lookups": self.misses,
+            "coalesced": self.coalesced,
+            "failures": self.failures,
+            "overrides": self.overrides,
+            "entries": len(self.cache),
+        }
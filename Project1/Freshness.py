@@ -0,0 +1,189 @@
+# Maslin Farrell
+# Computer Networks Project 1
+import time
+
+from email.utils import parsedate_to_datetime
+
+
+# The origin headers we keep next to each cached body
+STORED_HEADERS = ("etag", "last-modified", "cache-control", "expires", "content-type", "content-encoding", "date")
+
+# Heuristic freshness is a fraction of how old the file was when we stored it, capped at a day
+HEURISTIC_FRACTION = 0.1
+MAX_HEURISTIC_FRESHNESS = 24 * 60 * 60
+
+
+def parseHttpDate(value: str):
+    """
+    Parses an HTTP date header such as 'Sun, 06 Nov 1994 08:49:37 GMT'.
+
+    Parameters:
+    value (str): The header value.
+
+    Returns:
+    timestamp (float): The date as a unix timestamp, or None if it couldn't be parsed.
+    """
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def parseCacheControl(headers: dict) -> dict:
+    """
+    Splits the Cache-Control header into its directives.
+
+    Parameters:
+    headers (dict): The response headers with lower-cased names.
+
+    Returns:
+    directives (dict): Maps each lower-cased directive to its value, or to None if it has no value.
+    """
+    directives = {}
+    for directive in headers.get("cache-control", "").split(','):
+        name, separator, value = directive.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"') if separator else None
+    return directives
+
+
+def isStorable(headers: dict) -> bool:
+    """
+    Checks if a 200 response may be stored by a shared cache like ours.
+
+    Parameters:
+    headers (dict): The response headers with lower-cased names.
+
+    Returns:
+    bool: True if we may cache the response; False otherwise.
+    """
+    directives = parseCacheControl(headers)
+    return "no-store" not in directives and "private" not in directives
+
+
+def storedHeaders(headers: dict) -> dict:
+    """
+    Picks out the origin headers we keep next to a cached body.
+
+    Parameters:
+    headers (dict): The response headers with lower-cased names.
+
+    Returns:
+    headers (dict): Only the headers listed in STORED_HEADERS.
+    """
+    return {name: headers[name] for name in STORED_HEADERS if name in headers}
+
+
+def freshnessLifetime(headers: dict, storedTime: float, defaultLifetime: float) -> float:
+    """
+    Works out how long a cached response stays fresh after it was stored.
+    s-maxage and max-age win over Expires, and if neither is present we fall back to a heuristic based on Last-Modified.
+
+    Parameters:
+    headers (dict): The stored origin headers.
+    storedTime (float): When the response was stored, as a unix timestamp.
+    defaultLifetime (float): How long a response with no freshness information at all stays fresh.
+
+    Returns:
+    lifetime (float): The freshness lifetime in seconds.
+    """
+    directives = parseCacheControl(headers)
+
+    # no-cache means we may keep the response but must revalidate it every time
+    if "no-cache" in directives:
+        return 0.0
+
+    # We are a shared cache so s-maxage takes priority over max-age
+    for directive in ("s-maxage", "max-age"):
+        if directive in directives:
+            try:
+                return max(0.0, float(directives[directive]))
+            except (TypeError, ValueError):
+                return 0.0
+
+    # Expires is relative to the origin's Date, or to when we stored the response if there isn't one
+    dateTime = parseHttpDate(headers.get("date", "")) or storedTime
+    if "expires" in headers:
+        expiresTime = parseHttpDate(headers["expires"])
+        return max(0.0, expiresTime - dateTime) if expiresTime is not None else 0.0
+
+    # Without explicit freshness use a fraction of how long the file had gone unmodified
+    lastModifiedTime = parseHttpDate(headers.get("last-modified", ""))
+    if lastModifiedTime is not None:
+        return min(MAX_HEURISTIC_FRESHNESS, max(0.0, (dateTime - lastModifiedTime) * HEURISTIC_FRACTION))
+
+    return defaultLifetime
+
+
+def isFresh(headers: dict, storedTime: float, defaultLifetime: float) -> bool:
+    """
+    Checks if a cached response can still be served without asking the origin.
+
+    Parameters:
+    headers (dict): The stored origin headers.
+    storedTime (float): When the response was stored, as a unix timestamp.
+    defaultLifetime (float): How long a response with no freshness information at all stays fresh.
+
+    Returns:
+    bool: True if the response is still fresh; False if it is stale.
+    """
+    return time.time() - storedTime < freshnessLifetime(headers, storedTime, defaultLifetime)
+
+
+def staleFor(headers: dict, storedTime: float, defaultLifetime: float) -> float:
+    """
+    Works out how long a cached response has been stale for.
+
+    Parameters:
+    headers (dict): The stored origin headers.
+    storedTime (float): When the response was stored, as a unix timestamp.
+    defaultLifetime (float): How long a response with no freshness information at all stays fresh.
+
+    Returns:
+    staleness (float): How many seconds ago the response stopped being fresh, negative while it is still fresh.
+    """
+    return time.time() - storedTime - freshnessLifetime(headers, storedTime, defaultLifetime)
+
+
+def staleWindow(headers: dict, directive: str, defaultWindow: float) -> float:
+    """
+    Works out how long after going stale a cached response may still be served, for stale-while-revalidate or stale-if-error.
+    The origin's own directive wins over our default, and must-revalidate, proxy-revalidate or no-cache rule out serving it stale at all.
+
+    Parameters:
+    headers (dict): The stored origin headers.
+    directive (str): Either 'stale-while-revalidate' or 'stale-if-error'.
+    defaultWindow (float): The window in seconds to use when the origin didn't send the directive.
+
+    Returns:
+    window (float): How many seconds past going stale the response may be served.
+    """
+    directives = parseCacheControl(headers)
+    if "must-revalidate" in directives or "proxy-revalidate" in directives or "no-cache" in directives:
+        return 0.0
+
+    if directive in directives:
+        try:
+            return max(0.0, float(directives[directive]))
+        except (TypeError, ValueError):
+            return 0.0
+
+    return defaultWindow
+
+
+def conditionalHeaders(headers: dict) -> dict:
+    """
+    Builds the validators we send to revalidate a stale response.
+
+    Parameters:
+    headers (dict): The stored origin headers.
+
+    Returns:
+    headers (dict): If-None-Match and If-Modified-Since headers, empty if the response has no validators.
+    """
+    validators = {}
+    if "etag" in headers:
+        validators["If-None-Match"] = headers["etag"]
+    if "last-modified" in headers:
+        validators["If-Modified-Since"] = headers["last-modified"]
+    return validators
@@ -0,0 +1,214 @@
+# Maslin Farrell
+# Computer Networks Project 1
+import asyncio
+
+
+# Cap on the size of a response head so a misbehaving origin can't make us buffer forever
+MAX_HEADER_BYTES = 64 * 1024
+
+# How much of the body we read from the origin at a time
+BODY_CHUNK_SIZE = 64 * 1024
+
+
+class HttpParseError(Exception):
+    """
+    Raised when the origin sends us something we can't parse as an HTTP response.
+    """
+
+
+async def readResponseHead(reader: asyncio.StreamReader):
+    """
+    Reads the status line and headers of an HTTP response one line at a time.
+    Only the head is consumed, the body is left in the reader for readBody.
+
+    Parameters:
+    reader (StreamReader): StreamReader object connected to the origin server.
+
+    Returns:
+    statusLine (str): The status line from the origin, for example 'HTTP/1.1 200 OK'
+    statusCode (str): The status code from the status line, for example '200'
+    headers (dict): The response headers with lower-cased names
+    """
+    headBytes = 0
+
+    # Read the status line, skipping any stray blank lines before it
+    statusLine = b''
+    while not statusLine.strip():
+        statusLine = await reader.readline()
+        if not statusLine:
+            raise HttpParseError("Origin closed the connection before sending a status line")
+        headBytes += len(statusLine)
+
+    statusLine = statusLine.decode("latin-1").strip()
+    statusParts = statusLine.split(' ', 2)
+    if len(statusParts) < 2 or not statusParts[0].startswith("HTTP/"):
+        raise HttpParseError(f"Malformed status line: {statusLine}")
+    statusCode = statusParts[1]
+
+    # Read header lines until we reach the empty line that ends the head
+    headers = {}
+    while True:
+        line = await reader.readline()
+        headBytes += len(line)
+        if headBytes > MAX_HEADER_BYTES:
+            raise HttpParseError("Response head is too large")
+        if not line:
+            raise HttpParseError("Origin closed the connection in the middle of the headers")
+
+        line = line.rstrip(b'\r\n')
+        if not line:
+            break
+
+        name, separator, value = line.partition(b':')
+        if not separator:
+            raise HttpParseError(f"Malformed header line: {line!r}")
+
+        # Repeated headers are folded into one comma separated value
+        name = name.strip().lower().decode("latin-1")
+        value = value.strip().decode("latin-1")
+        headers[name] = f"{headers[name]}, {value}" if name in headers else value
+
+    return statusLine, statusCode, headers
+
+
+def isChunked(headers: dict) -> bool:
+    """
+    Checks if the response body uses chunked transfer-encoding.
+
+    Parameters:
+    headers (dict): The response headers with lower-cased names
+
+    Returns:
+    bool: True if the last transfer-coding is chunked; False otherwise.
+    """
+    codings = [coding.strip().lower() for coding in headers.get("transfer-encoding", "").split(',')]
+    return codings[-1] == "chunked"
+
+
+def hasBody(statusCode: str) -> bool:
+    """
+    Checks if a response with this status code carries a body at all.
+
+    Parameters:
+    statusCode (str): The status code from the status line.
+
+    Returns:
+    bool: False for 1xx, 204 and 304 responses which never have a body; True otherwise.
+    """
+    return not (statusCode.startswith("1") or statusCode in ("204", "304"))
+
+
+def isPersistent(statusLine: str, headers: dict) -> bool:
+    """
+    Checks if the connection can be reused for another request once this response's body has been read.
+
+    Parameters:
+    statusLine (str): The status line of the response.
+    headers (dict): The response headers with lower-cased names
+
+    Returns:
+    bool: True if the connection can be kept alive; False otherwise.
+    """
+    connectionTokens = [token.strip().lower() for token in headers.get("connection", "").split(',')]
+
+    # HTTP/1.1 connections are persistent unless told otherwise, HTTP/1.0 connections have to ask for it
+    if statusLine.startswith("HTTP/1.1"):
+        persistent = "close" not in connectionTokens
+    else:
+        persistent = "keep-alive" in connectionTokens
+
+    # A body without framing is ended by closing the connection so it can never be reused
+    statusCode = statusLine.split(' ', 2)[1]
+    return persistent and (not hasBody(statusCode) or isChunked(headers) or "content-length" in headers)
+
+
+async def readBody(reader: asyncio.StreamReader, headers: dict, readTimeout: float = None):
+    """
+    Async generator that yields the decoded body of a response as it arrives.
+    Callers should check hasBody first, as a response without a body looks like one that is delimited by closing.
+
+    Parameters:
+    reader (StreamReader): StreamReader object connected to the origin server, positioned after the head.
+    headers (dict): The response headers with lower-cased names
+    readTimeout (float): If set, asyncio.TimeoutError is raised when the origin sends nothing for this many seconds.
+
+    Yields:
+    chunk (bytes): The next piece of the body with any chunked framing removed.
+    """
+    chunks = readBodyChunks(reader, headers)
+    if readTimeout is None:
+        async for chunk in chunks:
+            yield chunk
+        return
+
+    try:
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), readTimeout)
+            except StopAsyncIteration:
+                return
+            yield chunk
+    finally:
+        await chunks.aclose()
+
+
+async def readBodyChunks(reader: asyncio.StreamReader, headers: dict):
+    """
+    Async generator that does the work for readBody without any timeout.
+    Handles Content-Length bodies, chunked bodies and bodies that are delimited by the connection closing.
+
+    Parameters:
+    reader (StreamReader): StreamReader object connected to the origin server, positioned after the head.
+    headers (dict): The response headers with lower-cased names
+
+    Yields:
+    chunk (bytes): The next piece of the body with any chunked framing removed.
+    """
+    if isChunked(headers):
+        while True:
+            # Each chunk starts with its size in hex, optionally followed by extensions after a ';'
+            sizeLine = await reader.readline()
+            if not sizeLine:
+                raise HttpParseError("Origin closed the connection in the middle of a chunked body")
+            try:
+                chunkSize = int(sizeLine.split(b';', 1)[0].strip(), 16)
+            except ValueError:
+                raise HttpParseError(f"Malformed chunk size: {sizeLine!r}")
+
+            # A zero sized chunk is the last chunk, after it come optional trailers and an empty line
+            if chunkSize == 0:
+                while True:
+                    trailer = await reader.readline()
+                    if not trailer or not trailer.strip():
+                        return
+
+            # Pass the chunk through in pieces so a huge chunk doesn't have to fit in memory
+            remaining = chunkSize
+            while remaining > 0:
+                data = await reader.readexactly(min(remaining, BODY_CHUNK_SIZE))
+                remaining -= len(data)
+                yield data
+
+            # Every chunk is followed by a CRLF
+            await reader.readline()
+
+    elif "content-length" in headers:
+        try:
+            remaining = int(headers["content-length"])
+        except ValueError:
+            raise HttpParseError(f"Malformed Content-Length: {headers['content-length']}")
+
+        while remaining > 0:
+            data = await reader.read(min(remaining, BODY_CHUNK_SIZE))
+            if not data:
+                raise HttpParseError("Origin closed the connection before sending the whole body")
+            remaining -= len(data)
+            yield data
+
+    else:
+        # With no framing information the body ends when the origin closes the connection
+        while True:
+            data = await reader.read(BODY_CHUNK_SIZE)
+            if not data:
+                return
+            yield data
@@ -0,0 +1,235 @@
+# Maslin Farrell
+# Computer Networks Project 1
+import asyncio
+import logging
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse
+
+
+# Only the start of a page is parsed, the links that matter are almost always near the top
+MAX_PARSED_BYTES = 1024 * 1024
+
+# The tags and attributes that point at subresources a browser loads with the page, links to other pages aren't followed
+LINK_ATTRIBUTES = {
+    "link": "href",
+    "script": "src",
+    "img": "src",
+}
+
+# A <link> is only a subresource for one of these rel values, other rels like 'canonical' or 'next' point at pages
+LINK_RELS = {"stylesheet", "preload", "icon"}
+
+
+class LinkParser(HTMLParser):
+    """
+    Collects the subresource links in an HTML page that point at the same origin as the page.
+    """
+
+    def __init__(self, pageUrl: str):
+        """
+        Parameters:
+        pageUrl (str): The URL of the page, relative links are resolved against it.
+        """
+        super().__init__(convert_charrefs=True)
+        self.pageUrl = pageUrl
+        self.origin = urlparse(pageUrl).netloc.lower()
+        self.links = {}
+
+    def handle_starttag(self, tag: str, attrs: list):
+        """
+        Records the link in a tag if it has one that points at the page's origin.
+
+        Parameters:
+        tag (str): The lower-cased tag name.
+        attrs (list): The tag's (name, value) attribute pairs.
+        """
+        attribute = LINK_ATTRIBUTES.get(tag)
+        if attribute is None:
+            return
+        # rel is a list of tokens, for example 'shortcut icon'
+        if tag == "link" and not LINK_RELS.intersection((dict(attrs).get("rel") or "").lower().split()):
+            return
+        for name, value in attrs:
+            if name == attribute and value:
+                # Fragments don't change the file, and the cache key ignores the query string
+                url = urljoin(self.pageUrl, value.strip()).split('#', 1)[0]
+                parsedURL = urlparse(url)
+                if parsedURL.scheme == "http" and parsedURL.netloc.lower() == self.origin:
+                    self.links[url] = None
+
+
+def extractLinks(pageUrl: str, body: bytes) -> list:
+    """
+    Finds the same-origin links in an HTML page.
+
+    Parameters:
+    pageUrl (str): The URL of the page.
+    body (bytes): The page, only the first MAX_PARSED_BYTES are parsed.
+
+    Returns:
+    links (list): The absolute URLs of the linked resources in the order they appear, without duplicates or the page itself.
+    """
+    parser = LinkParser(pageUrl)
+    try:
+        parser.feed(body[:MAX_PARSED_BYTES].decode("utf-8", errors="replace"))
+        parser.close()
+    except Exception as e:
+        # A page we can't parse still gives us the links found before the error
+        logging.error(f"ERROR: Failed to parse links from {pageUrl}! {e}")
+    parser.links.pop(pageUrl, None)
+    return list(parser.links)
+
+
+def pageStart(chunks: list) -> bytes:
+    """
+    Joins the start of a page from the chunks it arrived in, without copying more than is parsed.
+
+    Parameters:
+    chunks (list): The body chunks in order.
+
+    Returns:
+    body (bytes): At most the first MAX_PARSED_BYTES of the page.
+    """
+    start = []
+    length = 0
+    for chunk in chunks:
+        if length >= MAX_PARSED_BYTES:
+            break
+        start.append(chunk[:MAX_PARSED_BYTES - length])
+        length += len(start[-1])
+    return b''.join(start)
+
+
+def isHtml(headers: dict) -> bool:
+    """
+    Checks if a response is an unencoded HTML page we can look for links in.
+
+    Parameters:
+    headers (dict): The response headers with lower-cased names.
+
+    Returns:
+    bool: True if the body is text/html without a Content-Encoding; False otherwise.
+    """
+    contentType = headers.get("content-type", "").split(';', 1)[0].strip().lower()
+    return contentType == "text/html" and "content-encoding" not in headers
+
+
+class LinkPrefetcher:
+    """
+    Fetches the same-origin resources linked from HTML pages we fetched, so they are already cached when the client asks for them.
+    Prefetching is low priority: pages wait in a small bounded queue and are dropped when it is full,
+    links are fetched one at a time per worker, and nothing is fetched while the proxy is busy serving clients.
+    """
+
+    def __init__(self, proxy, maxQueuedPages: int = 100, concurrency: int = 2, busyRequests: int = 8,
+                 busyDelay: float = 0.1, maxLinksPerPage: int = 50, maxRemembered: int = 10000):
+        """
+        Parameters:
+        proxy (Proxy): The proxy whose cache the links are fetched into.
+        maxQueuedPages (int): The most pages waiting to have their links fetched, any more are dropped.
+        concurrency (int): How many pages have their links fetched at once.
+        busyRequests (int): Prefetching waits while this many client requests or more are being served.
+        busyDelay (float): How many seconds to wait before checking again if the proxy is still busy.
+        maxLinksPerPage (int): The most links fetched from a single page.
+        maxRemembered (int): How many links we remember having prefetched, so they aren't fetched again.
+        """
+        self.proxy = proxy
+        self.concurrency = concurrency
+        self.busyRequests = busyRequests
+        self.busyDelay = busyDelay
+        self.maxLinksPerPage = maxLinksPerPage
+        self.maxRemembered = maxRemembered
+
+        self.pages = asyncio.Queue(maxQueuedPages)
+
+        # Links we already prefetched, kept in insertion order so the oldest are forgotten first
+        self.seen = {}
+
+        # Holds references to the worker tasks so they aren't garbage collected while they run
+        self.workers = []
+
+        # Counters for how many pages and links were handled
+        self.pagesQueued = 0
+        self.pagesDropped = 0
+        self.linksFound = 0
+        self.fetched = 0
+        self.alreadyCached = 0
+        self.failed = 0
+
+    def start(self):
+        """
+        Starts the workers that fetch the queued pages' links.
+        """
+        self.workers = [asyncio.create_task(self.worker()) for _ in range(self.concurrency)]
+
+    def submit(self, pageUrl: str, body: bytes):
+        """
+        Queues a fetched HTML page to have its links prefetched, without waiting. The page is dropped if the queue is full.
+
+        Parameters:
+        pageUrl (str): The URL of the page.
+        body (bytes): The page.
+        """
+        try:
+            self.pages.put_nowait((pageUrl, body))
+            self.pagesQueued += 1
+        except asyncio.QueueFull:
+            self.pagesDropped += 1
+
+    async def worker(self):
+        """
+        Takes pages off the queue, parses them in a worker thread and fetches their links while the proxy isn't busy.
+        """
+        while True:
+            pageUrl, body = await self.pages.get()
+            links = await asyncio.to_thread(extractLinks, pageUrl, body)
+            links = [link for link in links if link not in self.seen][:self.maxLinksPerPage]
+            self.linksFound += len(links)
+
+            for link in links:
+                self.remember(link)
+
+                # Client requests come first
+                while self.proxy.admissionControl.active >= self.busyRequests:
+                    await asyncio.sleep(self.busyDelay)
+
+                try:
+                    result = await self.proxy.prefetch(link)
+                except Exception as e:
+                    logging.error(f"ERROR: Failed to prefetch {link}! {e}")
+                    result = None
+
+                if result is None:
+                    self.failed += 1
+                elif result:
+                    self.fetched += 1
+                else:
+                    self.alreadyCached += 1
+
+    def remember(self, link: str):
+        """
+        Records that a link has been prefetched, forgetting the oldest link if we remember too many.
+
+        Parameters:
+        link (str): The prefetched URL.
+        """
+        if len(self.seen) >= self.maxRemembered:
+            del self.seen[next(iter(self.seen))]
+        self.seen[link] = None
+
+    def stats(self) -> dict:
+        """
+        Returns the counters for link prefetching.
+
+        Returns:
+        stats (dict): Pages queued and dropped, links found, and how many were fetched, already cached or failed.
+        """
+        return {
+            "pagesQueued": self.pagesQueued,
+            "pagesDropped": self.pagesDropped,
+            "pagesWaiting": self.pages.qsize(),
+            "linksFound": self.linksFound,
+            "fetched": self.fetched,
+            "alreadyCached": self.alreadyCached,
+            "failed": self.failed,
+        }
@@ -0,0 +1,115 @@
+# Maslin Farrell
+# Computer Networks Project 1
+from collections import OrderedDict
+
+
+class MemoryCache:
+    """
+    In-memory LRU tier that sits in front of the '.cache' directory on disk.
+    Entries are stored as bytes and the cache is bounded by the total number of body bytes it holds.
+    Whenever adding an entry pushes us over the budget the least recently used entries are evicted.
+    """
+
+    def __init__(self, maxBytes: int, maxEntryBytes: int = None):
+        """
+        Parameters:
+        maxBytes (int): The byte budget for all of the bodies held in memory. A budget of 0 disables the memory tier.
+        maxEntryBytes (int): The largest single body we keep in memory. Defaults to an eighth of the budget.
+        """
+        self.maxBytes = maxBytes
+        self.maxEntryBytes = maxEntryBytes if maxEntryBytes is not None else maxBytes // 8
+        self.currentBytes = 0
+
+        # The OrderedDict keeps our entries in LRU order, the front is the least recently used entry
+        self.entries = OrderedDict()
+
+        # Counters used for sizing the memory tier against our working set
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        """
+        Looks up a key in the memory tier and marks it as the most recently used entry.
+
+        Parameters:
+        key (str): The cache key, this is the string form of the cache path.
+
+        Returns:
+        body (bytes): The cached body, or None if the key is not held in memory.
+        """
+        body = self.entries.get(key)
+
+        if body is None:
+            self.misses += 1
+            return None
+
+        # Move the entry to the back of the OrderedDict since it is now the most recently used
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return body
+
+    def admits(self, size: int) -> bool:
+        """
+        Checks if a body of the given size would be kept by the memory tier.
+        This lets callers that stream a body stop buffering it once it is too big.
+
+        Parameters:
+        size (int): The size of the body in bytes.
+
+        Returns:
+        bool: True if a body of this size can be stored; False otherwise.
+        """
+        return size <= self.maxEntryBytes
+
+    def put(self, key: str, body: bytes):
+        """
+        Adds or replaces an entry in the memory tier, evicting the least recently used entries until we are back under budget.
+
+        Parameters:
+        key (str): The cache key, this is the string form of the cache path.
+        body (bytes): The body of the cached response.
+        """
+        # Big objects would evict most of the hot set, so leave those on disk only
+        if not self.admits(len(body)):
+            self.remove(key)
+            return
+
+        # If we are replacing an existing entry remove its size from the total first
+        self.remove(key)
+
+        self.entries[key] = body
+        self.currentBytes += len(body)
+
+        # Evict from the front (least recently used) until we fit in our budget
+        while self.currentBytes > self.maxBytes:
+            _, evictedBody = self.entries.popitem(last=False)
+            self.currentBytes -= len(evictedBody)
+            self.evictions += 1
+
+    def remove(self, key: str):
+        """
+        Removes an entry from the memory tier if it exists.
+
+        Parameters:
+        key (str): The cache key, this is the string form of the cache path.
+        """
+        body = self.entries.pop(key, None)
+        if body is not None:
+            self.currentBytes -= len(body)
+
+    def stats(self) -> dict:
+        """
+        Returns the counters for the memory tier.
+
+        Returns:
+        stats (dict): hits, misses, evictions, the number of entries and the bytes currently used.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.currentBytes,
+            "maxBytes": self.maxBytes,
+        }
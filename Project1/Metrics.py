@@ -0,0 +1,138 @@
+# Maslin Farrell
+# Computer Networks Project 1
+import bisect
+import time
+
+from contextlib import contextmanager
+
+
+# The stages of a request we keep latency histograms for
+STAGES = ("clientParse", "cacheLookup", "diskRead", "originConnect", "originFirstByte", "originBody", "peerFirstByte", "cacheWrite", "clientWrite", "request")
+
+# Upper bounds of the histogram buckets in seconds, roughly logarithmic from 50us to 10s
+BUCKET_BOUNDS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram. Recording is a bisect and an increment so it is cheap enough to do on every request.
+    Percentiles are estimated from the buckets, which is plenty to see which stage the tail latency comes from.
+    """
+
+    def __init__(self):
+        # One count per bucket bound, plus a final bucket for anything slower than the last bound
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        """
+        Records one measurement.
+
+        Parameters:
+        seconds (float): How long the stage took in seconds.
+        """
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction: float) -> float:
+        """
+        Estimates a percentile as the upper bound of the bucket it falls in.
+
+        Parameters:
+        fraction (float): The percentile as a fraction, for example 0.99 for p99.
+
+        Returns:
+        seconds (float): The estimated percentile in seconds, 0 if nothing was recorded.
+        """
+        if self.count == 0:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                # The slowest bucket has no upper bound, and no bucket can be slower than the slowest measurement
+                bound = BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else self.max
+                return min(bound, self.max)
+        return self.max
+
+    def stats(self) -> dict:
+        """
+        Returns the histogram summary with every time in milliseconds.
+
+        Returns:
+        stats (dict): The count, mean, p50, p90, p99, max and the count in each bucket.
+        """
+        return {
+            "count": self.count,
+            "meanMs": self.total / self.count * 1000 if self.count else 0.0,
+            "p50Ms": self.percentile(0.5) * 1000,
+            "p90Ms": self.percentile(0.9) * 1000,
+            "p99Ms": self.percentile(0.99) * 1000,
+            "maxMs": self.max * 1000,
+            "buckets": {f"le{bound * 1000:g}ms": count for bound, count in zip(BUCKET_BOUNDS, self.counts)} | {"inf": self.counts[-1]},
+        }
+
+
+class Metrics:
+    """
+    Counters and per-stage latency histograms for the proxy.
+    Everything runs on the event loop, so no locking is needed.
+    """
+
+    def __init__(self):
+        self.startTime = time.time()
+        self.counters = {}
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+
+    def increment(self, name: str, amount: int = 1):
+        """
+        Adds to a counter, creating it the first time it is used.
+
+        Parameters:
+        name (str): The name of the counter.
+        amount (int): How much to add.
+        """
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record(self, stage: str, seconds: float):
+        """
+        Records how long a stage took.
+
+        Parameters:
+        stage (str): One of STAGES.
+        seconds (float): How long the stage took in seconds.
+        """
+        self.histograms[stage].record(seconds)
+
+    @contextmanager
+    def timer(self, stage: str):
+        """
+        Context manager that records how long the code inside it took, even if it raised.
+
+        Parameters:
+        stage (str): One of STAGES.
+        """
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.histograms[stage].record(time.perf_counter() - startTime)
+
+    def stats(self) -> dict:
+        """
+        Returns every counter and every stage histogram.
+
+        Returns:
+        stats (dict): The uptime in seconds, the counters, and the histogram summary for each stage.
+        """
+        return {
+            "uptime": time.time() - self.startTime,
+            "counters": dict(self.counters),
+            "stages": {stage: histogram.stats() for stage, histogram in self.histograms.items()},
+        }
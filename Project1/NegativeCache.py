@@ -0,0 +1,147 @@
+# Maslin Farrell
+# Computer Networks Project 1
+import time
+from collections import OrderedDict
+
+
+# Rough per-entry cost of the dict slot, the tuple and the float on top of the strings we count
+ENTRY_OVERHEAD_BYTES = 200
+
+
+class NegativeCache:
+    """
+    Remembers 404s and other cacheable error responses for a short time, so repeated requests for missing URLs don't all go to the origin.
+    It is kept apart from the disk cache and the memory tier, and only the status is stored since error bodies aren't passed on to the client.
+    Entries expire after their TTL and the least recently used are evicted when the cache goes over its byte budget.
+    """
+
+    def __init__(self, maxBytes: int = 4 * 1024 * 1024, ttl: float = 30.0):
+        """
+        Parameters:
+        maxBytes (int): The byte budget for all of the entries. A budget of 0 disables the negative cache.
+        ttl (float): The longest an error response is remembered for, in seconds.
+        """
+        self.maxBytes = maxBytes
+        self.ttl = ttl
+        self.currentBytes = 0
+
+        # Maps the cache key to (expiry time, status line, status code), the front is the least recently used entry
+        self.entries = OrderedDict()
+
+        # Counters used for seeing how many origin requests the negative cache saves
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.expired = 0
+        self.evictions = 0
+
+    @staticmethod
+    def entrySize(key: str, statusLine: str) -> int:
+        """
+        Estimates how much memory an entry takes.
+
+        Parameters:
+        key (str): The cache key.
+        statusLine (str): The stored status line.
+
+        Returns:
+        size (int): The estimated size of the entry in bytes.
+        """
+        return len(key) + len(statusLine) + ENTRY_OVERHEAD_BYTES
+
+    def get(self, key: str):
+        """
+        Looks up a remembered error response and marks it as the most recently used entry.
+
+        Parameters:
+        key (str): The cache key.
+
+        Returns:
+        statusLine (str): The status line the origin sent, or None if we don't remember an error for this key.
+        statusCode (str): The status code from the status line, or None.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None, None
+
+        expires, statusLine, statusCode = entry
+        if time.monotonic() >= expires:
+            self.expired += 1
+            self.misses += 1
+            self.remove(key)
+            return None, None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return statusLine, statusCode
+
+    def put(self, key: str, statusLine: str, statusCode: str, ttl: float = None):
+        """
+        Remembers an error response, evicting the least recently used entries until we are back under budget.
+
+        Parameters:
+        key (str): The cache key.
+        statusLine (str): The status line the origin sent.
+        statusCode (str): The status code from the status line.
+        ttl (float): How long to remember it for, capped at the cache's own TTL. Defaults to the cache's TTL.
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        size = self.entrySize(key, statusLine)
+        if ttl <= 0 or size > self.maxBytes:
+            return
+
+        self.remove(key)
+        self.entries[key] = (time.monotonic() + ttl, statusLine, statusCode)
+        self.currentBytes += size
+        self.stores += 1
+
+        # Evict from the front (least recently used) until we fit in our budget
+        while self.currentBytes > self.maxBytes:
+            evictedKey, (_, evictedStatusLine, _) = self.entries.popitem(last=False)
+            self.currentBytes -= self.entrySize(evictedKey, evictedStatusLine)
+            self.evictions += 1
+
+    def remove(self, key: str):
+        """
+        Forgets the error response for a key, for example once the origin has sent us a good copy of it.
+
+        Parameters:
+        key (str): The cache key.
+        """
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.currentBytes -= self.entrySize(key, entry[1])
+
+    def removeMatching(self, match) -> int:
+        """
+        Forgets the error responses for every key a purge removes. The negative cache is small, so every entry is checked.
+
+        Parameters:
+        match (function): Called with a cache key, returns True if the entry should be forgotten.
+
+        Returns:
+        removed (int): How many entries were forgotten.
+        """
+        keys = [key for key in self.entries if match(key)]
+        for key in keys:
+            self.remove(key)
+        return len(keys)
+
+    def stats(self) -> dict:
+        """
+        Returns the counters for the negative cache.
+
+        Returns:
+        stats (dict): hits, misses, stores, expired and evicted entries, the number of entries and the bytes currently used.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.currentBytes,
+            "maxBytes": self.maxBytes,
+        }
@@ -0,0 +1,192 @@
+# Maslin Farrell
+# Computer Networks Project 1
+import bisect
+import hashlib
+import time
+
+
+# Sent on requests we forward to a sibling proxy, a proxy never forwards a request carrying it so requests can't loop between peers
+PEER_HEADER = "X-Proxy-Peer"
+
+# How many points each proxy gets on the hash ring, more points spread the keys more evenly
+VIRTUAL_NODES = 100
+
+
+def parseAddress(address: str):
+    """
+    Splits a peer address into its host and port.
+
+    Parameters:
+    address (str): The address as host:port, for example '127.0.0.1:8889'
+
+    Returns:
+    host (str): The host name or IP address.
+    port (int): The port number.
+
+    Raises:
+    ValueError: If the address isn't host:port with a valid port.
+    """
+    host, separator, port = address.strip().rpartition(':')
+    if not separator or not host or not port.isdigit() or not 0 < int(port) < 65536:
+        raise ValueError(f"Peer addresses must be host:port, got '{address}'")
+    return host.lower(), int(port)
+
+
+def hashKey(value: str) -> int:
+    """
+    Hashes a cache key or a ring point to a position on the hash ring. Every proxy must get the same answer, so Python's hash() can't be used.
+
+    Parameters:
+    value (str): The string to hash.
+
+    Returns:
+    position (int): A 64-bit position on the ring.
+    """
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class Peer:
+    """
+    A sibling proxy, with the counters for what happened when we asked it for files.
+    """
+
+    def __init__(self, address: str):
+        """
+        Parameters:
+        address (str): The peer's address as host:port.
+        """
+        self.address = address
+        self.host, self.port = parseAddress(address)
+
+        # After a timeout or error we go straight to the origin for this peer's keys until this time
+        self.downUntil = 0.0
+
+        # hits were served from the peer's cache, misses the peer had to fetch from the origin itself
+        self.hits = 0
+        self.misses = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.skipped = 0
+
+    def stats(self) -> dict:
+        """
+        Returns the counters for this peer.
+
+        Returns:
+        stats (dict): Hits, misses, timeouts, errors, requests skipped while it was marked down, and whether it is down now.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "skipped": self.skipped,
+            "down": time.monotonic() < self.downUntil,
+        }
+
+
+class PeerGroup:
+    """
+    A group of sibling proxies that share their caches, each with their own cache directory.
+    Every cache key has one owner picked by consistent hashing over the whole group, ourselves included.
+    On a miss for a key another proxy owns we ask that proxy, which serves it from its cache or fetches it from the origin once for the whole group.
+    Every proxy in the group must be given the same list of addresses, so they all agree on the owner of each key.
+    Adding or removing a proxy only moves the keys on its part of the ring.
+    """
+
+    def __init__(self, name: str, peers: list, timeout: float = 2.0, retryDelay: float = 10.0):
+        """
+        Parameters:
+        name (str): Our own address as host:port, exactly as it appears in the other proxies' peer lists.
+        peers (list): The addresses of the proxies in the group as host:port, our own address may be included.
+        timeout (float): How many seconds a peer may go quiet while we wait for its response head or body.
+        retryDelay (float): How many seconds we leave a peer alone after it timed out or failed.
+        """
+        parseAddress(name)
+        self.name = name.strip().lower()
+        self.timeout = timeout
+        self.retryDelay = retryDelay
+
+        # Everyone but ourselves, duplicates in the list are ignored
+        self.peers = {}
+        for address in peers:
+            address = address.strip().lower()
+            if address != self.name and address not in self.peers:
+                self.peers[address] = Peer(address)
+
+        # The ring is kept as sorted positions with the owner of each position alongside, so the owner is found with a binary search
+        points = sorted((hashKey(f"{member}#{i}"), member) for member in [self.name, *self.peers] for i in range(VIRTUAL_NODES))
+        self.positions = [position for position, _ in points]
+        self.owners = [member for _, member in points]
+
+    def ownerOf(self, key: str) -> str:
+        """
+        Finds the proxy that owns a cache key, the first point on the ring at or after the key's position.
+
+        Parameters:
+        key (str): The cache key.
+
+        Returns:
+        owner (str): The owner's address.
+        """
+        index = bisect.bisect_left(self.positions, hashKey(key))
+        return self.owners[index % len(self.owners)]
+
+    def peerFor(self, key: str):
+        """
+        Finds the peer to ask for a cache key.
+
+        Parameters:
+        key (str): The cache key.
+
+        Returns:
+        peer (Peer): The peer that owns the key, or None if we own it or its owner is marked down.
+        """
+        owner = self.ownerOf(key)
+        if owner == self.name:
+            return None
+
+        peer = self.peers[owner]
+        if time.monotonic() < peer.downUntil:
+            peer.skipped += 1
+            return None
+        return peer
+
+    def succeeded(self, peer: Peer, hit: bool):
+        """
+        Records that a peer answered.
+
+        Parameters:
+        peer (Peer): The peer we asked.
+        hit (bool): True if the peer served the file from its cache; False if it went to the origin.
+        """
+        if hit:
+            peer.hits += 1
+        else:
+            peer.misses += 1
+
+    def failed(self, peer: Peer, timedOut: bool):
+        """
+        Records that a peer timed out or failed, and leaves it alone for retryDelay seconds.
+
+        Parameters:
+        peer (Peer): The peer we asked.
+        timedOut (bool): True if the peer timed out; False if it failed in another way.
+        """
+        if timedOut:
+            peer.timeouts += 1
+        else:
+            peer.errors += 1
+        peer.downUntil = time.monotonic() + self.retryDelay
+
+    def stats(self) -> dict:
+        """
+        Returns the counters for every peer.
+
+        Returns:
+        stats (dict): Our own address and the counters of each peer by address.
+        """
+        return {
+            "name": self.name,
+            "peers": {address: peer.stats() for address, peer in self.peers.items()},
+        }
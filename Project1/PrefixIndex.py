@@ -0,0 +1,168 @@
+# Maslin Farrell
+# Computer Networks Project 1
+from urllib.parse import urlparse
+
+
+# The ways a purge can pick the cache keys it removes
+PURGE_KINDS = ("url", "prefix", "host")
+
+
+def cacheKeyFor(url: str) -> str:
+    """
+    Turns a URL into its cache key, the lower-cased host and the path the same way the proxy builds it for a request.
+
+    Parameters:
+    url (str): The URL, with or without the 'http://' in front.
+
+    Returns:
+    key (str): The cache key, for example 'zhiju.me/networks/valid.html'.
+    """
+    if "://" not in url:
+        url = "http://" + url
+    parsedURL = urlparse(url)
+    return parsedURL.netloc.lower() + parsedURL.path
+
+
+def keyMatcher(kind: str, value: str):
+    """
+    Builds a test for the cache keys a purge removes, for the caches that aren't in the prefix index.
+
+    Parameters:
+    kind (str): 'url' for one cache key, 'prefix' for every key starting with value, or 'host' for every key on the host on any port.
+    value (str): The cache key, key prefix or host name.
+
+    Returns:
+    match (function): Called with a cache key, returns True if the purge removes it.
+    """
+    if kind == "url":
+        return lambda key: key == value
+    if kind == "prefix":
+        return lambda key: key.startswith(value)
+    return lambda key: PrefixIndex.onHost(key.split('/', 1)[0], value)
+
+
+class PrefixNode:
+    """
+    One path segment in the prefix index.
+    """
+
+    __slots__ = ("children", "key")
+
+    def __init__(self):
+        # Maps the next path segment to its node
+        self.children = {}
+
+        # The cache key that ends at this node, None if no cached file ends here
+        self.key = None
+
+
+class PrefixIndex:
+    """
+    A trie over the cache keys, split into the host followed by each segment of the path.
+    Purging a URL, a prefix or a host walks straight down to the matching keys instead of looking at every key in the cache,
+    so a purge costs about as much as the number of keys it removes.
+    """
+
+    def __init__(self):
+        self.root = PrefixNode()
+        self.size = 0
+
+    @staticmethod
+    def onHost(netloc: str, host: str) -> bool:
+        """
+        Checks if the host and port at the start of a cache key belong to a host.
+
+        Parameters:
+        netloc (str): The host, with its port if the URL had one.
+        host (str): The host name being purged.
+
+        Returns:
+        bool: True if netloc is the host on any port; False otherwise.
+        """
+        return netloc == host or netloc.startswith(host + ":")
+
+    def add(self, key: str):
+        """
+        Adds a cache key, adding it twice is the same as adding it once.
+
+        Parameters:
+        key (str): The cache key.
+        """
+        node = self.root
+        for segment in key.split('/'):
+            child = node.children.get(segment)
+            if child is None:
+                child = node.children[segment] = PrefixNode()
+            node = child
+        if node.key is None:
+            node.key = key
+            self.size += 1
+
+    def remove(self, key: str):
+        """
+        Removes a cache key, pruning the nodes that no longer lead to any key.
+
+        Parameters:
+        key (str): The cache key.
+        """
+        segments = key.split('/')
+        path = [self.root]
+        for segment in segments:
+            node = path[-1].children.get(segment)
+            if node is None:
+                return
+            path.append(node)
+        if path[-1].key is None:
+            return
+        path[-1].key = None
+        self.size -= 1
+
+        # Walk back up, dropping empty nodes until we reach one that is still in use
+        for depth in range(len(segments), 0, -1):
+            node = path[depth]
+            if node.key is not None or node.children:
+                break
+            del path[depth - 1].children[segments[depth - 1]]
+
+    def clear(self):
+        """
+        Removes every key.
+        """
+        self.root = PrefixNode()
+        self.size = 0
+
+    def find(self, kind: str, value: str) -> list:
+        """
+        Finds the cache keys a purge removes.
+
+        Parameters:
+        kind (str): 'url' for one cache key, 'prefix' for every key starting with value, or 'host' for every key on the host on any port.
+        value (str): The cache key, key prefix or host name.
+
+        Returns:
+        keys (list): The matching cache keys.
+        """
+        if kind == "host":
+            nodes = [node for netloc, node in self.root.children.items() if self.onHost(netloc, value)]
+        else:
+            # Walk down the whole segments, the last one may be cut short by a prefix
+            *segments, last = value.split('/')
+            node = self.root
+            for segment in segments:
+                node = node.children.get(segment)
+                if node is None:
+                    return []
+
+            if kind == "url":
+                node = node.children.get(last)
+                return [node.key] if node is not None and node.key is not None else []
+            nodes = [child for segment, child in node.children.items() if segment.startswith(last)]
+
+        # Collect every key below the matching nodes
+        keys = []
+        while nodes:
+            node = nodes.pop()
+            if node.key is not None:
+                keys.append(node.key)
+            nodes.extend(node.children.values())
+        return keys
@@ -2,53 +2,277 @@
 # Computer Networks Project 1
 import asyncio
 
+import json
 import logging
+import os
 import sys
-import aiofiles
+import time
+import zlib
 
+from contextlib import aclosing
 from socket import *
-from urllib.parse import urlparse
 from pathlib import Path
 
+from AdminServer import AdminServer
+from AdmissionControl import AdmissionControl
+from CacheEvictor import CacheEvictor
+from CacheIndex import CacheEntry, CacheIndex, ReplacedFileError
+from CacheWarmer import CacheWarmer
+from CacheWriter import CacheWrite, CacheWriter
+from Compression import acceptsGzip, decompress, isCompressible, newCompressor, newDecompressor
+from ConnectionPool import ConnectionPool, OriginBusyError, OriginConnection
+from DnsCache import DnsCache
+from Freshness import conditionalHeaders, freshnessLifetime, isFresh, isStorable, staleFor, staleWindow, storedHeaders
+from HttpParser import BODY_CHUNK_SIZE, HttpParseError, hasBody, isChunked, isPersistent, readBody, readResponseHead
+from LinkPrefetcher import LinkPrefetcher, isHtml, pageStart
+from MemoryCache import MemoryCache
+from Metrics import Metrics
+from NegativeCache import NegativeCache
+from PeerGroup import PEER_HEADER, Peer, PeerGroup
+from PrefixIndex import keyMatcher
+from QueueLogging import startQueueLogging
+from RangeRequests import contentRange, multipartHeads, multipartTail, newBoundary, requestedRanges
+from RequestParser import CLIENT_READ_SIZE, HttpRequest, RequestParser
+from RequestCoalescer import InFlightFetch, RequestCoalescer
+from RequestHedger import RequestHedger
+from SegmentStore import SegmentCompactor, SegmentStore
+
+
+# sendfile is handed the file a slice at a time, so a client that stops reading is timed out like any other client write
+SENDFILE_SLICE_BYTES = 1024 * 1024
+
 
 class Proxy:
-    async def processClientRequest(self, reader):
+    def __init__(self, memoryCacheBytes: int = 64 * 1024 * 1024, maxIdlePerOrigin: int = 8, originIdleTimeout: float = 30.0,
+                 clientIdleTimeout: float = 15.0, maxRequestsPerConnection: int = 100, cacheDir: str = ".cache",
+                 defaultFreshness: float = 3600.0, maxCacheBytes: int = 1024 * 1024 * 1024, maxCacheEntries: int = 100000,
+                 evictionPolicy: str = "lru", evictionInterval: float = 30.0, useSendfile: bool = True,
+                 compressAtRest: bool = False, compressionLevel: int = 6, sharedCache: bool = False,
+                 statsPort: int = None, statsInterval: float = None, dnsTtl: float = 60.0, dnsNegativeTtl: float = 5.0,
+                 hosts: dict = None, clientHeaderTimeout: float = 10.0, clientWriteTimeout: float = 30.0,
+                 originConnectTimeout: float = 5.0, originReadTimeout: float = 30.0, maxInFlightRequests: int = 1000,
+                 maxQueuedRequests: int = 1000, queueTimeout: float = 5.0, maxConnectionsPerOrigin: int = 64,
+                 warmUrls: list = None, warmConcurrency: int = 8, warmBeforeServing: bool = False, prefetchLinks: bool = False,
+                 negativeCacheBytes: int = 4 * 1024 * 1024, negativeCacheTtl: float = 30.0,
+                 negativeStatuses: tuple = ("404", "405", "410", "414", "501"), maxQueuedWriteBytes: int = 64 * 1024 * 1024,
+                 maxPendingWrites: int = 1000, staleWhileRevalidate: float = 30.0, staleIfError: float = 300.0,
+                 peers: list = None, peerName: str = None, peerTimeout: float = 2.0, peerRetryDelay: float = 10.0,
+                 storageEngine: str = "files", segmentBytes: int = 64 * 1024 * 1024, maxSegmentObjectBytes: int = 256 * 1024,
+                 adminPort: int = None, hedgePercentile: float = None, hedgeBudget: float = 0.05, hedgeOtherAddress: bool = False,
+                 fetchWindowBytes: int = 8 * 1024 * 1024, cacheWriters: int = 4):
+        """
+        Parameters:
+        memoryCacheBytes (int): The byte budget for the in-memory LRU tier that sits in front of the disk cache. Defaults to 64MB.
+        maxIdlePerOrigin (int): The most idle keep-alive connections we keep open to a single origin.
+        originIdleTimeout (float): How many seconds an idle origin connection is kept before we close it.
+        clientIdleTimeout (float): How many seconds we wait for the next request on a keep-alive client connection.
+        maxRequestsPerConnection (int): The most requests we serve on one client connection before closing it.
+        cacheDir (str): The directory the disk cache is stored in.
+        defaultFreshness (float): How many seconds a cached file stays fresh when the origin sent no freshness information at all.
+        maxCacheBytes (int): The most bytes the disk cache may hold before files are evicted. Defaults to 1GB.
+        maxCacheEntries (int): The most files the disk cache may hold before files are evicted.
+        evictionPolicy (str): How files are picked for eviction, either 'lru' or 'lfu'.
+        evictionInterval (float): How many seconds between background eviction sweeps.
+        useSendfile (bool): Serve cache hits that are too big for the memory tier with sendfile instead of reading them into memory.
+        compressAtRest (bool): Store text-like bodies gzip compressed, they are sent as-is to clients that accept gzip and decompressed for the rest.
+        compressionLevel (int): The zlib level used for compressed-at-rest bodies, from 1 (fastest) to 9 (smallest).
+        sharedCache (bool): True if other worker processes serve from the same cache directory, misses then check the disk for files they wrote.
+        statsPort (int): If set, a JSON stats endpoint is served on this port on localhost.
+        statsInterval (float): If set, the stats are logged every statsInterval seconds.
+        dnsTtl (float): How many seconds an origin host lookup is cached for.
+        dnsNegativeTtl (float): How many seconds a failed origin host lookup is cached for.
+        hosts (dict): Static host name to address overrides that are used instead of DNS.
+        clientHeaderTimeout (float): How many seconds a client has to send the rest of its request once the request line arrived.
+        clientWriteTimeout (float): How many seconds a client may take to accept more of a response before we drop it.
+        originConnectTimeout (float): How many seconds we wait for a connection to an origin, including waiting for a free slot.
+        originReadTimeout (float): How many seconds an origin may go quiet while we wait for its response head or body.
+        maxInFlightRequests (int): The most requests we work on at once, the rest wait in a queue.
+        maxQueuedRequests (int): The most requests that may wait for a slot, any more are answered with a 503 straight away.
+        queueTimeout (float): How many seconds a request may wait for a slot before it is answered with a 503.
+        maxConnectionsPerOrigin (int): The most connections we have checked out to a single origin at once.
+        warmUrls (list): URLs to fetch into the cache when the server starts.
+        warmConcurrency (int): The most warming fetches running at once.
+        warmBeforeServing (bool): Finish warming the cache before accepting clients, instead of warming alongside serving.
+        prefetchLinks (bool): Prefetch the same-origin resources linked from HTML pages fetched for clients.
+        negativeCacheBytes (int): The byte budget for remembered error responses. A budget of 0 disables the negative cache.
+        negativeCacheTtl (float): The longest an error response from an origin is remembered for, in seconds.
+        negativeStatuses (tuple): The origin status codes that are remembered in the negative cache.
+        maxQueuedWriteBytes (int): The most body bytes waiting to be written to the disk cache, bodies that would go over aren't cached.
+        maxPendingWrites (int): The most bodies being written to the disk cache at once, any more aren't cached.
+        cacheWriters (int): How many background tasks write bodies to the disk cache, each one writes a body at a time.
+        staleWhileRevalidate (float): How many seconds past going stale a cached file is still served straight away while it is refreshed in the background,
+        unless the origin sent its own stale-while-revalidate.
+        staleIfError (float): How many seconds past going stale a cached file is served instead of an origin timeout or 5xx, unless the origin sent its own stale-if-error.
+        peers (list): The host:port addresses of sibling proxies to share our cache with, misses on keys a sibling owns are fetched through it.
+        peerName (str): Our own host:port address as it appears in the siblings' peer lists, required with peers.
+        peerTimeout (float): How many seconds a sibling may go quiet before we give up on it and go to the origin.
+        peerRetryDelay (float): How many seconds we go straight to the origin for a sibling's keys after it timed out or failed.
+        storageEngine (str): 'files' to store every body in a file of its own, or 'segments' to pack small bodies into large segment files.
+        segmentBytes (int): How big a segment grows before a new one is started, with the segments storage engine.
+        maxSegmentObjectBytes (int): The largest stored body packed into a segment, bigger ones still get a file of their own.
+        adminPort (int): If set, the admin interface for purging cached files is served on this port on localhost.
+        hedgePercentile (float): If set, an origin request that hasn't got its response head back after this percentile of the origin's latency,
+        as a fraction, is hedged with a second attempt.
+        hedgeBudget (float): The most hedged attempts per origin request, as a fraction, so hedging can only add this much to the origin load.
+        hedgeOtherAddress (bool): Send hedged attempts to a different resolved address of the origin than the slow attempt, if it has one.
+        fetchWindowBytes (int): The most body bytes an origin fetch keeps in memory for the clients sharing it.
+        A client that misses on a file while it is being fetched only joins the fetch while the whole body so far fits in this window.
+        """
+        if storageEngine not in ("files", "segments"):
+            raise ValueError(f"Unknown storage engine {storageEngine}, expected 'files' or 'segments'")
+        if adminPort is not None and sharedCache:
+            raise ValueError("The admin interface can't be used with workers sharing a cache directory, a purge would only reach one of them")
+        if storageEngine == "segments" and sharedCache:
+            raise ValueError("The segments storage engine can't be shared between worker processes")
+
+        # Small bodies packed into append-only segments, the index is then loaded from the store's journal instead of a scan
+        self.segmentStore = SegmentStore(Path(cacheDir) / "segments", segmentBytes, maxSegmentObjectBytes) if storageEngine == "segments" else None
+
+        # Index of the disk cache, it is loaded when the server starts
+        self.cacheIndex = CacheIndex(cacheDir, self.segmentStore)
+        self.defaultFreshness = defaultFreshness
+        self.sharedCache = sharedCache
+
+        # Grace windows for serving stale copies, while they are refreshed and while the origin is failing
+        self.staleWhileRevalidate = staleWhileRevalidate
+        self.staleIfError = staleIfError
+
+        # Hot objects are served from memory so we skip the stat and disk read on every hit
+        self.memoryCache = MemoryCache(memoryCacheBytes)
+
+        # 404s and other cacheable errors are remembered separately for a short time, so missing URLs don't go to the origin every time
+        self.negativeCache = NegativeCache(negativeCacheBytes, negativeCacheTtl)
+        self.negativeStatuses = negativeStatuses
+
+        self.useSendfile = useSendfile
+
+        # Compressed-at-rest storage for text-like bodies
+        self.compressAtRest = compressAtRest
+        self.compressionLevel = compressionLevel
+
+        # Bodies are written to the disk cache in the background so clients never wait on the disk
+        self.cacheWriter = CacheWriter(self.commitCacheWrite, self.memoryCache.admits, maxQueuedWriteBytes, maxPendingWrites, self.segmentStore,
+                                       cacheWriters)
+
+        # Keeps the disk cache under its quota, it runs as a background task once the server starts
+        self.cacheEvictor = CacheEvictor(self.cacheIndex, self.memoryCache, maxCacheBytes, maxCacheEntries, evictionPolicy, evictionInterval,
+                                         sharedCache=sharedCache)
+
+        # Reclaims the dead space evicted and replaced bodies leave in the segments, it runs next to the evictor
+        self.segmentCompactor = SegmentCompactor(self.cacheIndex, self.segmentStore, evictionInterval) if self.segmentStore is not None else None
+
+        # Origin host lookups are cached so misses don't wait on the resolver every time
+        self.dnsCache = DnsCache(dnsTtl, dnsNegativeTtl, hosts=hosts)
+
+        # Persistent connections to origin servers so misses don't pay for TCP setup every time
+        self.originPool = ConnectionPool(maxIdlePerOrigin, originIdleTimeout, self.dnsCache, maxConnectionsPerOrigin, originConnectTimeout)
+        self.originReadTimeout = originReadTimeout
+
+        # A slow origin request gets a second attempt once it is slower than the origin usually is, within a budget
+        self.hedger = RequestHedger(hedgePercentile, hedgeBudget) if hedgePercentile is not None else None
+        self.hedgeOtherAddress = hedgeOtherAddress
+
+        # Concurrent misses for the same file share a single origin fetch
+        self.coalescer = RequestCoalescer(fetchWindowBytes)
+
+        # Limits for keep-alive client connections
+        self.clientIdleTimeout = clientIdleTimeout
+        self.maxRequestsPerConnection = maxRequestsPerConnection
+        self.clientHeaderTimeout = clientHeaderTimeout
+        self.clientWriteTimeout = clientWriteTimeout
+
+        # Caps how many requests we work on at once, requests over the cap are queued and then rejected with a 503
+        self.admissionControl = AdmissionControl(maxInFlightRequests, maxQueuedRequests, queueTimeout)
+
+        # Counters and per-stage latency histograms, exposed on the stats endpoint or logged periodically
+        self.metrics = Metrics()
+        self.statsPort = statsPort
+        self.statsInterval = statsInterval
+
+        # Filling the cache ahead of the clients, from a list of URLs at startup and from the links in fetched pages
+        self.warmUrls = warmUrls
+        self.warmBeforeServing = warmBeforeServing
+        self.cacheWarmer = CacheWarmer(self, warmConcurrency)
+        self.linkPrefetcher = LinkPrefetcher(self) if prefetchLinks else None
+
+        # Sibling proxies we share our caches with, each key is owned by one proxy in the group
+        self.peerGroup = PeerGroup(peerName, peers, peerTimeout, peerRetryDelay) if peers else None
+
+        # Purging cached files by URL, prefix or host, on its own port so clients can't reach it
+        self.adminPort = adminPort
+        self.adminServer = AdminServer(self, clientIdleTimeout)
+
+    async def processClientRequest(self, reader, parser: RequestParser):
         """
-        Processes the received client requests.
+        Processes the next request received from the client.
+        Bytes are read from the client and fed to the connection's parser until it has the whole request head.
+        Only the request head is parsed, so any pipelined requests that follow are kept in the parser for the next call.
+        We wait up to clientIdleTimeout for a request to start, then the client has clientHeaderTimeout to send the rest of its head.
 
         Parameters:
-        serverSocket (socket): used for accepting and receiving client requests.
+        reader (StreamReader): StreamReader object for reading from the client.
+        parser (RequestParser): The parser for this client's connection, holding anything already read past the last request.
 
         Returns:
-        uri (list): List containing the request from the client split into a list. [0] = request type, [1] = url [2] = http version
-        clientSocket (socket): This is the created client socket used for communicating with the telnet client
+        request (HttpRequest): The parsed request. A request that couldn't be parsed is returned without a method so it fails validation.
+        Returns None if the client closed the connection or timed out before sending another request.
         """
         
         try:
-            # Accept 2KB packet size and decode it as utf-8
-            data = await reader.read(2000)
-            data = data.decode("utf-8")
+            loop = asyncio.get_running_loop()
+            startTime = None
+            request = parser.nextRequest()
+            while request is None:
+                # A client between requests may stay idle for longer than one in the middle of sending a request
+                if parser.hasPartialRequest():
+                    if startTime is None:
+                        startTime, headerDeadline = time.perf_counter(), loop.time() + self.clientHeaderTimeout
+                    timeout = headerDeadline - loop.time()
+                else:
+                    timeout = self.clientIdleTimeout
+
+                data = await asyncio.wait_for(reader.read(CLIENT_READ_SIZE), max(0.0, timeout))
+                if not data:
+                    return None
+                parser.feed(data)
+                request = parser.nextRequest()
 
             # Print the message received from the client
-            print("Received a message from this client: " + data)
+            logging.info("Received a message from this client: " + request.requestLine)
 
-            # Split the data into a list called URI
-            # Such that index 0 = GET, index 1 = URL, index 2 = HTTP Version
-            uri = data.split()
-            
-            return uri
+            # Time the parse from the first piece of the request so the wait for a keep-alive client's next request isn't counted
+            self.metrics.record("clientParse", time.perf_counter() - startTime if startTime is not None else 0.0)
+            return request
+        # A request head that is too big or isn't text can't be a valid request
+        except (HttpParseError, UnicodeDecodeError) as e:
+            logging.error(f"ERROR: Could not parse the request from the client! {e}")
+            return HttpRequest("")
+        except asyncio.TimeoutError:
+            return None
         # Exiting gracefully letting the user know they pressed Ctrl+c and the server is shutting down
         except KeyboardInterrupt:
             print("\nServer interrupted by user (Ctrl+c). Closing server.")
             reader.close()
             sys.exit(0)
 
-    async def extractRequestData(self, uri: str):
+    async def drainClient(self, writer: asyncio.StreamWriter):
+        """
+        Waits for the client to accept what we have written so far, giving up on a client that stopped reading.
+
+        Parameters:
+        writer (StreamWriter): StreamWriter object for writing to the client.
+
+        Raises:
+        asyncio.TimeoutError: If the client didn't accept the data within clientWriteTimeout.
         """
-        This function extracts all of the necessary params from the clients URI
+        await asyncio.wait_for(writer.drain(), self.clientWriteTimeout)
+
+    async def extractRequestData(self, request: HttpRequest):
+        """
+        This function extracts all of the necessary params from the clients request
 
         Parameters:
-        uri (str): this is the clients URI
+        request (HttpRequest): this is the clients request
 
         Returns:
         requestType (str): The request type which should always be GET
@@ -56,69 +280,71 @@ class Proxy:
         httpVersion (str): The requested HTTP version which will be 1.1 as we only support that.
         host (str): The host we will be requesting
         port (int): The port we will be using for the request, either user specified or default 80
-        cachePath (str): The built cache path we will be using for storing files in the cache
+        cacheKey (str): The key we will be using for storing the file in the cache, this is the host and path of the URL
         """
 
-        # Parse the url into a var called parsedURL
-        parsedURL = urlparse(uri[1])
+        # The request parses the url into parsedURL the first time we ask for it
+        parsedURL = request.url
         # Set the request type
-        requestType = uri[0]
+        requestType = request.method
         # Set the path
         path = parsedURL.path
         # Set the http version
-        httpVersion = uri[2]
+        httpVersion = request.version
         # Set the hostname
         host = parsedURL.hostname
         # Set the port If one is provided use that one if not we use the default port 80
         port = parsedURL.port if parsedURL.port is not None else 80
         
-        # Store the file we will be working from. 
+        # Store the key we will be working from. 
         # if we requested zhiju.me/networks/valid.html
-        # we will have the path .cache/zhiju.me/networks/valid.html
-        cachePath = ".cache" / Path(parsedURL.netloc) / Path(parsedURL.path.strip('/'))
+        # we will have the key zhiju.me/networks/valid.html
+        # The cache index hashes the key into the location of the file on disk
+        # Host names aren't case sensitive, so the host is lower-cased and Example.COM and example.com share one key
+        cacheKey = parsedURL.netloc.lower() + parsedURL.path
         
-        return requestType, path, httpVersion, host, port, cachePath
+        return requestType, path, httpVersion, host, port, cacheKey
 
-    async def validURI(self, uri: list, writer: asyncio.StreamWriter) -> bool:
+    async def validURI(self, request: HttpRequest, writer: asyncio.StreamWriter) -> bool:
         """
         Validates the user-submitted URI for the proxy server.
 
         Performs the following checks:
-        - Ensures the URI consists of exactly 3 parameters: GET <requested url> HTTP/1.1
+        - Ensures the request line consists of exactly 3 parameters: GET <requested url> HTTP/1.1
         - Checks if the first parameter is a GET request. Only GET requests can be made.
         - Checks if the second parameter starts with 'http://' as only HTTP requests can be made. HTTPS is NOT supported.
         - Checks if the HTTP version is 1.1 as only HTTP/1.1 is supported.
 
         Parameters:
-        uri (list): The request components from the telnet client.
+        request (HttpRequest): The request from the telnet client.
         writer (StreamWriter): The StreamWriter object used for sending error messages to the telnet client.
 
         Returns:
         bool: True if the user's URI is valid; False otherwise.
         """
 
-        # Make sure the uri list contains three elements if it doesn't let the user know and return false
-        if len(uri) != 3:
-            await writer.drain()
+        # Make sure the request line contains three elements if it doesn't let the user know and return false
+        if request.method is None:
+            await self.drainClient(writer)
             writer.write("ERROR: Your request must contain the following: GET <URL> <HTTP/1.1>\n".encode("utf-8"))
             return False
 
         # Check if the first index is a GET request if it isn't let the user know and return false
-        elif uri[0] != "GET":
-            await writer.drain()
+        elif request.method != "GET":
+            await self.drainClient(writer)
             writer.write("ERROR: This server only accepts the method GET\n".encode("utf-8"))
             return False
 
         # Check if the requested URL starts with http:// if it doesn't let them know and exit
-        elif not uri[1].startswith("http://"):
-            await writer.drain()
+        elif not request.target.startswith("http://"):
+            await self.drainClient(writer)
             writer.write("ERROR: Your URL must start with http://\n".encode("utf-8"))
             writer.write("Only HTTP requests are supported!\n".encode("utf-8"))
             return False
 
         # Check if the HTTP version is 1.1 if it isn't let the user know and return false
-        elif uri[2] != "HTTP/1.1":
-            await writer.drain()
+        elif request.version != "HTTP/1.1":
+            await self.drainClient(writer)
             writer.write("ERROR: Your HTTP Version must be HTTP/1.1\n".encode("utf-8"))
             return False
 
@@ -136,219 +362,1407 @@ class Proxy:
         writer.write("ERROR: Your Request was not properly formatted. Closing Connection\nExample Usage: GET http://zhiju.me/networks/valid.html HTTP/1.1\n".encode("utf-8"))
         writer.close()
 
-    async def readFromCache(self, cachePath: str, writer: asyncio.StreamWriter):
+    async def readFromCache(self, cacheKey: str, entry: CacheEntry, writer: asyncio.StreamWriter, clientAcceptsGzip: bool = False, ranges: list = None):
         """
         Reads the requested file from the cache and sends it to our client.
+        Files small enough for the memory tier are read and added to it so the next hit does not touch the disk.
+        Bigger files are sent with sendfile so the body goes from the page cache to the socket without being copied through python.
+        A range request only sends the ranges it asked for, straight from the file, and doesn't promote the file into the memory tier.
         
         Parameters:
-        cachePath (str): This is the path for the requested file's location. All cached items are stored under the parent folder '.cache'
+        cacheKey (str): The cache key for the requested file.
+        entry (CacheEntry): The cache index entry for the requested file. All cached items are stored under the parent folder '.cache'
         clientSocket (socket): This is the socket object used for communicating with the client.
+        clientAcceptsGzip (bool): True if a compressed-at-rest file can be sent to the client without decompressing it.
+        ranges (list): The byte ranges the client asked for, or None to send the whole file.
 
+        Returns:
+        bool: False if the file was missing from the disk or replaced and nothing was sent, so the caller can go to the origin instead; True otherwise.
         """
         try:
-            print("Serving the requested file from the cache to the client!")
+            logging.info("Serving the requested file from the cache to the client!")
+
+            if ranges is not None:
+                await self.sendRanges(writer, entry, ranges)
+                return True
+
+            # With sendfile the kernel reads the disk and writes the socket together, so it is timed as a client write
+            if self.useSendfile and not self.memoryCache.admits(entry.size):
+                with self.metrics.timer("clientWrite"):
+                    await self.sendfileFromCache(writer, entry, clientAcceptsGzip)
+                return True
 
             # We will be storing the cachedResponse to this variable
             cachedResponse = b''
 
             # Read the contents of the requested file (which is a bytes-like object) 
-            # we will decode it and store it to the cachedResponse variable
-            async with aiofiles.open(cachePath, 'rb') as file:
-                cachedResponse = await file.read()
-        
-            # This done to strip the byte-like b'' format from python
-            cachedResponse = cachedResponse.decode('utf-8')    
+            with self.metrics.timer("diskRead"):
+                cachedResponse = await self.readStoredBody(entry)
 
-            # Since we will only save the requested file to the cache when the request is 200 
-            # it is safe to hardcode the HTTP status message
-            writer.write("HTTP/1.1 200 OK\n".encode("utf-8"))
-            await writer.drain()
-            # Send the Cache-Hit status, since we are pulling from the cache, the cache hit is 1
-            writer.write(f"Cache-Hit: 1\n".encode("utf-8"))
-            await writer.drain()
-            # Send the body content to our client
-            writer.write(f"\n\n{cachedResponse}\n\n".encode("utf-8"))
-            await writer.drain()
+            # Promote the file into the memory tier, compressed files are kept compressed
+            self.memoryCache.put(cacheKey, cachedResponse)
+
+            await self.sendCachedResponse(writer, cachedResponse, entry, clientAcceptsGzip)
+            return True
+
+        except FileNotFoundError as e:
+            # Another worker evicted or replaced the file, or someone deleted it behind our back
+            # The file is opened and checked against the entry before anything is sent, so the client can still be answered from the origin
+            # Dropping our entry lets the next lookup load the copy another worker put in its place
+            logging.error(f"ERROR: Cached file is missing! Treating it as a miss. {e}")
+            self.metrics.increment("replacedFiles" if isinstance(e, ReplacedFileError) else "missingFiles")
+            if self.cacheIndex.lookup(cacheKey) is entry:
+                self.cacheIndex.remove(cacheKey)
+                self.memoryCache.remove(cacheKey)
+            return False
 
         except Exception as e:
             logging.error(f"ERROR: Failed to read from cache! Dropping connection. {e}")
             writer.close()
             await writer.wait_closed()
+            return True
 
-    async def requestFromOrigin(self, requestType: str, path: str, httpVersion: str, host: str, port: int):
+    async def readStoredBody(self, entry: CacheEntry) -> bytes:
+        """
+        Reads a whole cached body as it is stored, from its own file or with pread from its segment.
+
+        Parameters:
+        entry (CacheEntry): The cache index entry for the file.
+
+        Returns:
+        body (bytes): The stored body.
+
+        Raises:
+        ReplacedFileError: If another worker replaced the file since the entry was loaded.
+        """
+        if entry.segment is not None:
+            return await asyncio.to_thread(self.segmentStore.read, entry)
+        file = await asyncio.to_thread(self.cacheIndex.openBody, entry)
+        with file:
+            return await asyncio.to_thread(file.read)
+
+    async def sendfileFromCache(self, writer: asyncio.StreamWriter, entry: CacheEntry, clientAcceptsGzip: bool = False):
+        """
+        Sends a cached file to our client using the kernel's sendfile after writing the response head.
+        If the transport can't do sendfile, for example a TLS transport, the file is streamed in chunks instead.
+        A compressed-at-rest file going to a client that doesn't accept gzip is decompressed in chunks as it is sent.
+
+        Parameters:
+        writer (StreamWriter): StreamWriter object used for sending messages back to the client.
+        entry (CacheEntry): The cache index entry for the requested file.
+        clientAcceptsGzip (bool): True if a compressed-at-rest file can be sent to the client without decompressing it.
+        """
+        file = await asyncio.to_thread(self.cacheIndex.openBody, entry)
         try:
-            # Make a request to the origin server
-            reader, writer = await asyncio.open_connection(host, 80)
-
-            # Build the request to the origin server
-            httpRequest = f"{requestType} {path} {httpVersion}\nHost: {host}:{port}\nConnection: close\n\n"
-            
-            # Send the request
-            writer.write(httpRequest.encode('utf-8'))
-            await writer.drain()
+            if entry.storedEncoding is not None and not clientAcceptsGzip:
+                writer.write(self.cachedResponseHead(entry.identitySize, entry, None))
+                await self.drainClient(writer)
 
-            # Receive the response
-            origin_response = await reader.read(4096)
-            return origin_response
+                # sendfile can't change the bytes, so read the file in a worker thread and decompress it as we go
+                # A body in a segment starts at its offset and ends where the next body starts
+                decompressor = newDecompressor()
+                await asyncio.to_thread(file.seek, entry.offset)
+                remaining = entry.size
+                while remaining > 0:
+                    chunk = await asyncio.to_thread(file.read, min(remaining, BODY_CHUNK_SIZE))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    writer.write(decompressor.decompress(chunk))
+                    await self.drainClient(writer)
+                writer.write(decompressor.flush())
+                await self.drainClient(writer)
+                return
 
-        except Exception as e:
-            return f"An error occurred during the request to the origin server: {e}"
+            writer.write(self.cachedResponseHead(entry.size, entry, self.responseEncoding(entry, clientAcceptsGzip)))
+            await self.drainClient(writer)
+            await self.sendFileSection(writer, file, entry.offset, entry.size)
+        finally:
+            file.close()
+
+    async def sendFileSection(self, writer: asyncio.StreamWriter, file, offset: int, count: int):
+        """
+        Sends part of an open cached file to our client with sendfile, anything already written to the client goes out first.
+        The section is sent in slices of SENDFILE_SLICE_BYTES, each of which the client must accept within clientWriteTimeout.
+        If the transport can't do sendfile the section is read in chunks instead.
+
+        Parameters:
+        writer (StreamWriter): StreamWriter object used for sending messages back to the client.
+        file (file): The cached file, opened for reading in binary mode.
+        offset (int): Where in the file the section starts.
+        count (int): How many bytes to send.
+
+        Raises:
+        asyncio.TimeoutError: If the client didn't accept a slice within clientWriteTimeout.
+        """
+        try:
+            end = offset + count
+            while offset < end:
+                sliceBytes = min(end - offset, SENDFILE_SLICE_BYTES)
+                sent = await asyncio.wait_for(asyncio.get_running_loop().sendfile(writer.transport, file, offset, sliceBytes, fallback=False),
+                                              self.clientWriteTimeout)
+                if sent == 0:
+                    raise OSError(f"Cached file {file.name} is shorter than its index entry")
+                offset += sent
+                count -= sent
+        except asyncio.SendfileNotAvailableError:
+            # Read the file in a worker thread so the event loop never waits on the disk
+            await asyncio.to_thread(file.seek, offset)
+            remaining = count
+            while remaining > 0:
+                chunk = await asyncio.to_thread(file.read, min(remaining, BODY_CHUNK_SIZE))
+                if not chunk:
+                    raise OSError(f"Cached file {file.name} is shorter than its index entry")
+                remaining -= len(chunk)
+                writer.write(chunk)
+                await self.drainClient(writer)
+
+    async def sendRanges(self, writer: asyncio.StreamWriter, entry: CacheEntry, ranges: list, cachedResponse: bytes = None):
+        """
+        Sends a 206 Partial Content response for a range request on a cached file.
+        A single range is sent as it is, several ranges are sent as a multipart/byteranges body.
+        Ranges are sliced out of the memory tier if we have the body there, otherwise each one is seeked to and sent with sendfile.
+        If none of the ranges can be satisfied the client gets a 416 instead.
+
+        Parameters:
+        writer (StreamWriter): StreamWriter object used for sending messages back to the client.
+        entry (CacheEntry): The cache index entry for the file, it must be stored unencoded by us so the offsets line up.
+        ranges (list): The ranges to send as (first, last) byte offsets.
+        cachedResponse (bytes): The body from the memory tier, or None to send the ranges from the file.
+        """
+        if not ranges:
+            await self.sendRangeNotSatisfiable(writer, entry.size, 1)
+            return
+        self.metrics.increment("rangeRequests")
+
+        contentType = entry.headers.get("content-type")
+        responseHead = "HTTP/1.1 206 Partial Content\r\nCache-Hit: 1\r\nAccept-Ranges: bytes\r\n"
+        if len(ranges) == 1:
+            # A single range has its Content-Range in the response head and no part heads
+            partHeads, tail = [b''], b''
+            responseHead += f"Content-Range: {contentRange(ranges[0][0], ranges[0][1], entry.size)}\r\n"
+            if contentType is not None:
+                responseHead += f"Content-Type: {contentType}\r\n"
+        else:
+            boundary = newBoundary()
+            partHeads, tail = multipartHeads(ranges, entry.size, contentType, boundary), multipartTail(boundary)
+            responseHead += f"Content-Type: multipart/byteranges; boundary={boundary}\r\n"
+        if "content-encoding" in entry.headers:
+            responseHead += f"Content-Encoding: {entry.headers['content-encoding']}\r\n"
+
+        # Work out the length up front so the connection can be kept alive
+        length = sum(last - first + 1 for first, last in ranges) + sum(len(partHead) for partHead in partHeads) + len(tail)
+        responseHead = f"{responseHead}Content-Length: {length}\r\n\r\n".encode("utf-8")
+
+        with self.metrics.timer("clientWrite"):
+            if cachedResponse is not None:
+                # Slice the body through a memoryview so the ranges aren't copied before they are written
+                body = memoryview(cachedResponse)
+                parts = [responseHead]
+                for partHead, (first, last) in zip(partHeads, ranges):
+                    parts += [partHead, body[first:last + 1]]
+                parts.append(tail)
+                writer.writelines(parts)
+                await self.drainClient(writer)
+                return
+
+            # Open the file before sending anything, so a missing or replaced file can still be answered from the origin
+            file = await asyncio.to_thread(self.cacheIndex.openBody, entry)
+            writer.write(responseHead)
+            try:
+                for partHead, (first, last) in zip(partHeads, ranges):
+                    writer.write(partHead)
+                    await self.drainClient(writer)
+                    await self.sendFileSection(writer, file, entry.offset + first, last - first + 1)
+            finally:
+                file.close()
+            writer.write(tail)
+            await self.drainClient(writer)
+
+    async def sendRangeNotSatisfiable(self, writer: asyncio.StreamWriter, size: int, cacheHit: int):
+        """
+        Sends a 416 for a range request where none of the ranges overlap the body.
+
+        Parameters:
+        writer (StreamWriter): StreamWriter object used for sending messages back to the client.
+        size (int): The size of the full body, so the client can ask again with a range that fits.
+        cacheHit (int): The Cache-Hit header value, 1 if the body came from our cache.
+        """
+        self.metrics.increment("rangeNotSatisfiable")
+        writer.write(f"HTTP/1.1 416 Range Not Satisfiable\r\nCache-Hit: {cacheHit}\r\nContent-Range: bytes */{size}\r\nContent-Length: 0\r\n\r\n".encode("utf-8"))
+        await self.drainClient(writer)
+
+    @staticmethod
+    def responseEncoding(entry: CacheEntry, clientAcceptsGzip: bool):
+        """
+        Works out the Content-Encoding of a cache hit as the client will receive it.
+
+        Parameters:
+        entry (CacheEntry): The cache index entry for the file.
+        clientAcceptsGzip (bool): True if the client accepts a gzip encoded body.
+
+        Returns:
+        encoding (str): The Content-Encoding to send, or None if the body is sent unencoded.
+        """
+        # Bodies we compressed ourselves are only sent compressed to clients that asked for it
+        if entry.storedEncoding is not None:
+            return entry.storedEncoding if clientAcceptsGzip else None
+
+        # Otherwise the body is exactly what the origin sent, including any encoding it applied
+        return entry.headers.get("content-encoding")
+
+    def cachedResponseHead(self, size: int, entry: CacheEntry, contentEncoding: str = None) -> bytes:
+        """
+        Builds the status line and headers we send for a cache hit.
+
+        Parameters:
+        size (int): The size of the body we are sending.
+        entry (CacheEntry): The cache index entry for the file, holding the stored origin headers.
+        contentEncoding (str): The Content-Encoding of the body we are sending, None if it is unencoded.
+
+        Returns:
+        responseHead (bytes): The encoded response head, including the empty line that ends it.
+        """
+        # Since we will only save the requested file to the cache when the request is 200 
+        # it is safe to hardcode the HTTP status message
+        # Send the Cache-Hit status, since we are pulling from the cache, the cache hit is 1
+        responseHead = f"HTTP/1.1 200 OK\r\nCache-Hit: 1\r\nContent-Length: {size}\r\n"
+        if "content-type" in entry.headers:
+            responseHead += f"Content-Type: {entry.headers['content-type']}\r\n"
+        if contentEncoding is not None:
+            responseHead += f"Content-Encoding: {contentEncoding}\r\n"
+        # The body depends on Accept-Encoding when we compressed it ourselves, so tell any caches downstream
+        # Ranges can only be served from files whose bytes on disk are the bytes the client sees
+        if entry.storedEncoding is not None:
+            responseHead += "Vary: Accept-Encoding\r\n"
+        else:
+            responseHead += "Accept-Ranges: bytes\r\n"
+        return f"{responseHead}\r\n".encode("utf-8")
+
+    async def sendCachedResponse(self, writer: asyncio.StreamWriter, cachedResponse: bytes, entry: CacheEntry, clientAcceptsGzip: bool = False):
+        """
+        Sends a cached body to our client, this is shared by the memory tier and the disk cache.
+        A compressed-at-rest body is decompressed first if the client doesn't accept gzip.
+
+        Parameters:
+        writer (StreamWriter): StreamWriter object used for sending messages back to the client.
+        cachedResponse (bytes): The body of the cached file, as it is stored.
+        entry (CacheEntry): The cache index entry for the file, holding the stored origin headers.
+        clientAcceptsGzip (bool): True if the client accepts a gzip encoded body.
+        """
+        if entry.storedEncoding is not None and not clientAcceptsGzip:
+            cachedResponse = decompress(cachedResponse)
+
+        # Send the head and the body content to our client in a single write
+        with self.metrics.timer("clientWrite"):
+            writer.writelines([self.cachedResponseHead(len(cachedResponse), entry, self.responseEncoding(entry, clientAcceptsGzip)), cachedResponse])
+            await self.drainClient(writer)
+
+    async def requestFromOrigin(self, requestType: str, path: str, httpVersion: str, host: str, port: int, extraHeaders: dict = None,
+                                readTimeout: float = None, avoidAddress: str = None, connections: list = None):
+        """
+        Sends the request to the origin server over a pooled keep-alive connection and reads the response head.
+        The body is not read here, it is streamed by handleOriginResponse as it arrives.
+        If a reused connection turns out to have been closed by the origin we retry once on a fresh connection.
+
+        Parameters:
+        requestType (str): The request type which should always be GET
+        path (str): The path for the requested file
+        httpVersion (str): The HTTP version we send to the origin
+        host (str): The host we will be requesting
+        port (int): The port on the origin server
+        extraHeaders (dict): Any additional request headers, for example the validators for a conditional request
+        readTimeout (float): How many seconds we wait for the response head, defaults to originReadTimeout.
+        avoidAddress (str): Prefer any other resolved address of the origin over this one.
+        connections (list): If given, every connection we check out is appended to it, so a hedged attempt can see where this one went.
+
+        Returns:
+        connection (OriginConnection): The origin connection, positioned at the start of the body.
+        statusLine (str): Status line contains the HTTP status of the request.
+        statusCode (str): The status code from the status line.
+        headers (dict): The response headers with lower-cased names.
+        Returns None if the request failed.
+
+        Raises:
+        OriginBusyError: If the origin is at its connection limit, so the caller can answer with a 503.
+        """
+        # Build the request to the origin server, we ask to keep the connection open so it can go back in the pool
+        httpRequest = f"{requestType} {path} {httpVersion}\r\nHost: {host}:{port}\r\nConnection: keep-alive\r\n"
+        for name, value in (extraHeaders or {}).items():
+            httpRequest += f"{name}: {value}\r\n"
+        httpRequest += "\r\n"
+
+        while True:
+            connection = None
+            try:
+                with self.metrics.timer("originConnect"):
+                    connection = await self.originPool.acquire(host, port, avoidAddress)
+                if connections is not None:
+                    connections.append(connection)
+
+                # Send the request
+                startTime = time.perf_counter()
+                connection.writer.write(httpRequest.encode('utf-8'))
+                await connection.writer.drain()
+
+                # Read the status line and the headers, the body is streamed later
+                statusLine, statusCode, headers = await asyncio.wait_for(readResponseHead(connection.reader), readTimeout or self.originReadTimeout)
+                self.metrics.record("originFirstByte", time.perf_counter() - startTime)
+                return connection, statusLine, statusCode, headers
+
+            except (HttpParseError, ConnectionError, asyncio.IncompleteReadError) as e:
+                if connection is None:
+                    logging.error(f"ERROR: An error occurred during the request to the origin server: {e}")
+                    return None
+
+                self.originPool.discard(connection)
+
+                # The origin may have closed an idle connection just as we reused it, so try again on a new one
+                if not connection.reused:
+                    logging.error(f"ERROR: Failed to read the response from the origin server! {e}")
+                    return None
+
+            except OriginBusyError:
+                raise
+
+            except asyncio.CancelledError:
+                # A hedged attempt that lost, its connection is part way through a request so it can't go back in the pool
+                if connection is not None:
+                    self.originPool.discard(connection)
+                raise
+
+            except asyncio.TimeoutError:
+                logging.error(f"ERROR: Timed out waiting for the origin server {host}:{port}!")
+                if connection is not None:
+                    self.originPool.discard(connection)
+                return None
+
+            except Exception as e:
+                logging.error(f"ERROR: An error occurred during the request to the origin server: {e}")
+                if connection is not None:
+                    self.originPool.discard(connection)
+                return None
+
+    async def hedgedRequestFromOrigin(self, requestType: str, path: str, httpVersion: str, host: str, port: int, extraHeaders: dict = None):
+        """
+        Sends the request to the origin like requestFromOrigin, hedging it if its response head is slow to arrive.
+        Once the first attempt has waited longer than the origin's hedge delay, and the hedge budget allows it, a second attempt is sent.
+        The first attempt to get a response head back is used and the other is cancelled, if one fails we wait for the other.
+
+        Parameters:
+        requestType (str): The request type which should always be GET
+        path (str): The path for the requested file
+        httpVersion (str): The HTTP version we send to the origin
+        host (str): The host we will be requesting
+        port (int): The port on the origin server
+        extraHeaders (dict): Any additional request headers, for example the validators for a conditional request
+
+        Returns:
+        The same as requestFromOrigin, None if every attempt failed.
+
+        Raises:
+        OriginBusyError: If the origin is at its connection limit and no attempt got a response.
+        """
+        if self.hedger is None:
+            return await self.requestFromOrigin(requestType, path, httpVersion, host, port, extraHeaders)
+
+        startTime = time.perf_counter()
+        delay = self.hedger.delayFor(host, port)
+
+        # Until we know how fast the origin usually is there is nothing to hedge against, so just learn its latency
+        if delay is None:
+            originResponse = await self.requestFromOrigin(requestType, path, httpVersion, host, port, extraHeaders)
+            if originResponse is not None:
+                self.hedger.record(host, port, time.perf_counter() - startTime)
+            return originResponse
+
+        # Maps each attempt to True if it is the hedge
+        primaryConnections = []
+        attempts = {asyncio.create_task(self.requestFromOrigin(requestType, path, httpVersion, host, port, extraHeaders,
+                                                               connections=primaryConnections)): False}
+        winner = None
+        busyError = None
+        try:
+            done, pending = await asyncio.wait(attempts, timeout=delay)
+
+            # The first attempt is slower than the origin usually is, so send a second one if the budget allows it
+            if pending and self.hedger.allow():
+                avoidAddress = primaryConnections[-1].address if self.hedgeOtherAddress and primaryConnections else None
+                hedge = asyncio.create_task(self.requestFromOrigin(requestType, path, httpVersion, host, port, extraHeaders, avoidAddress=avoidAddress))
+                attempts[hedge] = True
+                pending.add(hedge)
+
+            while True:
+                for attempt in done:
+                    try:
+                        originResponse = attempt.result()
+                    except OriginBusyError as e:
+                        busyError = e
+                        continue
+                    if originResponse is not None:
+                        winner = attempt
+                        if len(attempts) > 1:
+                            self.hedger.won(attempts[attempt])
+                        # A hedge that won only tells us the first attempt took at least this long, which is still worth counting
+                        self.hedger.record(host, port, time.perf_counter() - startTime)
+                        return originResponse
+
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+            if busyError is not None:
+                raise busyError
+            return None
 
         finally:
-            # Close the writer to indicate that we're done
-            writer.close()
-            await writer.wait_closed()
+            # Cancel the attempt that lost, or give back its connection if it answered at the same time as the winner
+            for attempt in attempts:
+                if attempt is winner:
+                    continue
+                if not attempt.done():
+                    attempt.cancel()
+                elif not attempt.cancelled() and attempt.exception() is None and attempt.result() is not None:
+                    self.originPool.discard(attempt.result()[0])
+
+    async def fetchFromOrigin(self, fetch: InFlightFetch, requestType: str, path: str, httpVersion: str, host: str, port: int, cacheKey: str,
+                              staleEntry: CacheEntry = None, usePeers: bool = True):
+        """
+        Runs a single origin fetch for a cache key and publishes it to every client waiting on it.
+        If we have a stale copy with validators the request is made conditional, and a 304 refreshes our copy without moving the body again.
+        If the status code is 200 the body and the origin headers are written to our cache as the body arrives.
+        This runs as its own task so a client disconnecting doesn't cancel the fetch for everyone else.
+        On a miss for a key a sibling proxy owns the sibling is asked first, we only go to the origin if it can't answer.
 
-    async def handleOriginResponse(self, writer: asyncio.StreamWriter, response: bytes, cachePath: str):
+        Parameters:
+        fetch (InFlightFetch): The fetch the response is published to.
+        requestType (str): The request type which should always be GET
+        path (str): The path for the requested file
+        httpVersion (str): The HTTP version we send to the origin
+        host (str): The host we will be requesting
+        port (int): The port on the origin server
+        cacheKey (str): The cache key for the requested file, the cache index gives us the location we will be writing it to.
+        staleEntry (CacheEntry): Our stale copy of the file if we have one, used for revalidation.
+        usePeers (bool): Ask the sibling proxy that owns the key first. False for requests a sibling forwarded to us.
+        """
+        complete = False
+        try:
+            # A stale copy of ours is cheaper to revalidate with the origin, so siblings are only asked on a miss
+            if usePeers and staleEntry is None and self.peerGroup is not None:
+                peer = self.peerGroup.peerFor(cacheKey)
+                if peer is not None:
+                    complete = await self.fetchFromPeer(fetch, peer, requestType, httpVersion, cacheKey)
+                    if complete is not None:
+                        return
+                    complete = False
+
+            # Ask the origin to only send the body if it changed since our copy was stored
+            validators = conditionalHeaders(staleEntry.headers) if staleEntry is not None else {}
+
+            try:
+                originResponse = await self.hedgedRequestFromOrigin(requestType, path, httpVersion, host, port, validators)
+            except OriginBusyError as e:
+                # Shed the request instead of queueing it behind a struggling origin
+                logging.error(f"ERROR: {e}, answering with a 503")
+                self.metrics.increment("originBusy")
+                fetch.setHead("HTTP/1.1 503 Service Unavailable", "503", {})
+                complete = True
+                return
+
+            if originResponse is None:
+                self.metrics.increment("originErrors")
+                return
+
+            connection, statusLine, statusCode, headers = originResponse
+            self.metrics.increment(f"originStatus{statusCode}")
+            try:
+                if statusCode == "304" and validators:
+                    # Our copy is still good, refresh its headers and serve it
+                    complete = await self.handleNotModifiedResponse(fetch, cacheKey, staleEntry, headers)
+                elif statusCode == "200":
+                    fetch.setHead(statusLine, statusCode, headers)
+                    complete = await self.storeOriginBody(fetch, connection, headers, cacheKey)
+                else:
+                    # Error bodies aren't passed on to the client, but they still have to be read so the connection can be reused
+                    fetch.setHead(statusLine, statusCode, headers)
+                    if hasBody(statusCode):
+                        async for _ in readBody(connection.reader, headers, self.originReadTimeout):
+                            pass
+                    complete = True
+                    if not fetch.purged:
+                        await self.storeNegativeResponse(cacheKey, statusLine, statusCode, headers)
+
+            except (HttpParseError, ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                logging.error(f"ERROR: The response from the origin server was cut short! {e!r}")
+
+            finally:
+                # Only hand the connection back to the pool if we read the whole response and the origin will keep it open
+                if complete and isPersistent(statusLine, headers):
+                    self.originPool.release(connection)
+                else:
+                    self.originPool.discard(connection)
+
+        finally:
+            fetch.finish(complete)
+
+            # From here on new misses go to the cache, or start a new fetch if this one failed
+            # Until the cache writer has put the file in place, new misses keep joining this fetch and get its body from memory
+            if fetch.cacheWrite is not None:
+                fetch.cacheWrite.onDone(lambda: self.coalescer.remove(cacheKey, fetch))
+            else:
+                self.coalescer.remove(cacheKey, fetch)
+
+    async def fetchFromPeer(self, fetch: InFlightFetch, peer: Peer, requestType: str, httpVersion: str, cacheKey: str):
+        """
+        Fetches a file through the sibling proxy that owns it, publishing its response to every client waiting on the fetch.
+        The sibling serves it from its cache or fetches it from the origin into its cache, so we don't keep a copy ourselves.
+        If the sibling can't be reached, times out or answers with a 5xx before the head is published, the caller goes to the origin instead.
+
+        Parameters:
+        fetch (InFlightFetch): The fetch the response is published to.
+        peer (Peer): The sibling that owns the key.
+        requestType (str): The request type which should always be GET
+        httpVersion (str): The HTTP version we send to the sibling
+        cacheKey (str): The cache key for the requested file, the sibling gets the same key from the URL we send it.
+
+        Returns:
+        complete (bool): True if the sibling's whole response was published; False if it was cut short part way through;
+        None if the sibling couldn't answer and nothing was published.
+        """
+        startTime = time.perf_counter()
+        try:
+            # The sibling is a proxy, so it gets the whole URL, and the peer header stops it from forwarding the request again
+            peerResponse = await self.requestFromOrigin(requestType, f"http://{cacheKey}", httpVersion, peer.host, peer.port,
+                                                        {PEER_HEADER: self.peerGroup.name}, self.peerGroup.timeout)
+        except OriginBusyError:
+            peerResponse = None
+        self.metrics.record("peerFirstByte", time.perf_counter() - startTime)
+
+        if peerResponse is None:
+            # requestFromOrigin doesn't tell us why it failed, but only a timeout takes the whole timeout
+            timedOut = time.perf_counter() - startTime >= self.peerGroup.timeout
+            self.peerGroup.failed(peer, timedOut)
+            self.metrics.increment("peerTimeouts" if timedOut else "peerErrors")
+            logging.error(f"ERROR: The peer {peer.address} {'timed out' if timedOut else 'failed'}, going to the origin instead")
+            return None
+
+        connection, statusLine, statusCode, headers = peerResponse
+
+        # The sibling's own 502, 503 or 504 means it couldn't get the file either, but the origin may still answer us
+        if statusCode.startswith("5"):
+            self.originPool.discard(connection)
+            self.peerGroup.failed(peer, False)
+            self.metrics.increment("peerErrors")
+            return None
+
+        hit = headers.get("cache-hit") == "1"
+        self.peerGroup.succeeded(peer, hit)
+        self.metrics.increment("peerHits" if hit else "peerMisses")
+
+        fetch.peer = peer
+        fetch.setHead(statusLine, statusCode, headers)
+        complete = False
+        try:
+            if hasBody(statusCode):
+                async for chunk in readBody(connection.reader, headers, self.peerGroup.timeout):
+                    fetch.append(chunk)
+                    await fetch.waitForReaders()
+            complete = True
+        except (HttpParseError, ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            logging.error(f"ERROR: The response from the peer {peer.address} was cut short! {e!r}")
+        finally:
+            if complete and isPersistent(statusLine, headers):
+                self.originPool.release(connection)
+            else:
+                self.originPool.discard(connection)
+        return complete
+
+    async def storeNegativeResponse(self, cacheKey: str, statusLine: str, statusCode: str, headers: dict):
+        """
+        Remembers an error response from the origin in the negative cache if its status is one we cache and the origin allows it.
+        The origin's own freshness lifetime is used if it is shorter than our TTL.
+        A file and its error can't both be cached, so any copy we have of the file is dropped as the origin says it is gone.
+
+        Parameters:
+        cacheKey (str): The cache key for the requested file.
+        statusLine (str): The status line the origin sent.
+        statusCode (str): The status code from the status line.
+        headers (dict): The response headers with lower-cased names.
+        """
+        if statusCode not in self.negativeStatuses or not isStorable(headers):
+            return
+        self.negativeCache.put(cacheKey, statusLine, statusCode, freshnessLifetime(headers, time.time(), self.negativeCache.ttl))
+        if self.cacheIndex.lookup(cacheKey) is not None:
+            await self.removeFromCache(cacheKey)
+
+    async def storeOriginBody(self, fetch: InFlightFetch, connection: OriginConnection, headers: dict, cacheKey: str) -> bool:
+        """
+        Reads a 200 body from the origin, publishing it to the waiting clients and handing it to the cache writer as it arrives.
+        The cache writer stores the body in the background, so the clients never wait on the disk, and renames it into place once complete.
+        If the origin fails part way through, or the writer is too far behind, the body is thrown away instead of being cached.
+        With compressAtRest, text-like bodies are gzip compressed on the way to disk while the clients still get the origin's bytes.
+
+        Parameters:
+        fetch (InFlightFetch): The fetch the body is published to.
+        connection (OriginConnection): The origin connection, positioned at the start of the body.
+        headers (dict): The response headers with lower-cased names.
+        cacheKey (str): The cache key for the requested file.
+
+        Returns:
+        bool: True if the whole body was read from the origin; False otherwise.
+        """
+        cacheWrite = None
+        complete = False
+
+        # Responses marked no-store or private must not be kept by a shared cache, so drop any copy we have
+        if not isStorable(headers):
+            await self.removeFromCache(cacheKey)
+        # The key was purged after this fetch started, so the body may be the very one the purge was meant to get rid of
+        elif fetch.purged:
+            logging.info("The requested file was purged while it was being fetched, not caching it!")
+        else:
+            logging.info("Response Received from server, and status code is 200!\nWriting to cache...")
+
+            # Compress text-like bodies as they are written, anything the origin already encoded is stored as-is
+            compressor = newCompressor(self.compressionLevel) if self.compressAtRest and isCompressible(headers) else None
+            cacheWrite = fetch.cacheWrite = self.cacheWriter.begin(cacheKey, self.cacheIndex.pathFor(cacheKey), compressor)
+            if cacheWrite is None:
+                self.metrics.increment("droppedCacheWrites")
+
+        # A body we aren't caching isn't kept for clients that miss on it later, they fetch it themselves
+        if cacheWrite is None:
+            fetch.stopRetaining()
+            self.coalescer.remove(cacheKey, fetch)
+
+        bodyStartTime = time.perf_counter()
+        try:
+            async for chunk in readBody(connection.reader, headers, self.originReadTimeout):
+                # Hand the chunk to the waiting clients first, then queue it for our cache file
+                fetch.append(chunk)
+                if cacheWrite is not None:
+                    self.cacheWriter.append(cacheWrite, chunk)
+
+                # Don't read further ahead of the slowest client than the fetch's window
+                await fetch.waitForReaders()
+
+            complete = True
+
+        finally:
+            self.metrics.record("originBody", time.perf_counter() - bodyStartTime)
+
+            # If the response was already some seconds old when it reached us, count that against its freshness
+            if cacheWrite is not None:
+                self.cacheWriter.finish(cacheWrite, complete, headers, time.time() - self.parseAge(headers))
+
+        return complete
+
+    async def commitCacheWrite(self, cacheWrite: CacheWrite):
+        """
+        Records a body the cache writer has just renamed into place, this is called by the cache writer.
+
+        Parameters:
+        cacheWrite (CacheWrite): The finished write.
+        """
+        startTime = time.perf_counter()
+
+        # Record the new file in the index so lookups can find it without touching the disk
+        # This happens before anything is awaited, the cache writer renamed the file into place just before calling us
+        storedEncoding = "gzip" if cacheWrite.compressor is not None else None
+        self.negativeCache.remove(cacheWrite.key)
+        entry = self.cacheIndex.add(cacheWrite.key, cacheWrite.storedBytes, storedHeaders(cacheWrite.headers), cacheWrite.storedTime,
+                                    storedEncoding, cacheWrite.bodyBytes, cacheWrite.segment, cacheWrite.offset, cacheWrite.fileStat)
+        await self.writeMetadata(cacheWrite.key, entry)
+        self.metrics.record("cacheWrite", cacheWrite.writeTime + time.perf_counter() - startTime)
+
+        # Keep the freshly fetched body in the memory tier as well
+        if cacheWrite.memoryChunks is not None:
+            self.memoryCache.put(cacheWrite.key, b''.join(cacheWrite.memoryChunks))
+
+    async def handleNotModifiedResponse(self, fetch: InFlightFetch, cacheKey: str, entry: CacheEntry, headers: dict) -> bool:
+        """
+        If the origin answered our conditional request with a 304 our stale copy is still good.
+        The new origin headers are merged into the stored ones, the stored time is reset and the cached body is published to the waiting clients.
+        A compressed-at-rest body is decompressed as it is published, since the waiting clients may not all accept gzip.
+        If another worker sharing the cache replaced the file meanwhile, its copy is published instead of refreshing ours.
+
+        Parameters:
+        fetch (InFlightFetch): The fetch the cached body is published to.
+        cacheKey (str): The cache key for the requested file.
+        entry (CacheEntry): Our stale copy of the file.
+        headers (dict): The headers from the 304 response with lower-cased names.
+
+        Returns:
+        bool: True if the whole cached body was published; False otherwise.
+        """
+        # Our copy was purged while we were revalidating it, so there is nothing left to refresh
+        if fetch.purged:
+            logging.error("ERROR: The cached file was purged while it was being revalidated!")
+            return False
+
+        logging.info("Origin server says our cached copy is still valid (304), refreshing it!")
+
+        # The compactor swaps in a new entry when it moves a body, so refresh the entry the index has now
+        entry = self.cacheIndex.lookup(cacheKey) or entry
+        cachedResponse = self.memoryCache.get(cacheKey)
+
+        # Open our copy before refreshing it, another worker sharing the cache may have replaced the file since we indexed it
+        # Its copy was fetched after ours, so that is published as it is instead
+        file = None
+        refresh = True
+        try:
+            if cachedResponse is None and entry.segment is None:
+                try:
+                    file = await asyncio.to_thread(self.cacheIndex.openBody, entry)
+                except ReplacedFileError:
+                    loaded = await asyncio.to_thread(self.cacheIndex.loadKey, cacheKey) if self.sharedCache else None
+                    if loaded is None:
+                        raise
+                    file = await asyncio.to_thread(self.cacheIndex.openBody, loaded)
+                    if self.cacheIndex.lookup(cacheKey) is entry:
+                        self.cacheIndex.remove(cacheKey)
+                    entry = self.cacheIndex.insert(loaded)
+                    refresh = False
+        except OSError as e:
+            logging.error(f"ERROR: The revalidated file is missing from the cache! {e}")
+            self.metrics.increment("replacedFiles" if isinstance(e, ReplacedFileError) else "missingFiles")
+            if self.cacheIndex.lookup(cacheKey) is entry:
+                self.cacheIndex.remove(cacheKey)
+            return False
+
+        if refresh:
+            refreshedHeaders = dict(entry.headers)
+            refreshedHeaders.update(storedHeaders(headers))
+            entry = self.cacheIndex.add(cacheKey, entry.size, refreshedHeaders, time.time() - self.parseAge(headers),
+                                        entry.storedEncoding, entry.identitySize, entry.segment, entry.offset, entry.fileStat)
+            await self.writeMetadata(cacheKey, entry)
+
+        # Publish our copy as a 200 so the waiting clients are served the same way as a cache hit
+        fetch.fromCache = True
+        fetch.setHead("HTTP/1.1 200 OK", "200", {"content-length": str(entry.identitySize), **storedHeaders(entry.headers)})
+
+        decompressor = newDecompressor() if entry.storedEncoding is not None else None
+        try:
+            # A body packed into a segment is small, so it is read in one go rather than streamed
+            if cachedResponse is None and entry.segment is not None:
+                cachedResponse = await self.readStoredBody(entry)
+
+            if cachedResponse is not None:
+                fetch.append(decompress(cachedResponse) if decompressor is not None else cachedResponse)
+            else:
+                remaining = entry.size
+                while remaining > 0:
+                    chunk = await asyncio.to_thread(file.read, min(remaining, BODY_CHUNK_SIZE))
+                    if not chunk:
+                        raise OSError(f"Cached file {entry.path} is shorter than its index entry")
+                    remaining -= len(chunk)
+                    fetch.append(decompressor.decompress(chunk) if decompressor is not None else chunk)
+                    await fetch.waitForReaders()
+                if decompressor is not None:
+                    fetch.append(decompressor.flush())
+        except (OSError, zlib.error) as e:
+            logging.error(f"ERROR: Failed to read the revalidated file from the cache! {e}")
+            await self.removeFromCache(cacheKey)
+            return False
+        finally:
+            if file is not None:
+                file.close()
+
+        return True
+
+    async def writeMetadata(self, cacheKey: str, entry: CacheEntry):
+        """
+        Writes the '.meta' file for a cache entry.
+        Like the body, it is written to a temporary file and renamed into place so another worker never loads half of it.
+        With the segments storage engine the entry is recorded in the store's journal instead.
+
+        Parameters:
+        cacheKey (str): The cache key for the file.
+        entry (CacheEntry): The cache index entry holding the headers and the stored time.
+        """
+        if self.segmentStore is not None:
+            try:
+                await asyncio.to_thread(self.segmentStore.record, entry)
+            except OSError as e:
+                logging.error(f"ERROR: An unexpected error has occurred while writing the segment journal! {e}")
+            return
+
+        # The temporary file is written and renamed in one worker thread call
+        try:
+            await asyncio.to_thread(self.storeMetadata, self.cacheIndex.serializeMetadata(cacheKey, entry), entry.metaPath)
+        except OSError as e:
+            logging.error(f"ERROR: An unexpected error has occurred while writing the cache metadata! {e}")
+
+    @staticmethod
+    def storeMetadata(metadata: bytes, metaPath: Path):
+        """
+        Blocking part of writeMetadata, run in a worker thread. A temporary file that couldn't be renamed into place is deleted.
+
+        Parameters:
+        metadata (bytes): The serialized metadata.
+        metaPath (Path): Where the '.meta' file goes.
+        """
+        tempPath = metaPath.with_name(f"{metaPath.name}.{os.getpid()}.tmp")
+        try:
+            with open(tempPath, 'wb') as metaFile:
+                metaFile.write(metadata)
+            os.replace(tempPath, metaPath)
+        except OSError:
+            tempPath.unlink(missing_ok=True)
+            raise
+
+    async def removeFromCache(self, cacheKey: str):
+        """
+        Drops a file from the cache index and the memory tier and deletes it from the disk in a worker thread.
+
+        Parameters:
+        cacheKey (str): The cache key for the file.
+        """
+        entry = self.cacheIndex.lookup(cacheKey)
+        self.cacheIndex.remove(cacheKey)
+        self.memoryCache.remove(cacheKey)
+        if entry is not None:
+            await asyncio.to_thread(self.cacheIndex.deleteStored, entry)
+
+    async def purge(self, kind: str, value: str) -> dict:
+        """
+        Purges one cache key, every key under a prefix or every key on a host.
+        The keys are dropped from the index, the memory tier and the negative cache before anything is awaited,
+        so no lookup can find them once the purge has started, and their files are deleted afterwards in a worker thread.
+        A fetch in flight for a purged key may be bringing back the old body, so it is detached from new requests and its body isn't cached.
+
+        Parameters:
+        kind (str): 'url' for one cache key, 'prefix' for every key starting with value, or 'host' for every key on the host on any port.
+        value (str): The cache key, key prefix or host name.
+
+        Returns:
+        result (dict): How many cached files were purged, how many bytes they held, and how many error responses and fetches were dropped.
+        """
+        startTime = time.perf_counter()
+        match = keyMatcher(kind, value)
+
+        # The prefix index walks straight to the matching keys
+        purged = self.cacheIndex.find(kind, value)
+        for digest, entry in purged:
+            self.cacheIndex.removeDigest(digest)
+            self.memoryCache.remove(entry.key)
+
+        # The negative cache and the fetches in flight are small, so they are checked one by one
+        negativeEntries = self.negativeCache.removeMatching(match)
+        fetches = 0
+        for key, fetch in list(self.coalescer.inFlight.items()):
+            if match(key):
+                fetch.purged = True
+                self.coalescer.remove(key, fetch)
+                if fetch.cacheWrite is not None:
+                    self.cacheWriter.cancel(fetch.cacheWrite)
+                fetches += 1
+
+        await asyncio.to_thread(self.cacheEvictor.deleteFiles, purged)
+
+        purgedBytes = sum(entry.size for _, entry in purged)
+        self.metrics.increment("purges")
+        self.metrics.increment("purgedFiles", len(purged))
+        logging.info(f"Purged {len(purged)} cached files ({purgedBytes} bytes) for {kind} {value} in {(time.perf_counter() - startTime) * 1000:.1f}ms")
+        return {"files": len(purged), "bytes": purgedBytes, "negativeEntries": negativeEntries, "fetches": fetches}
+
+    @staticmethod
+    def parseAge(headers: dict) -> float:
+        """
+        Reads the Age header, which says how long the response already sat in other caches before reaching us.
+
+        Parameters:
+        headers (dict): The response headers with lower-cased names.
+
+        Returns:
+        age (float): The age in seconds, 0 if there is no valid Age header.
+        """
+        try:
+            return max(0.0, float(headers.get("age", 0)))
+        except ValueError:
+            return 0.0
+
+    async def handleOriginResponse(self, writer: asyncio.StreamWriter, fetch: InFlightFetch, reader, requestHeaders: dict = None) -> bool:
         """
         handles the response from the origin server. 
-        If the status code is 200 we have a successful response and will write the requested file to our cache.
+        If the status code is 200 we have a successful response and stream the body to the client, or just the range it asked for.
         If the status code is 404 we send a message back to the client and close their connection.
         If the status code is an unsupported error then we tell the client and close their connection.
 
         Parameters:
-        clientSocket (socket): used for sending messages back to the client
-        response (bytes): Response from the origin server
-        cachePath (str): This is the location we will be writing our files to. 
-        """
+        writer (StreamWriter): StreamWriter object used for sending messages back to the client.
+        fetch (InFlightFetch): The origin fetch for the requested file, which may be shared with other clients.
+        reader (object): This client's handle from joining the fetch.
+        requestHeaders (dict): The request headers with lower-cased names.
 
-        # Decode the response output from a bytes-like object into a string data type
-        responseDecoded = response.decode("utf-8")
-        
-        # Extract the headers and body
-        headers, body = responseDecoded.split('\r\n\r\n', 1)
-        statusLine = headers.split('\n')[0]
-        statusCode = statusLine.split(' ')[1]
-    
+        Returns:
+        bool: True if the client was sent a complete response; False otherwise.
+        """
+        await fetch.waitForHead()
 
         # Process the response correctly depending on the status codes
-        if statusCode == "200":
-            await self.handleSuccessfulResponse(writer, statusLine, body, cachePath)
-        elif statusCode == "404":
-            await self.handleNotFoundResponse(writer, statusLine)
+        if fetch.statusCode is None:
+            await self.handleUnsupportedResponse(writer, "HTTP/1.1 502 Bad Gateway")
+        elif fetch.statusCode == "200":
+            ranges = self.fetchRanges(fetch, requestHeaders)
+            if ranges is not None:
+                return await self.handleRangeResponse(writer, fetch, reader, ranges)
+            return await self.handleSuccessfulResponse(writer, fetch, reader)
+        elif fetch.statusCode == "404":
+            await self.handleNotFoundResponse(writer, fetch.statusLine)
         else:
-            await self.handleUnsupportedResponse(writer, statusLine)
+            await self.handleUnsupportedResponse(writer, fetch.statusLine)
+        return True
 
-    async def handleSuccessfulResponse(self, writer: asyncio.StreamWriter, statusLine: str, body: str, cachePath: str):
+    async def handleSuccessfulResponse(self, writer: asyncio.StreamWriter, fetch: InFlightFetch, reader) -> bool:
         """
-        If the status code was 200 then we store the requested file to our cache and serve the request to the client.
+        If the status code was 200 then we stream the body to the client as it arrives from the origin.
 
         Parameters:
         writer (StreamWriter): StreamWriter object used for sending messages back to the client.
-        statusLine (str): Status line contains the HTTP status of the request.
-        body (str): This is the body of the requested file as a string.
-        cachePath (str): This is the directory where we will be storing the requested file.
+        fetch (InFlightFetch): The origin fetch for the requested file, which may be shared with other clients.
+        reader (object): This client's handle from joining the fetch.
+
+        Returns:
+        bool: True if the client was sent the whole body; False otherwise.
         """
 
-        print("Response Received from server, and status code is 200!\nWriting to cache...")
+        # Send the status line and Cache-Hit header right away so the client's first byte doesn't wait on the body
+        # If the origin told us the length we pass it on, otherwise we chunk what we send to the client
+        # This way the client can always tell where the body ends and keep its connection open
+        chunked = isChunked(fetch.headers) or "content-length" not in fetch.headers
+        responseHead = f"{fetch.statusLine}\r\nCache-Hit: {1 if fetch.fromCache else 0}\r\n"
+        if "content-type" in fetch.headers:
+            responseHead += f"Content-Type: {fetch.headers['content-type']}\r\n"
+        if "content-encoding" in fetch.headers:
+            responseHead += f"Content-Encoding: {fetch.headers['content-encoding']}\r\n"
+        if chunked:
+            responseHead += "Transfer-Encoding: chunked\r\n"
+        else:
+            responseHead += f"Content-Length: {fetch.headers['content-length']}\r\nAccept-Ranges: bytes\r\n"
+        # Only the writes are timed, the waits for the next chunk from the origin are counted as origin body time
+        startTime = time.perf_counter()
+        writer.write(f"{responseHead}\r\n".encode("utf-8"))
+        await self.drainClient(writer)
+        writeTime = time.perf_counter() - startTime
 
-        # Since the directory doesn't exist make it
         try:
-            # Creates the requested directories, if the requested directories already exist its okay so we don't get an error if it does
-            await asyncio.to_thread(cachePath.parent.mkdir, parents=True, exist_ok=True)
+            async with aclosing(fetch.stream(reader)) as chunks:
+                async for chunk in chunks:
+                    startTime = time.perf_counter()
+                    if chunked:
+                        writer.write(f"{len(chunk):x}\r\n".encode("utf-8") + chunk + b"\r\n")
+                    else:
+                        writer.write(chunk)
+                    await self.drainClient(writer)
+                    writeTime += time.perf_counter() - startTime
 
-            # Since we had to decode the body to originally extract it from the response, we now re-encode the body for storing it to our cache
-            # This will save the body as a bytes-like object
-            encodedBody = body.encode("utf-8")
+            # If the origin cut us off the client only got part of the body
+            if not fetch.complete:
+                return False
 
-            # Write the body of the response to our cache file
-            # If we are serving a cache there is no point in storing the headers in our cache
-            async with aiofiles.open(cachePath, 'wb') as file:
-                await file.write(encodedBody)
+            # The last chunk of a chunked body is empty
+            if chunked:
+                writer.write(b"0\r\n\r\n")
+                await self.drainClient(writer)
 
-        except FileNotFoundError as e:
-            logging.error(f"ERROR: The cache path does not exist! {e}")
-        except Exception as e:
-            logging.error(f"ERROR: An unexpected error has occurred while writing to the cache! {e}")
-        
-        # Send the status line from the headers
-        writer.write(f"{statusLine}\n".encode("utf-8"))
-        await writer.drain()
+            return True
+        finally:
+            self.metrics.record("clientWrite", writeTime)
+
+    @staticmethod
+    def fetchRanges(fetch: InFlightFetch, requestHeaders: dict):
+        """
+        Works out the range to send a range request that missed the cache, from the fetch of the full body.
+        Only a single range of a body with a known length is sliced out of the fetch, anything else gets the whole body.
+
+        Parameters:
+        fetch (InFlightFetch): The origin fetch for the requested file.
+        requestHeaders (dict): The request headers with lower-cased names.
+
+        Returns:
+        ranges (list): A single (first, last) range, an empty list if it can't be satisfied, or None to send the whole body.
+        """
+        if not requestHeaders or "range" not in requestHeaders or isChunked(fetch.headers):
+            return None
+        try:
+            size = int(fetch.headers["content-length"])
+        except (KeyError, ValueError):
+            return None
 
-        # Send the Cache-Hit message
-        writer.write(f"Cache-Hit: 0\n".encode("utf-8"))
-        await writer.drain()
-        # Send the body we decoded from our response back to the client
-        writer.write(f"\n\n{body}\n\n".encode("utf-8"))
-        await writer.drain()
+        ranges = requestedRanges(requestHeaders, fetch.headers, size)
+        return ranges if ranges is None or len(ranges) <= 1 else None
 
-    async def handleNotFoundResponse(self, writer:asyncio.StreamWriter, statusLine: str):
+    async def handleRangeResponse(self, writer: asyncio.StreamWriter, fetch: InFlightFetch, reader, ranges: list) -> bool:
         """
-        If the status code was 404 then we let the client know and close the connection.
+        Sends a 206 Partial Content response sliced out of a fetch of the full body as it streams in.
+        We stop reading the fetch once the range has been sent, the fetch keeps going in its own task so the full body still ends up in the cache.
+
+        Parameters:
+        writer (StreamWriter): StreamWriter object used for sending messages back to the client.
+        fetch (InFlightFetch): The origin fetch for the requested file, which may be shared with other clients.
+        reader (object): This client's handle from joining the fetch.
+        ranges (list): A single (first, last) range, or an empty list if the range can't be satisfied.
+
+        Returns:
+        bool: True if the client was sent the whole range; False otherwise.
+        """
+        size = int(fetch.headers["content-length"])
+        if not ranges:
+            await self.sendRangeNotSatisfiable(writer, size, 1 if fetch.fromCache else 0)
+            return True
+        self.metrics.increment("rangeRequests")
+
+        first, last = ranges[0]
+        responseHead = f"HTTP/1.1 206 Partial Content\r\nCache-Hit: {1 if fetch.fromCache else 0}\r\nAccept-Ranges: bytes\r\n"
+        responseHead += f"Content-Range: {contentRange(first, last, size)}\r\nContent-Length: {last - first + 1}\r\n"
+        if "content-type" in fetch.headers:
+            responseHead += f"Content-Type: {fetch.headers['content-type']}\r\n"
+        if "content-encoding" in fetch.headers:
+            responseHead += f"Content-Encoding: {fetch.headers['content-encoding']}\r\n"
+
+        # Only the writes are timed, the waits for the next chunk from the origin are counted as origin body time
+        startTime = time.perf_counter()
+        writer.write(f"{responseHead}\r\n".encode("utf-8"))
+        await self.drainClient(writer)
+        writeTime = time.perf_counter() - startTime
+
+        try:
+            # Skip the chunks before the range and stop as soon as we are past the end of it
+            # Closing the stream straight away lets the fetch drop the chunks we didn't read
+            offset = 0
+            async with aclosing(fetch.stream(reader)) as chunks:
+                async for chunk in chunks:
+                    end = offset + len(chunk)
+                    if end > first:
+                        startTime = time.perf_counter()
+                        writer.write(chunk[max(0, first - offset):last + 1 - offset])
+                        await self.drainClient(writer)
+                        writeTime += time.perf_counter() - startTime
+                    offset = end
+                    if offset > last:
+                        return True
+
+            # If the origin cut us off before the end of the range the client only got part of it
+            return False
+        finally:
+            self.metrics.record("clientWrite", writeTime)
+
+    async def handleNotFoundResponse(self, writer:asyncio.StreamWriter, statusLine: str, cacheHit: int = 0):
+        """
+        If the status code was 404 then we let the client know.
 
         Parameters:
         clientSocket (str): Client socket used for sending messages back to the client.
         statusLine (str): Status line contains the HTTP status of the request.
+        cacheHit (int): The Cache-Hit header value, 1 if the 404 came from the negative cache.
         """
 
-        # Send the status line from the headers
-        writer.write(f"{statusLine}\n".encode("utf-8"))
-        await writer.drain()
-        
-        # Send the Cache-Hit message
-        writer.write(f"Cache-Hit: 0\n".encode("utf-8"))
-        await writer.drain()
-
-        # Send the response to the client 404 NOT FOUND
-        writer.write("\n404 NOT FOUND\n\n".encode("utf-8"))
-        await writer.drain()
+        # Send the status line from the headers, the Cache-Hit message and the response 404 NOT FOUND
+        # The Content-Length lets the client keep using the connection afterwards
+        await self.sendErrorResponse(writer, statusLine, "404 NOT FOUND\n", cacheHit)
 
-    async def handleUnsupportedResponse(self, writer:asyncio.StreamWriter, statusLine):
+    async def handleUnsupportedResponse(self, writer:asyncio.StreamWriter, statusLine, cacheHit: int = 0):
         """
-        If the status code was something other than 200 or 404 then we have an unexpected error let the client know and close the connection.
+        If the status code was something other than 200 or 404 then we have an unexpected error let the client know.
 
         Parameters:
         clientSocket (str): Client socket used for sending messages back to the client.
         statusLine (str): Status line contains the HTTP status of the request.
+        cacheHit (int): The Cache-Hit header value, 1 if the error came from the negative cache.
         """
         
-        # Send the status line from the headers
-        writer.write(f"{statusLine}\n".encode("utf-8"))
-        await writer.drain()
-        
-        # Send the Cache-Hit message
-        writer.write(f"Cache-Hit: 0\n".encode("utf-8"))
-        await writer.drain()
-        
-        # Send the unsupported error message
-        writer.write(f"\nUnsupported Error\n\n".encode("utf-8"))
-        await writer.drain()
+        # Send the status line from the headers, the Cache-Hit message and the unsupported error message
+        await self.sendErrorResponse(writer, statusLine, "Unsupported Error\n", cacheHit)
+
+    async def sendErrorResponse(self, writer: asyncio.StreamWriter, statusLine: str, message: str, cacheHit: int = 0):
+        """
+        Sends an error status to the client with a short text body.
+
+        Parameters:
+        writer (StreamWriter): StreamWriter object used for sending messages back to the client.
+        statusLine (str): Status line contains the HTTP status of the request.
+        message (str): The text body we send to the client.
+        cacheHit (int): The Cache-Hit header value, 1 if the error came from the negative cache.
+        """
+        body = message.encode("utf-8")
+        writer.write(f"{statusLine}\r\nCache-Hit: {cacheHit}\r\nContent-Length: {len(body)}\r\n\r\n".encode("utf-8") + body)
+        await self.drainClient(writer)
     
+    async def handleRequest(self, writer: asyncio.StreamWriter, request: HttpRequest) -> bool:
+        """
+        Serves a single valid request from the memory tier, a fetch in flight, the disk cache or the origin server.
+
+        Parameters:
+        writer (StreamWriter): StreamWriter object for writing to the client.
+        request (HttpRequest): The parsed request from the client.
+
+        Returns:
+        bool: True if the client was sent a complete response and the connection can be used for another request; False otherwise.
+        """
+        requestType, path, httpVersion, host, port, cacheKey = await self.extractRequestData(request)
+        lookupStartTime = time.perf_counter()
+
+        # Compressed-at-rest files are only sent compressed if the client says it can decode them
+        clientAcceptsGzip = acceptsGzip(request.headers)
+
+        # Check the cache index, this never touches the disk
+        # A fresh copy can be served straight away, a stale copy has to be revalidated with the origin first unless it is within its grace window
+        entry = self.cacheIndex.lookup(cacheKey)
+
+        # Another worker may have cached the file since we built our index, so check the disk before going to the origin
+        if entry is None and self.sharedCache and cacheKey not in self.coalescer.inFlight:
+            loaded = await asyncio.to_thread(self.cacheIndex.loadKey, cacheKey)
+            if loaded is not None:
+                entry = self.cacheIndex.insert(loaded)
+
+        staleness = staleFor(entry.headers, entry.storedTime, self.defaultFreshness) if entry is not None else None
+        fresh = staleness is not None and staleness < 0
+
+        # A copy that only just went stale is served straight away and refreshed in the background, so the client never waits on the origin
+        serveStale = not fresh and staleness is not None and staleness < staleWindow(entry.headers, "stale-while-revalidate", self.staleWhileRevalidate)
+        servable = fresh or serveStale
+
+        # Check the memory tier first, this avoids a disk read for hot objects
+        cachedResponse = self.memoryCache.get(cacheKey) if servable else None
+
+        # A file we don't have a fresh copy of may be one the origin recently told us doesn't exist
+        negativeStatusLine, negativeStatusCode = self.negativeCache.get(cacheKey) if not servable else (None, None)
+
+        # Look for a fetch that is already in flight for this file, a stale copy we can serve doesn't wait for it
+        fetch = self.coalescer.get(cacheKey) if cachedResponse is None and negativeStatusLine is None and not serveStale else None
+
+        # Record the access so the evictor keeps the files we actually use
+        if servable:
+            entry.touch()
+
+        # Start refreshing a stale copy we are about to serve, unless a fetch for it is already running
+        if serveStale:
+            self.metrics.increment("staleHits")
+            if cacheKey not in self.coalescer.inFlight:
+                self.metrics.increment("backgroundRevalidations")
+                self.startFetch(requestType, path, httpVersion, host, port, cacheKey, entry)
+
+        # A range request on a copy we can serve is answered from it directly, unless we compressed it and the offsets don't line up
+        ranges = None
+        if servable and entry.storedEncoding is None:
+            ranges = requestedRanges(request.headers, entry.headers, entry.size)
+
+        self.metrics.record("cacheLookup", time.perf_counter() - lookupStartTime)
+
+        if cachedResponse is not None:
+            self.metrics.increment("memoryHits")
+            logging.info("Serving the requested file from the memory cache to the client!")
+            if ranges is not None:
+                await self.sendRanges(writer, entry, ranges, cachedResponse)
+            else:
+                await self.sendCachedResponse(writer, cachedResponse, entry, clientAcceptsGzip)
+            return True
+        elif negativeStatusLine is not None:
+            self.metrics.increment("negativeHits")
+            logging.info("Serving the origin's error response from the negative cache to the client!")
+            if negativeStatusCode == "404":
+                await self.handleNotFoundResponse(writer, negativeStatusLine, 1)
+            else:
+                await self.handleUnsupportedResponse(writer, negativeStatusLine, 1)
+            return True
+        elif fetch is not None and not fetch.joinable:
+            # The start of the body is no longer kept, so wait for the fetch to put the file in the cache and serve it from there
+            # If the file didn't make it into the cache we go to the origin ourselves
+            # A fetch that isn't being cached, like a revalidation or a sibling's response, is waited for and then we look again
+            self.metrics.increment("lateJoins")
+            await asyncio.wait({fetch.task})
+            if fetch.cacheWrite is not None:
+                await fetch.cacheWrite.wait()
+            return await self.handleRequest(writer, request)
+        elif fetch is not None:
+            # Join the fetch in flight so concurrent misses on the same file only go to the origin once
+            self.metrics.increment("coalescedRequests")
+            return await self.handleOriginOrStale(writer, fetch, request, cacheKey, entry, clientAcceptsGzip)
+        # Check if we have a copy of the file in our cache we can serve
+        elif servable:
+            # If we are here that means we have the file and we will serve it to the client without contacting the origin
+            self.metrics.increment("diskHits")
+            if await self.readFromCache(cacheKey, entry, writer, clientAcceptsGzip, ranges):
+                return not writer.is_closing()
+
+            # The file is gone from the disk and the index, so looking again sends the request to the origin
+            return await self.handleRequest(writer, request)
+        else:
+            self.metrics.increment("revalidations" if entry is not None else "misses")
+            # Request the file from the origin server as we do not have it stored in our cache, or our copy is stale
+            # The fetch runs as its own task so any clients that miss on the same file while it runs can share it
+            # A request a sibling forwarded to us is ours to fetch from the origin, it is never forwarded again
+            fetch = self.startFetch(requestType, path, httpVersion, host, port, cacheKey, entry, PEER_HEADER.lower() not in request.headers)
+
+            # Handle response from the origin server, the body is streamed to the client as it arrives
+            # A range request still fetches the whole body so it can be cached, the client is only sent its range
+            complete = await self.handleOriginOrStale(writer, fetch, request, cacheKey, entry, clientAcceptsGzip)
+
+            # Look for links in a page we just fetched so the resources the client asks for next are already cached
+            # A page too big to keep whole for the clients sharing its fetch isn't looked at
+            if self.linkPrefetcher is not None and fetch.done and fetch.complete and fetch.statusCode == "200" and isHtml(fetch.headers) \
+                    and fetch.firstChunk == 0:
+                self.linkPrefetcher.submit(request.target, pageStart(fetch.chunks))
+
+            return complete
+
+    def startFetch(self, requestType: str, path: str, httpVersion: str, host: str, port: int, cacheKey: str, staleEntry: CacheEntry = None,
+                   usePeers: bool = True) -> InFlightFetch:
+        """
+        Starts an origin fetch for a cache key as its own task and registers it with the coalescer, so clients that miss on the same file can share it.
+
+        Parameters:
+        requestType (str): The request type which should always be GET
+        path (str): The path for the requested file
+        httpVersion (str): The HTTP version we send to the origin
+        host (str): The host we will be requesting
+        port (int): The port on the origin server
+        cacheKey (str): The cache key for the requested file.
+        staleEntry (CacheEntry): Our stale copy of the file if we have one, used for revalidation.
+        usePeers (bool): Ask the sibling proxy that owns the key first. False for requests a sibling forwarded to us.
+
+        Returns:
+        fetch (InFlightFetch): The fetch that was started.
+        """
+        fetch = self.coalescer.start(cacheKey)
+        fetch.task = asyncio.create_task(self.fetchFromOrigin(fetch, requestType, path, httpVersion, host, port, cacheKey, staleEntry, usePeers))
+        return fetch
+
+    async def handleOriginOrStale(self, writer: asyncio.StreamWriter, fetch: InFlightFetch, request: HttpRequest, cacheKey: str,
+                                  staleEntry: CacheEntry, clientAcceptsGzip: bool) -> bool:
+        """
+        Answers a client from an origin fetch, or from our stale copy if the origin timed out or failed and the copy is within its stale-if-error window.
+        The client joins the fetch before anything else runs, so the fetch keeps every chunk until this client has read it or given up.
+
+        Parameters:
+        writer (StreamWriter): StreamWriter object used for sending messages back to the client.
+        fetch (InFlightFetch): The origin fetch for the requested file, which may be shared with other clients.
+        request (HttpRequest): The parsed request from the client.
+        cacheKey (str): The cache key for the requested file.
+        staleEntry (CacheEntry): Our stale copy of the file, or None if we don't have one.
+        clientAcceptsGzip (bool): True if the client accepts gzip encoded responses.
+
+        Returns:
+        bool: True if the client was sent a complete response; False otherwise.
+        """
+        reader = fetch.join()
+        try:
+            if staleEntry is not None:
+                await fetch.waitForHead()
+
+                # No response, a 5xx, or our own 503 for a busy origin all count as the origin failing
+                originFailed = fetch.statusCode is None or fetch.statusCode.startswith("5")
+
+                # The failed fetch may have thrown our copy away, for example when the origin's error was remembered in the negative cache
+                if originFailed and self.cacheIndex.lookup(cacheKey) is staleEntry and \
+                        staleFor(staleEntry.headers, staleEntry.storedTime, self.defaultFreshness) < staleWindow(staleEntry.headers, "stale-if-error", self.staleIfError):
+                    self.metrics.increment("staleIfErrorHits")
+                    logging.info("The origin failed, serving our stale copy of the requested file to the client!")
+                    staleEntry.touch()
+                    ranges = requestedRanges(request.headers, staleEntry.headers, staleEntry.size) if staleEntry.storedEncoding is None else None
+                    if await self.readFromCache(cacheKey, staleEntry, writer, clientAcceptsGzip, ranges):
+                        return not writer.is_closing()
+
+            # If our stale copy turned out to be missing from the disk the client gets the origin's failure instead
+            return await self.handleOriginResponse(writer, fetch, reader, request.headers)
+        finally:
+            fetch.leave(reader)
+
+    async def prefetch(self, url: str):
+        """
+        Fetches a URL into the cache without a client waiting on it, this is used for cache warming and link prefetching.
+        The fetch is registered with the coalescer like any other, so clients that miss on the same file while it runs share it.
+
+        Parameters:
+        url (str): The http:// URL to fetch.
+
+        Returns:
+        fetched (bool): True if the file was fetched into the cache, or into the cache of the sibling proxy that owns it; False if we already had a fresh copy or it was already being fetched;
+        None if it couldn't be fetched or isn't cacheable.
+        """
+        if not url.startswith("http://"):
+            return None
+        requestType, path, httpVersion, host, port, cacheKey = await self.extractRequestData(HttpRequest.forUrl(url))
+        if host is None:
+            return None
+
+        entry = self.cacheIndex.lookup(cacheKey)
+        if entry is None and self.sharedCache and cacheKey not in self.coalescer.inFlight:
+            loaded = await asyncio.to_thread(self.cacheIndex.loadKey, cacheKey)
+            if loaded is not None:
+                entry = self.cacheIndex.insert(loaded)
+
+        if entry is not None and isFresh(entry.headers, entry.storedTime, self.defaultFreshness):
+            return False
+        if cacheKey in self.coalescer.inFlight:
+            return False
+        if entry is None and self.negativeCache.get(cacheKey)[0] is not None:
+            return None
+
+        fetch = self.startFetch(requestType, path, httpVersion, host, port, cacheKey, entry)
+
+        # Shield the fetch so cancelling a prefetch doesn't cut off clients that joined it
+        await asyncio.shield(fetch.task)
+        if fetch.cacheWrite is not None:
+            await fetch.cacheWrite.wait()
+        if fetch.complete and fetch.statusCode in ("200", "304") and (fetch.peer is not None or self.cacheIndex.lookup(cacheKey) is not None):
+            return True
+        return None
+
     async def handleClient(self, reader, writer):
         """
-        Handles the incoming client request.
+        Handles the incoming client connection.
+        The connection is kept alive so the client can send several requests, including pipelined ones, without reconnecting.
+        Requests are answered one after another so pipelined requests get their responses in order.
+        The connection is closed once the client goes idle, asks us to close it, or reaches the per-connection request limit.
 
         Parameters:
         reader (StreamReader): StreamReader object for reading from the client.
         writer (StreamWriter): StreamWriter object for writing to the client.
         """
+        # Anything the client sent past the end of a request stays in the parser for the next one
+        parser = RequestParser()
         try:
-            # Get the URI
-            uri = await self.processClientRequest(reader)
-
-            isValid = await self.validURI(uri, writer)
-            
-            # If the URI is valid then extract the request data
-            if isValid:
-                requestType, path, httpVersion, host, port, cachePath = await self.extractRequestData(uri)
-                    
-                # Check if the cache path exists
-                if cachePath.exists():
-                    # If we are here that means we have the file and we will serve it to the client without contacting the origin
-                    await self.readFromCache(cachePath, writer)
+            for _ in range(self.maxRequestsPerConnection):
+                # Get the request, this gives up on the connection if the client stays idle for too long
+                request = await self.processClientRequest(reader, parser)
+
+                # The client closed the connection or timed out
+                if request is None:
+                    break
+
+                isValid = await self.validURI(request, writer)
+                
+                # If the URI is not valid handle the invalid request, which closes the connection
+                if not isValid:
+                    self.metrics.increment("invalidRequests")
+                    await self.handleInvalidRequest(writer)
+                    break
+
+                self.metrics.increment("requests")
+
+                # Shed load with a 503 once we are working on as many requests as we allow and the queue is full
+                if not await self.admissionControl.acquire():
+                    self.metrics.increment("rejectedRequests")
+                    await self.sendErrorResponse(writer, "HTTP/1.1 503 Service Unavailable", "Service Unavailable\n")
+                    keepAlive = True
                 else:
-                    # Request the file from the origin server as we do not have it stored in our cache
-                    response = await self.requestFromOrigin(requestType, path, httpVersion, host, port)
-                    
-                    # Handle response from the origin server
-                    await self.handleOriginResponse(writer, response, cachePath)
-            # If the URI is not valid handle the invalid request
-            else:
-                await self.handleInvalidRequest(writer)
+                    try:
+                        with self.metrics.timer("request"):
+                            keepAlive = await self.handleRequest(writer, request)
+                    finally:
+                        self.admissionControl.release()
+
+                # Stop if the response couldn't be completed or the client doesn't want to send anything else
+                if not keepAlive or not request.keepAlive:
+                    break
+        except (ConnectionError, asyncio.TimeoutError):
+            # The client went away or stopped reading in the middle of a response
+            pass
         finally:
             writer.close()
     
-    async def server(self, listeningPort: int):
+    async def server(self, listeningPort: int, reusePort: bool = False, runEvictor: bool = True):
         """
         Handles all of the proxy server logic.
         The function creates two sockets: serverSocket and outboundSocket.
@@ -359,8 +1773,106 @@ class Proxy:
 
         Parameters:
         listeningPort (int): The port specified by the user for telnet communications
+        reusePort (bool): Listen with SO_REUSEPORT so several worker processes can share the port, the kernel spreads connections between them.
+        runEvictor (bool): Run the background eviction task, only one worker sharing a cache directory should.
         """
-        serverSocket = await asyncio.start_server(self.handleClient, '0.0.0.0', listeningPort)
+        # Log from a background thread so writing to stdout never blocks the event loop
+        self.logListener = startQueueLogging()
+
+        # Load the cache index before we start serving so lookups never have to touch the disk
+        await asyncio.to_thread(self.cacheIndex.build)
+        logging.info(f"Loaded {len(self.cacheIndex.entries)} cached files into the cache index in {self.cacheIndex.buildTime * 1000:.1f}ms")
+
+        # Start evicting in the background, keeping a reference so the task isn't garbage collected
+        if runEvictor:
+            self.evictionTask = asyncio.create_task(self.cacheEvictor.run())
+            if self.segmentCompactor is not None:
+                self.compactionTask = asyncio.create_task(self.segmentCompactor.run())
+        # The other workers sharing the cache still have to notice the files the evicting worker deleted
+        elif self.sharedCache:
+            self.evictionTask = asyncio.create_task(self.cacheEvictor.runSync())
+
+        # The stats endpoint only listens on localhost
+        if self.statsPort is not None:
+            self.statsServer = await asyncio.start_server(self.handleStatsClient, '127.0.0.1', self.statsPort)
+        if self.adminPort is not None:
+            self.adminListener = await asyncio.start_server(self.adminServer.handleClient, '127.0.0.1', self.adminPort)
+        if self.statsInterval is not None:
+            self.statsTask = asyncio.create_task(self.logStats())
+
+        if self.linkPrefetcher is not None:
+            self.linkPrefetcher.start()
+
+        # Warm the cache before accepting clients if asked to, otherwise warm it in the background while we serve
+        if self.warmUrls:
+            if self.warmBeforeServing:
+                await self.cacheWarmer.warm(self.warmUrls)
+            else:
+                self.warmTask = asyncio.create_task(self.cacheWarmer.warm(self.warmUrls))
+
+        serverSocket = await asyncio.start_server(self.handleClient, '0.0.0.0', listeningPort, reuse_port=reusePort or None)
 
         async with serverSocket:
-            await serverSocket.serve_forever()
\ No newline at end of file
+            try:
+                await serverSocket.serve_forever()
+            finally:
+                # Flush anything still waiting in the log queue
+                if self.logListener is not None:
+                    self.logListener.stop()
+
+    def stats(self) -> dict:
+        """
+        Collects the metrics and the stats of every part of the proxy.
+
+        Returns:
+        stats (dict): The request metrics and the stats of the caches, the origin pool, the coalescer and the evictor.
+        """
+        return {
+            "metrics": self.metrics.stats(),
+            "memoryCache": self.memoryCache.stats(),
+            "negativeCache": self.negativeCache.stats(),
+            "cacheWriter": self.cacheWriter.stats(),
+            "cacheIndex": self.cacheIndex.stats(),
+            "segmentStore": self.segmentStore.stats() if self.segmentStore is not None else None,
+            "cacheEvictor": self.cacheEvictor.stats(),
+            "originPool": self.originPool.stats(),
+            "dnsCache": self.dnsCache.stats(),
+            "admissionControl": self.admissionControl.stats(),
+            "coalescer": self.coalescer.stats(),
+            "cacheWarmer": self.cacheWarmer.stats(),
+            "linkPrefetcher": self.linkPrefetcher.stats() if self.linkPrefetcher is not None else None,
+            "peerGroup": self.peerGroup.stats() if self.peerGroup is not None else None,
+            "adminServer": self.adminServer.stats() if self.adminPort is not None else None,
+            "hedger": self.hedger.stats() if self.hedger is not None else None,
+        }
+
+    async def handleStatsClient(self, reader, writer):
+        """
+        Answers any request on the stats port with the stats as JSON and closes the connection.
+
+        Parameters:
+        reader (StreamReader): StreamReader object for reading from the client.
+        writer (StreamWriter): StreamWriter object for writing to the client.
+        """
+        try:
+            # Read and ignore the request head, every path returns the same stats
+            while True:
+                line = await asyncio.wait_for(reader.readline(), self.clientIdleTimeout)
+                if not line.strip():
+                    break
+
+            body = json.dumps(self.stats(), indent=2).encode("utf-8")
+            writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("utf-8") + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def logStats(self):
+        """
+        Logs the stats every statsInterval seconds, forever. This is started as a background task by the server.
+        """
+        while True:
+            await asyncio.sleep(self.statsInterval)
+            logging.info(json.dumps(self.stats()))
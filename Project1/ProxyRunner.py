@@ -1,29 +1,186 @@
 import sys
 import asyncio
+import argparse
+from CacheWarmer import CacheWarmer
+from DnsCache import DnsCache
+from PeerGroup import parseAddress
 from Proxy import Proxy
+from WorkerSupervisor import WorkerSupervisor
 
 if __name__ == "__main__":
-    # Check if the length of issued commands are correct
-    if len(sys.argv) != 2:
-        print("ERROR: Not enough parameters supplied")
-        print("Example Usage: python3 proxy.py <listening port number>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="HTTP proxy cache", usage="python3 ProxyRunner.py <listening port number> [--workers N] [--warm FILE]")
+    parser.add_argument("listeningPort", help="The port the proxy listens on")
+    parser.add_argument("--workers", type=int, default=1, help="How many worker processes share the port, defaults to 1")
+    parser.add_argument("--stats-port", type=int, default=None, help="Serve the stats as JSON on this localhost port, each worker uses the next port up")
+    parser.add_argument("--admin-port", type=int, default=None,
+                        help="Serve the admin interface for purging cached files on this localhost port, only with a single worker")
+    parser.add_argument("--stats-interval", type=float, default=None, help="Log the stats every this many seconds")
+    parser.add_argument("--hosts-file", default=None, help="An /etc/hosts style file of origin addresses that are used instead of DNS")
+    parser.add_argument("--warm", default=None, help="A file of URLs, or a previous node's access log, to fetch into the cache at startup")
+    parser.add_argument("--warm-concurrency", type=int, default=8, help="The most URLs fetched at once while warming, defaults to 8")
+    parser.add_argument("--warm-before-serving", action="store_true", help="Finish warming the cache before accepting clients")
+    parser.add_argument("--prefetch-links", action="store_true", help="Prefetch the same-origin resources linked from fetched HTML pages")
+    parser.add_argument("--negative-cache-ttl", type=float, default=30.0, help="Remember 404s and other cacheable origin errors for this many seconds, 0 turns it off")
+    parser.add_argument("--stale-while-revalidate", type=float, default=30.0,
+                        help="Serve a cached file for this many seconds after it goes stale while it is refreshed in the background, defaults to 30")
+    parser.add_argument("--stale-if-error", type=float, default=300.0,
+                        help="Serve a cached file for this many seconds after it goes stale when the origin times out or fails, defaults to 300")
+    parser.add_argument("--peers", nargs="+", default=None, metavar="HOST:PORT",
+                        help="Sibling proxies to share caches with, give every proxy in the group the same list")
+    parser.add_argument("--peer-name", default=None, metavar="HOST:PORT",
+                        help="This proxy's own address as it appears in --peers, defaults to 127.0.0.1:<port number>")
+    parser.add_argument("--peer-timeout", type=float, default=2.0, help="Go to the origin if a sibling proxy doesn't answer within this many seconds")
+    parser.add_argument("--hedge-percentile", type=float, default=None,
+                        help="Send a second attempt for an origin request that is slower than this percentile of the origin's latency, for example 95")
+    parser.add_argument("--hedge-budget", type=float, default=5.0,
+                        help="The most hedged attempts as a percentage of origin requests, defaults to 5")
+    parser.add_argument("--hedge-other-address", action="store_true", help="Send hedged attempts to a different address of the origin if it has one")
+    parser.add_argument("--storage", choices=("files", "segments"), default="files",
+                        help="Store every cached body in its own file, or pack small bodies into large segment files")
+    parser.add_argument("--cache-mb", type=float, default=1024.0, help="The most megabytes the disk cache may hold, defaults to 1024")
+    parser.add_argument("--cache-entries", type=int, default=100000, help="The most files the disk cache may hold, defaults to 100000")
+    parser.add_argument("--eviction-policy", choices=("lru", "lfu"), default="lru",
+                        help="Evict the least recently used or the least frequently used files first, defaults to lru")
+    parser.add_argument("--memory-cache-mb", type=float, default=64.0,
+                        help="The megabytes of hot files kept in memory in front of the disk cache, 0 turns it off, defaults to 64")
+    parser.add_argument("--compress-at-rest", action="store_true", help="Gzip text-like files when storing them in the disk cache")
+    parser.add_argument("--compression-level", type=int, default=6, help="The gzip level from 1 (fastest) to 9 (smallest) for --compress-at-rest, defaults to 6")
+    parser.add_argument("--client-idle-timeout", type=float, default=15.0,
+                        help="Close a keep-alive client connection after this many seconds without a request, defaults to 15")
+    parser.add_argument("--client-header-timeout", type=float, default=10.0,
+                        help="Drop a client that takes longer than this many seconds to send a request's headers, defaults to 10")
+    parser.add_argument("--client-write-timeout", type=float, default=30.0,
+                        help="Drop a client that takes longer than this many seconds to accept more of a response, defaults to 30")
+    parser.add_argument("--origin-connect-timeout", type=float, default=5.0,
+                        help="Give up connecting to an origin after this many seconds, defaults to 5")
+    parser.add_argument("--origin-read-timeout", type=float, default=30.0,
+                        help="Give up on an origin that goes quiet for this many seconds in the middle of a response, defaults to 30")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="The most client requests worked on at once, defaults to 1000")
+    parser.add_argument("--max-queued", type=int, default=1000,
+                        help="The most client requests waiting for a slot, any more get a 503 straight away, defaults to 1000")
+    parser.add_argument("--queue-timeout", type=float, default=5.0,
+                        help="Answer a request with a 503 if it waited this many seconds for a slot, defaults to 5")
+    parser.add_argument("--max-origin-connections", type=int, default=64,
+                        help="The most connections open to a single origin at once, defaults to 64")
+    parser.add_argument("--write-queue-mb", type=float, default=64.0,
+                        help="The most megabytes waiting to be written to the disk cache, files that would go over aren't cached, defaults to 64")
+    parser.add_argument("--max-pending-writes", type=int, default=1000,
+                        help="The most files being written to the disk cache at once, any more aren't cached, defaults to 1000")
+    parser.add_argument("--cache-writers", type=int, default=4,
+                        help="How many files are written out to the disk cache side by side, defaults to 4")
+    args = parser.parse_args()
 
     # Get the user-supplied listening port
-    listeningPort = sys.argv[1]
+    listeningPort = args.listeningPort
 
     # Check if the supplied listening port is an integer
     try:
         # Try to cast the listening port to an int to double check the user specified an int for the port
         listeningPort = int(listeningPort)
-        
-        # If we were able to cast the requested listening port to an int start the server
-        proxy = Proxy()
-        asyncio.run(proxy.server(listeningPort))
 
     # The user didn't use an integer for the server's listening port
     except ValueError:
         # If the user did not supply an int as a listening port, let them know they made a mistake
         print("The listening port command must be an integer")
         print("Example usage: python3 proxy.py 1530")
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
+
+    if args.workers < 1:
+        print("The number of workers must be at least 1")
+        sys.exit(1)
+
+    if args.storage == "segments" and args.workers > 1:
+        print("The segments storage can only be used with a single worker")
+        sys.exit(1)
+
+    # A purge only reaches the index and memory tier of the worker it is sent to, the others would keep serving the purged files
+    if args.admin_port is not None and args.workers > 1:
+        print("The admin port can only be used with a single worker")
+        sys.exit(1)
+
+    if args.warm_concurrency < 1:
+        print("The warm concurrency must be at least 1")
+        sys.exit(1)
+
+    if args.cache_mb <= 0 or args.cache_entries < 1 or args.memory_cache_mb < 0:
+        print("The disk cache size and entries must be above 0, and the memory cache size can't be negative")
+        sys.exit(1)
+
+    if not 1 <= args.compression_level <= 9:
+        print("The compression level must be between 1 and 9")
+        sys.exit(1)
+
+    timeouts = (args.client_idle_timeout, args.client_header_timeout, args.client_write_timeout, args.origin_connect_timeout,
+                args.origin_read_timeout, args.queue_timeout)
+    if min(timeouts) <= 0:
+        print("The timeouts must be above 0 seconds")
+        sys.exit(1)
+
+    if args.max_in_flight < 1 or args.max_queued < 0 or args.max_origin_connections < 1:
+        print("The in-flight and per-origin connection limits must be at least 1, and the queue limit can't be negative")
+        sys.exit(1)
+
+    if args.write_queue_mb <= 0 or args.max_pending_writes < 1 or args.cache_writers < 1:
+        print("The write queue size must be above 0, and the pending writes and cache writers at least 1")
+        sys.exit(1)
+
+    proxyOptions = {"statsPort": args.stats_port, "statsInterval": args.stats_interval, "prefetchLinks": args.prefetch_links,
+                    "adminPort": args.admin_port, "negativeCacheTtl": args.negative_cache_ttl, "staleWhileRevalidate": args.stale_while_revalidate,
+                    "staleIfError": args.stale_if_error, "storageEngine": args.storage}
+
+    # Sizes are given in megabytes on the command line but the proxy works in bytes
+    proxyOptions.update({"maxCacheBytes": int(args.cache_mb * 1024 * 1024), "maxCacheEntries": args.cache_entries,
+                         "evictionPolicy": args.eviction_policy, "memoryCacheBytes": int(args.memory_cache_mb * 1024 * 1024),
+                         "compressAtRest": args.compress_at_rest, "compressionLevel": args.compression_level,
+                         "clientIdleTimeout": args.client_idle_timeout, "clientHeaderTimeout": args.client_header_timeout,
+                         "clientWriteTimeout": args.client_write_timeout, "originConnectTimeout": args.origin_connect_timeout,
+                         "originReadTimeout": args.origin_read_timeout, "maxInFlightRequests": args.max_in_flight,
+                         "maxQueuedRequests": args.max_queued, "queueTimeout": args.queue_timeout,
+                         "maxConnectionsPerOrigin": args.max_origin_connections,
+                         "maxQueuedWriteBytes": int(args.write_queue_mb * 1024 * 1024), "maxPendingWrites": args.max_pending_writes,
+                         "cacheWriters": args.cache_writers})
+
+    # Hedging is off unless a percentile is given
+    if args.hedge_percentile is not None:
+        if not 0 < args.hedge_percentile < 100 or not 0 < args.hedge_budget <= 100:
+            print("The hedge percentile must be between 0 and 100, and the hedge budget above 0 and at most 100")
+            sys.exit(1)
+        proxyOptions.update({"hedgePercentile": args.hedge_percentile / 100, "hedgeBudget": args.hedge_budget / 100,
+                             "hedgeOtherAddress": args.hedge_other_address})
+
+    # Check the sibling proxy addresses
+    if args.peers is not None:
+        peerName = args.peer_name if args.peer_name is not None else f"127.0.0.1:{listeningPort}"
+        try:
+            for address in [peerName, *args.peers]:
+                parseAddress(address)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        proxyOptions.update({"peers": args.peers, "peerName": peerName, "peerTimeout": args.peer_timeout})
+
+    # Load the static hosts override
+    if args.hosts_file is not None:
+        try:
+            proxyOptions["hosts"] = DnsCache.loadHostsFile(args.hosts_file)
+        except OSError as e:
+            print(f"Could not read the hosts file: {e}")
+            sys.exit(1)
+
+    # Load the URLs to warm the cache with
+    if args.warm is not None:
+        try:
+            proxyOptions["warmUrls"] = CacheWarmer.loadUrls(args.warm)
+        except OSError as e:
+            print(f"Could not read the warm file: {e}")
+            sys.exit(1)
+        proxyOptions["warmConcurrency"] = args.warm_concurrency
+        proxyOptions["warmBeforeServing"] = args.warm_before_serving
+
+    # If we were able to cast the requested listening port to an int start the server
+    if args.workers == 1:
+        proxy = Proxy(**proxyOptions)
+        asyncio.run(proxy.server(listeningPort))
+    else:
+        # Run one proxy per worker process, all sharing the port and the cache directory
+        WorkerSupervisor(args.workers, listeningPort, proxyOptions).run()
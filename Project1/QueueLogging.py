@@ -0,0 +1,37 @@
+# Maslin Farrell
+# Computer Networks Project 1
+import logging
+import queue
+import sys
+
+from logging.handlers import QueueHandler, QueueListener
+
+
+def startQueueLogging(level: int = logging.INFO):
+    """
+    Routes the root logger through a queue so logging from the event loop never blocks on writing to stdout.
+    Log calls only put the record on the queue, a background thread formats and writes them.
+    Calling this again while queue logging is running does nothing.
+
+    Parameters:
+    level (int): The lowest level that gets logged.
+
+    Returns:
+    listener (QueueListener): The running listener, stop it to flush the queue. None if queue logging was already running.
+    """
+    root = logging.getLogger()
+    if any(isinstance(handler, QueueHandler) for handler in root.handlers):
+        return None
+    root.setLevel(level)
+
+    # Write the messages the same way print did, our messages already say if they are an error
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(logging.Formatter("%(message)s"))
+
+    # The queue is unbounded so a burst of logging can never stall a request
+    logQueue = queue.SimpleQueue()
+    listener = QueueListener(logQueue, output, respect_handler_level=True)
+
+    root.handlers = [QueueHandler(logQueue)]
+    listener.start()
+    return listener
@@ -0,0 +1,156 @@
+# Maslin Farrell
+# Computer Networks Project 1
+import secrets
+
+
+# Cap on the number of ranges in one request so a client can't make us send thousands of tiny parts
+MAX_RANGES = 16
+
+
+def parseRange(value: str, size: int):
+    """
+    Parses a Range header against the size of the body it applies to.
+    Handles 'bytes=first-last', open ended 'bytes=first-' and suffix 'bytes=-length' ranges, separated by commas.
+
+    Parameters:
+    value (str): The value of the Range header.
+    size (int): The size of the full body in bytes.
+
+    Returns:
+    ranges (list): The satisfiable ranges as (first, last) byte offsets, last included. An empty list means none of them
+    can be satisfied and the client should get a 416. None means the header is malformed and should be ignored.
+    """
+    unit, separator, specs = value.partition('=')
+    if not separator or unit.strip().lower() != "bytes":
+        return None
+
+    specs = specs.split(',')
+    if len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        first, dash, last = spec.strip().partition('-')
+        if not dash or not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+
+        if not first:
+            # A suffix range asks for the last few bytes of the body
+            length = int(last)
+            if length > 0 and size > 0:
+                ranges.append((max(0, size - length), size - 1))
+            continue
+
+        first = int(first)
+        last = int(last) if last else None
+        if last is not None and last < first:
+            return None
+
+        # A range that starts past the end can't be satisfied, one that ends past the end or is open ended is cut short
+        if first < size:
+            ranges.append((first, size - 1 if last is None else min(last, size - 1)))
+
+    return ranges
+
+
+def ifRangeMatches(value: str, headers: dict) -> bool:
+    """
+    Checks an If-Range validator against the headers we stored with the file.
+    Entity tags have to match with the strong comparison, so weak tags never match.
+
+    Parameters:
+    value (str): The value of the If-Range header, an entity tag or a date.
+    headers (dict): The stored origin headers with lower-cased names.
+
+    Returns:
+    bool: True if our copy is the one the client has part of, so a range can be sent; False if the whole body should be sent.
+    """
+    value = value.strip()
+    if value.startswith("W/"):
+        return False
+    if value.startswith('"'):
+        etag = headers.get("etag", "")
+        return not etag.startswith("W/") and etag == value
+    return headers.get("last-modified") == value
+
+
+def requestedRanges(requestHeaders: dict, headers: dict, size: int):
+    """
+    Works out which ranges of a body should be sent for a request, taking Range and If-Range into account.
+
+    Parameters:
+    requestHeaders (dict): The request headers with lower-cased names.
+    headers (dict): The stored or origin response headers with lower-cased names.
+    size (int): The size of the full body in bytes.
+
+    Returns:
+    ranges (list): The ranges to send as (first, last) byte offsets, an empty list if none can be satisfied,
+    or None if the whole body should be sent.
+    """
+    value = requestHeaders.get("range") if requestHeaders else None
+    if value is None:
+        return None
+    if "if-range" in requestHeaders and not ifRangeMatches(requestHeaders["if-range"], headers):
+        return None
+    return parseRange(value, size)
+
+
+def contentRange(first: int, last: int, size: int) -> str:
+    """
+    Formats the Content-Range value for one range.
+
+    Parameters:
+    first (int): The offset of the first byte in the range.
+    last (int): The offset of the last byte in the range.
+    size (int): The size of the full body in bytes.
+
+    Returns:
+    contentRange (str): For example 'bytes 0-99/1000'
+    """
+    return f"bytes {first}-{last}/{size}"
+
+
+def newBoundary() -> str:
+    """
+    Makes a boundary for a multipart/byteranges body, random so it can't turn up inside the body by accident.
+
+    Returns:
+    boundary (str): The boundary string without the leading dashes.
+    """
+    return secrets.token_hex(16)
+
+
+def multipartHeads(ranges: list, size: int, contentType: str, boundary: str) -> list:
+    """
+    Builds the part heads for a multipart/byteranges body, the body of each part goes straight after its head.
+
+    Parameters:
+    ranges (list): The ranges being sent as (first, last) byte offsets.
+    size (int): The size of the full body in bytes.
+    contentType (str): The Content-Type of the full body, or None if it doesn't have one.
+    boundary (str): The multipart boundary.
+
+    Returns:
+    partHeads (list): The encoded head of each part, in the same order as ranges.
+    """
+    partHeads = []
+    for first, last in ranges:
+        partHead = f"\r\n--{boundary}\r\n"
+        if contentType is not None:
+            partHead += f"Content-Type: {contentType}\r\n"
+        partHead += f"Content-Range: {contentRange(first, last, size)}\r\n\r\n"
+        partHeads.append(partHead.encode("utf-8"))
+    return partHeads
+
+
+def multipartTail(boundary: str) -> bytes:
+    """
+    Builds the closing delimiter of a multipart/byteranges body.
+
+    Parameters:
+    boundary (str): The multipart boundary.
+
+    Returns:
+    tail (bytes): The encoded closing delimiter.
+    """
+    return f"\r\n--{boundary}--\r\n".encode("utf-8")
@@ -0,0 +1,275 @@
+# Maslin Farrell
+# Computer Networks Project 1
+import asyncio
+
+
+class InFlightFetch:
+    """
+    A single origin fetch that any number of clients can read from while it streams in.
+    The fetching task publishes the response head and body chunks, every client waiting on the same cache key reads them from here.
+    Chunks are kept from the start of the body while it fits in the window, so that clients that join late still get the whole body.
+    Once the body outgrows the window, or it won't be cached, the fetch can no longer be joined and each chunk is dropped once every client has read it.
+    A client joins before the head is sent to it, so the chunks it hasn't read yet are kept even if it hasn't started reading.
+    The fetching task then waits for the slowest client to catch up before going over the window, so a fetch never holds much more than the window.
+    """
+
+    def __init__(self, windowBytes: int = 8 * 1024 * 1024):
+        """
+        Parameters:
+        windowBytes (int): The most body bytes kept for the clients reading the fetch.
+        """
+        self.statusLine = None
+        self.statusCode = None
+        self.headers = None
+
+        # The chunks still kept, the first of them is chunk number firstChunk of the body
+        self.chunks = []
+        self.firstChunk = 0
+        self.bufferedBytes = 0
+        self.windowBytes = windowBytes
+
+        # True while every chunk from the start of the body is still kept, so a client that joins now gets the whole body
+        self.joinable = True
+
+        # Maps each client reading the fetch to the number of the next chunk it reads
+        self.readers = {}
+
+        self.done = False
+        self.complete = False
+
+        # True when the body is our own cached copy, for example after the origin answered a revalidation with a 304
+        self.fromCache = False
+
+        # Set once the head has arrived, or once the fetch failed before we got one
+        self.headReady = asyncio.Event()
+
+        # Replaced with a fresh event every time a chunk is published so readers can wait for the next one
+        self.updated = asyncio.Event()
+
+        # Set when a client reads a chunk or stops reading, so the fetching task can wait for the slowest one to catch up
+        self.readProgress = asyncio.Event()
+
+        # Holds a reference to the fetching task so it isn't garbage collected while it runs
+        self.task = None
+
+        # The background write of the body to our cache, if it is being cached
+        self.cacheWrite = None
+
+        # The sibling proxy the response came from, None if it came from the origin
+        self.peer = None
+
+        # Set when the key was purged while the fetch ran, its response is still served to the clients waiting on it but never cached
+        self.purged = False
+
+    def setHead(self, statusLine: str, statusCode: str, headers: dict):
+        """
+        Publishes the response head to every waiting client.
+
+        Parameters:
+        statusLine (str): Status line contains the HTTP status of the request.
+        statusCode (str): The status code from the status line.
+        headers (dict): The response headers with lower-cased names.
+        """
+        self.statusLine = statusLine
+        self.statusCode = statusCode
+        self.headers = headers
+        self.headReady.set()
+
+    def append(self, chunk: bytes):
+        """
+        Publishes the next piece of the body to every waiting client.
+
+        Parameters:
+        chunk (bytes): The next piece of the body.
+        """
+        self.chunks.append(chunk)
+        self.bufferedBytes += len(chunk)
+        if self.bufferedBytes > self.windowBytes:
+            self.joinable = False
+        self.trim()
+        self.notify()
+
+    def join(self):
+        """
+        Registers a client that will read the body, so no chunk it hasn't read is dropped. Only called while the fetch is joinable.
+        The client that started the fetch joins before the fetching task can publish anything.
+
+        Returns:
+        reader (object): The client's handle, passed to stream and leave.
+        """
+        reader = object()
+        self.readers[reader] = self.firstChunk
+        return reader
+
+    def leave(self, reader):
+        """
+        Unregisters a client, for example once it has read the whole body or gave up. Leaving twice is the same as leaving once.
+
+        Parameters:
+        reader (object): The handle join returned.
+        """
+        if reader in self.readers:
+            del self.readers[reader]
+            self.readProgress.set()
+            self.trim()
+
+    def stopRetaining(self):
+        """
+        Stops keeping chunks for clients that haven't joined yet, for example because the response won't be cached.
+        """
+        self.joinable = False
+        self.trim()
+
+    def trim(self):
+        """
+        Drops the chunks every client has already read, once the fetch can no longer be joined.
+        """
+        if self.joinable:
+            return
+        oldest = min(self.readers.values(), default=self.firstChunk + len(self.chunks))
+        if oldest <= self.firstChunk:
+            return
+        dropped = oldest - self.firstChunk
+        self.bufferedBytes -= sum(len(chunk) for chunk in self.chunks[:dropped])
+        del self.chunks[:dropped]
+        self.firstChunk = oldest
+
+    async def waitForReaders(self):
+        """
+        Waits until the slowest client reading the fetch is back within the window, the fetching task calls this after publishing a chunk.
+        Clients that stop reading are timed out by their own writes, so this can't wait forever.
+        """
+        while not self.joinable and self.bufferedBytes > self.windowBytes and self.readers:
+            self.readProgress.clear()
+            await self.readProgress.wait()
+            self.trim()
+
+    def finish(self, complete: bool):
+        """
+        Marks the fetch as finished. If the fetch failed before the head arrived, waiting clients see a statusCode of None.
+
+        Parameters:
+        complete (bool): True if the whole body was received from the origin; False otherwise.
+        """
+        self.done = True
+        self.complete = complete
+        self.headReady.set()
+        self.notify()
+
+    def notify(self):
+        """
+        Wakes up every client waiting on the next chunk.
+        """
+        self.updated.set()
+        self.updated = asyncio.Event()
+
+    async def waitForHead(self):
+        """
+        Waits until the response head has arrived or the fetch has failed.
+        """
+        await self.headReady.wait()
+
+    async def stream(self, reader):
+        """
+        Async generator that yields the body from the first chunk, waiting for more chunks until the fetch is finished.
+        The client leaves the fetch once the generator is closed.
+
+        Parameters:
+        reader (object): The handle join returned.
+
+        Yields:
+        chunk (bytes): The next piece of the body.
+        """
+        index = self.readers[reader]
+        try:
+            while True:
+                # Grab the event before checking for chunks so we can't miss a notification in between
+                updated = self.updated
+
+                while index < self.firstChunk + len(self.chunks):
+                    chunk = self.chunks[index - self.firstChunk]
+                    index = self.readers[reader] = index + 1
+                    self.readProgress.set()
+                    yield chunk
+
+                if self.done:
+                    return
+
+                await updated.wait()
+        finally:
+            self.leave(reader)
+
+
+class RequestCoalescer:
+    """
+    Single-flight for origin fetches, concurrent misses on the same cache key share one fetch instead of each going to the origin.
+    """
+
+    def __init__(self, windowBytes: int = 8 * 1024 * 1024):
+        """
+        Parameters:
+        windowBytes (int): The most body bytes each fetch keeps for the clients reading it.
+        """
+        self.windowBytes = windowBytes
+
+        # Maps the cache key to the fetch that is currently in flight for it
+        self.inFlight = {}
+
+        # Counters for how many misses started a fetch and how many joined an existing one
+        self.leaders = 0
+        self.followers = 0
+
+    def get(self, key: str):
+        """
+        Looks up the fetch in flight for a cache key and counts the caller as a follower if there is one.
+
+        Parameters:
+        key (str): The cache key.
+
+        Returns:
+        fetch (InFlightFetch): The fetch in flight for this key, or None if there isn't one.
+        """
+        fetch = self.inFlight.get(key)
+        if fetch is not None:
+            self.followers += 1
+        return fetch
+
+    def start(self, key: str) -> InFlightFetch:
+        """
+        Registers a new fetch for a cache key, the caller is responsible for running it and removing it when it finishes.
+
+        Parameters:
+        key (str): The cache key.
+
+        Returns:
+        fetch (InFlightFetch): The newly registered fetch.
+        """
+        fetch = InFlightFetch(self.windowBytes)
+        self.inFlight[key] = fetch
+        self.leaders += 1
+        return fetch
+
+    def remove(self, key: str, fetch: InFlightFetch):
+        """
+        Removes a finished fetch so the next miss for the key goes to the cache or starts a new fetch.
+
+        Parameters:
+        key (str): The cache key.
+        fetch (InFlightFetch): The fetch that finished.
+        """
+        if self.inFlight.get(key) is fetch:
+            del self.inFlight[key]
+
+    def stats(self) -> dict:
+        """
+        Returns the counters for request coalescing.
+
+        Returns:
+        stats (dict): How many fetches were started, how many misses were coalesced into one, how many fetches are in flight and the body bytes they keep.
+        """
+        return {
+            "fetches": self.leaders,
+            "coalesced": self.followers,
+            "inFlight": len(self.inFlight),
+            "bufferedBytes": sum(fetch.bufferedBytes for fetch in self.inFlight.values()),
+        }
@@ -0,0 +1,150 @@
+# Maslin Farrell
+# Computer Networks Project 1
+import collections
+
+
+class LatencyWindow:
+    """
+    The most recent response head latencies from one origin, with the hedge delay worked out from them.
+    Sorting the window on every request would cost more than it saves, so the delay is only worked out again every few samples.
+    """
+
+    def __init__(self, size: int):
+        """
+        Parameters:
+        size (int): How many of the most recent latencies are kept.
+        """
+        self.samples = collections.deque(maxlen=size)
+        self.delay = None
+        self.sinceUpdate = 0
+
+
+class RequestHedger:
+    """
+    Hedged origin requests, so a single slow origin connection or replica doesn't decide the latency of a miss.
+    If an origin request hasn't got its response head back after the origin's usual latency at a chosen percentile,
+    a second attempt is sent and whichever answers first is used, the other one is cancelled.
+    Hedges are paid for out of a budget that every origin request adds a fraction of a hedge to, so hedging can only
+    add that fraction to the load on the origins, on top of a small burst.
+    Origins we don't have enough latencies for yet are never hedged.
+    """
+
+    def __init__(self, percentile: float = 0.95, budget: float = 0.05, minDelay: float = 0.01, window: int = 1000,
+                 minSamples: int = 20, burst: float = 10.0, maxOrigins: int = 1000):
+        """
+        Parameters:
+        percentile (float): The percentile of an origin's latency we wait for before hedging, as a fraction, for example 0.95 for p95.
+        budget (float): The most hedges per origin request, as a fraction, for example 0.05 to add at most 5% to the origin load.
+        minDelay (float): The shortest we wait before hedging in seconds, so fast origins aren't hedged on noise.
+        window (int): How many of the most recent latencies are kept per origin.
+        minSamples (int): How many latencies we need from an origin before we hedge its requests.
+        burst (float): The most unspent hedges the budget can save up.
+        maxOrigins (int): The most origins we keep latencies for, the least recently used is dropped when there are more.
+        """
+        self.percentile = percentile
+        self.budget = budget
+        self.minDelay = minDelay
+        self.window = window
+        self.minSamples = minSamples
+        self.burst = burst
+        self.maxOrigins = maxOrigins
+
+        # Maps (host, port) to its LatencyWindow, the front is the least recently used origin
+        self.origins = collections.OrderedDict()
+
+        # Hedges we can afford right now, the budget starts full
+        self.tokens = burst
+
+        # Counters for how often we hedged and which attempt won
+        self.requests = 0
+        self.hedges = 0
+        self.hedgeWins = 0
+        self.primaryWins = 0
+        self.budgetExhausted = 0
+
+    def delayFor(self, host: str, port: int):
+        """
+        Counts an origin request towards the hedge budget and says how long it may wait for its response head before it is hedged.
+
+        Parameters:
+        host (str): The origin host.
+        port (int): The origin port.
+
+        Returns:
+        delay (float): How many seconds to wait before hedging, or None if we don't know the origin well enough to hedge it.
+        """
+        self.requests += 1
+        self.tokens = min(self.burst, self.tokens + self.budget)
+
+        latencies = self.origins.get((host, port))
+        if latencies is None:
+            return None
+        self.origins.move_to_end((host, port))
+        return latencies.delay
+
+    def allow(self) -> bool:
+        """
+        Spends one hedge from the budget.
+
+        Returns:
+        bool: True if the hedge can be sent; False if the budget is used up.
+        """
+        if self.tokens < 1.0:
+            self.budgetExhausted += 1
+            return False
+        self.tokens -= 1.0
+        self.hedges += 1
+        return True
+
+    def record(self, host: str, port: int, seconds: float):
+        """
+        Records how long an origin took to send its response head.
+
+        Parameters:
+        host (str): The origin host.
+        port (int): The origin port.
+        seconds (float): The time from starting the request until its response head arrived.
+        """
+        latencies = self.origins.get((host, port))
+        if latencies is None:
+            latencies = self.origins[(host, port)] = LatencyWindow(self.window)
+            if len(self.origins) > self.maxOrigins:
+                self.origins.popitem(last=False)
+        latencies.samples.append(seconds)
+        latencies.sinceUpdate += 1
+
+        # Work the delay out as soon as we have enough latencies, then again every twentieth of a window
+        count = len(latencies.samples)
+        if count >= self.minSamples and (latencies.delay is None or latencies.sinceUpdate >= max(1, self.window // 20)):
+            ordered = sorted(latencies.samples)
+            latencies.delay = max(self.minDelay, ordered[min(count - 1, int(self.percentile * count))])
+            latencies.sinceUpdate = 0
+
+    def won(self, hedged: bool):
+        """
+        Records which attempt of a hedged request answered first.
+
+        Parameters:
+        hedged (bool): True if the hedge won; False if the first attempt did.
+        """
+        if hedged:
+            self.hedgeWins += 1
+        else:
+            self.primaryWins += 1
+
+    def stats(self) -> dict:
+        """
+        Returns the counters for hedging.
+
+        Returns:
+        stats (dict): Origin requests, hedges sent, which attempt won, how often the budget ran out, and how many origins we have latencies for.
+        """
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedgeRate": self.hedges / self.requests if self.requests else 0.0,
+            "hedgeWins": self.hedgeWins,
+            "primaryWins": self.primaryWins,
+            "budgetExhausted": self.budgetExhausted,
+            "origins": len(self.origins),
+        }
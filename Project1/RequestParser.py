@@ -0,0 +1,176 @@
+# Maslin Farrell
+# Computer Networks Project 1
+from urllib.parse import urlparse
+
+from HttpParser import MAX_HEADER_BYTES, HttpParseError
+
+
+# How much we read from a client at a time, a typical request head fits in one read
+CLIENT_READ_SIZE = 16 * 1024
+
+
+class HttpRequest:
+    """
+    A parsed client request: the request line split into its parts, the headers and the parts of the requested URL.
+    A request line that doesn't have exactly three parts leaves method, target and version as None.
+    """
+
+    def __init__(self, requestLine: str, headers: dict = None):
+        """
+        Parameters:
+        requestLine (str): The request line, for example 'GET http://zhiju.me/networks/valid.html HTTP/1.1'
+        headers (dict): The request headers with lower-cased names.
+        """
+        self.requestLine = requestLine
+        self.headers = headers if headers is not None else {}
+
+        parts = requestLine.split()
+        self.method, self.target, self.version = parts if len(parts) == 3 else (None, None, None)
+
+        # The parts of the URL are worked out once, the first time something asks for them
+        self.parsedURL = None
+
+    @classmethod
+    def forUrl(cls, url: str) -> "HttpRequest":
+        """
+        Builds the GET request a client would send for a URL, this is used when we fetch files without a client.
+
+        Parameters:
+        url (str): The http:// URL.
+
+        Returns:
+        request (HttpRequest): A GET request for the URL with no headers.
+        """
+        return cls(f"GET {url} HTTP/1.1")
+
+    @property
+    def url(self):
+        """
+        The requested URL, parsed.
+
+        Returns:
+        parsedURL (ParseResult): The result of urlparse on the request target.
+        """
+        if self.parsedURL is None:
+            self.parsedURL = urlparse(self.target or "")
+        return self.parsedURL
+
+    @property
+    def keepAlive(self) -> bool:
+        """
+        Checks if the client wants to keep the connection open after this request.
+
+        Returns:
+        bool: False if the client sent 'Connection: close'; True otherwise.
+        """
+        return "close" not in self.headers.get("connection", "").lower()
+
+
+class RequestParser:
+    """
+    Incremental parser for the requests a client sends on one connection.
+    Bytes are fed in as they arrive from the socket, in whatever pieces TCP delivers them, and a request comes out once its whole head is buffered.
+    Any bytes after the head, such as pipelined requests, stay in the buffer for the next call.
+    The buffer is only scanned once for the end of the head, and the head is copied out of it once, however many pieces it arrived in.
+    """
+
+    def __init__(self, maxHeadBytes: int = MAX_HEADER_BYTES):
+        """
+        Parameters:
+        maxHeadBytes (int): The largest request head we accept, a client that sends more without ending its head is rejected.
+        """
+        self.maxHeadBytes = maxHeadBytes
+        self.buffer = bytearray()
+
+        # How far into the buffer we already know there is no end of the head, so we don't scan those bytes again
+        self.scanned = 0
+
+    def feed(self, data: bytes):
+        """
+        Adds bytes received from the client to the buffer.
+
+        Parameters:
+        data (bytes): The bytes that were just read from the socket.
+        """
+        self.buffer += data
+
+    def hasPartialRequest(self) -> bool:
+        """
+        Checks if part of a request is buffered, as opposed to the client being between requests.
+
+        Returns:
+        bool: True if part of the next request has been buffered; False otherwise.
+        """
+        # nextRequest drops the blank lines between requests, so anything left over is the start of a request
+        return bool(self.buffer)
+
+    def nextRequest(self):
+        """
+        Takes the next complete request head out of the buffer and parses it.
+
+        Returns:
+        request (HttpRequest): The next request, or None if the rest of its head hasn't arrived yet.
+
+        Raises:
+        HttpParseError: If the head is longer than maxHeadBytes.
+        """
+        buffer = self.buffer
+
+        # Skip any blank lines left over between requests
+        if buffer and buffer[0] in (13, 10):
+            del buffer[:len(buffer) - len(buffer.lstrip(b'\r\n'))]
+            self.scanned = 0
+
+        # The head ends with an empty line, clients should use CRLF but a bare LF is accepted too
+        # Start a few bytes back in case the end of the head was split across two reads
+        start = self.scanned - 3 if self.scanned > 3 else 0
+        end = buffer.find(b'\r\n\r\n', start)
+        headLength = end + 4
+        if end < 0 or buffer.find(b'\n\n', start, end) >= 0:
+            end = buffer.find(b'\n\n', start)
+            headLength = end + 2
+        if end < 0:
+            self.scanned = len(buffer)
+            if len(buffer) > self.maxHeadBytes:
+                raise HttpParseError(f"Request head is longer than {self.maxHeadBytes} bytes")
+            return None
+        if end > self.maxHeadBytes:
+            raise HttpParseError(f"Request head is longer than {self.maxHeadBytes} bytes")
+
+        head = bytes(buffer[:end])
+        del buffer[:headLength]
+        self.scanned = 0
+        return parseRequestHead(head)
+
+
+def parseRequestHead(head: bytes) -> HttpRequest:
+    """
+    Parses a request head, without the empty line that ends it, into a request.
+
+    Parameters:
+    head (bytes): The request line and header lines.
+
+    Returns:
+    request (HttpRequest): The parsed request.
+
+    Raises:
+    UnicodeDecodeError: If the request line isn't valid UTF-8.
+    """
+    lines = head.split(b'\n')
+    requestLine = lines[0].rstrip(b'\r').decode("utf-8")
+
+    # Header values are latin-1, so the rest of the head is decoded in one go rather than line by line
+    headers = {}
+    if len(lines) > 1:
+        for line in head[len(lines[0]) + 1:].decode("latin-1").split('\n'):
+            name, separator, value = line.partition(':')
+            # Lines without a colon aren't headers, so they are skipped
+            if not separator:
+                continue
+
+            # Repeated headers are folded into one comma separated value
+            name = name.strip().lower()
+            value = value.strip()
+            headers[name] = f"{headers[name]}, {value}" if name in headers else value
+
+    return HttpRequest(requestLine, headers)
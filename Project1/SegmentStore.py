@@ -0,0 +1,537 @@
+# Maslin Farrell
+# Computer Networks Project 1
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from CacheIndex import CacheEntry, CacheIndex
+
+
+# The journal of every entry in the store, replayed at startup instead of walking the cache directory
+JOURNAL_NAME = "index.log"
+SEGMENT_SUFFIX = ".seg"
+
+# The journal is rewritten from the live entries once it holds this many more records than there are entries
+JOURNAL_SLACK = 10000
+
+
+class SegmentStore:
+    """
+    Packs small cached bodies into large append-only segment files instead of giving every URL its own file.
+    This saves an inode and a directory entry per object, and a cold start reads one journal instead of walking the whole cache tree.
+    Bodies are appended to the active segment and located by (segment, offset, size), they are read back with pread or sent with sendfile.
+    Every change to an entry is appended to a JSON-lines journal: 'put' with the stored headers, 'move' when the compactor relocates a body,
+    and 'del' when it is removed. Bodies too big for a segment are kept as plain files, but they are recorded in the journal as well.
+    A body that is replaced or removed becomes dead space in its segment, which the SegmentCompactor reclaims.
+    Segments are only ever written by this process, so the store can't be shared between worker processes.
+    """
+
+    def __init__(self, directory: str, segmentBytes: int = 64 * 1024 * 1024, maxObjectBytes: int = 256 * 1024,
+                 compactThreshold: float = 0.5):
+        """
+        Parameters:
+        directory (str): The directory the segments and the journal are stored in.
+        segmentBytes (int): How big a segment grows before we start a new one.
+        maxObjectBytes (int): The largest stored body that goes in a segment, bigger ones are stored as plain files.
+        compactThreshold (float): A sealed segment is compacted once this fraction of it is dead space.
+        """
+        self.directory = Path(directory)
+        self.segmentBytes = segmentBytes
+        self.maxObjectBytes = maxObjectBytes
+        self.compactThreshold = compactThreshold
+
+        # Appends and journal writes come from worker threads, this keeps each one whole
+        self.lock = threading.Lock()
+
+        # Maps the cache key to its current entry, the journal is rewritten from these
+        self.live = {}
+
+        # Maps each segment id to [size, dead bytes] and to the appends that are not in the journal yet
+        self.segments = {}
+        self.unrecorded = {}
+
+        # The segment being appended to and its file descriptor
+        self.activeSegment = None
+        self.activeFd = None
+
+        # Read-only file descriptors for pread, kept open between reads
+        self.readers = {}
+
+        # Maps the cache key to (old entry, new entry) for the bodies the compactor moved in the index but hasn't journalled yet
+        self.moving = {}
+
+        # Compacted segments are deleted on the next pass, so a read that already looked up the old location can still finish
+        self.retired = []
+
+        self.journalFd = None
+        self.journalRecords = 0
+
+        # Counters for the store and the compactor
+        self.loadTime = 0.0
+        self.appends = 0
+        self.compactions = 0
+        self.movedBytes = 0
+        self.bytesReclaimed = 0
+
+    def segmentPath(self, segmentId: int) -> Path:
+        """
+        Builds the location of a segment file.
+
+        Parameters:
+        segmentId (int): The segment's id.
+
+        Returns:
+        path (Path): The segment file.
+        """
+        return self.directory / f"{segmentId:08d}{SEGMENT_SUFFIX}"
+
+    def load(self, pathFor) -> list:
+        """
+        Replays the journal into entries and opens a new active segment. This is blocking, so it is meant to be run in a thread.
+        Records pointing past the end of their segment, for example from a crash before the journal caught up, are dropped.
+        The journal is rewritten afterwards so it only holds the live entries.
+
+        Parameters:
+        pathFor (function): Builds the plain file location for a cache key, for bodies kept outside the segments.
+
+        Returns:
+        entries (list): The CacheEntry of every stored body.
+        """
+        startTime = time.perf_counter()
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        # Find the segments on disk and how big they are
+        sizes = {}
+        for file in os.scandir(self.directory):
+            name, suffix = os.path.splitext(file.name)
+            if suffix == SEGMENT_SUFFIX and name.isdigit():
+                sizes[int(name)] = file.stat().st_size
+
+        entries = {}
+        journalPath = self.directory / JOURNAL_NAME
+        if journalPath.exists():
+            with open(journalPath, 'rb') as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash, everything before it is still good
+                        continue
+                    self.replay(record, entries, pathFor)
+
+        # Only keep entries whose bytes are really on disk
+        for key, entry in list(entries.items()):
+            if entry.segment is None:
+                if not entry.path.exists():
+                    del entries[key]
+            elif entry.offset + entry.size > sizes.get(entry.segment, -1):
+                del entries[key]
+
+        # Every byte of a segment is dead unless a live entry points at it
+        self.segments = {segmentId: [size, size] for segmentId, size in sizes.items()}
+        for entry in entries.values():
+            if entry.segment is not None:
+                self.segments[entry.segment][1] -= entry.size
+
+        self.live = entries
+        self.openSegment(max(sizes, default=0) + 1)
+        self.rewriteJournal()
+        self.loadTime = time.perf_counter() - startTime
+        return list(entries.values())
+
+    def replay(self, record: dict, entries: dict, pathFor):
+        """
+        Applies one journal record to the entries being loaded.
+
+        Parameters:
+        record (dict): The journal record.
+        entries (dict): Maps the cache key to its CacheEntry so far.
+        pathFor (function): Builds the plain file location for a cache key.
+        """
+        key = record.get("key")
+        operation = record.get("op")
+        if operation == "put":
+            segment = record.get("segment")
+            path = self.segmentPath(segment) if segment is not None else pathFor(key)
+            entry = CacheEntry(path, record["size"], record["storedTime"], record.get("headers"), key,
+                               record.get("storedEncoding"), record.get("identitySize"), segment, record.get("offset", 0))
+            entries[key] = entry
+        elif operation == "move" and key in entries:
+            entry = entries[key]
+            entry.segment, entry.offset = record["segment"], record["offset"]
+            entry.path = self.segmentPath(entry.segment)
+        elif operation == "del":
+            entries.pop(key, None)
+
+    def openSegment(self, segmentId: int):
+        """
+        Starts appending to a new segment. The caller holds the lock, or is loading the store.
+
+        Parameters:
+        segmentId (int): The new segment's id.
+        """
+        if self.activeFd is not None:
+            os.close(self.activeFd)
+        self.activeSegment = segmentId
+        self.activeFd = os.open(self.segmentPath(segmentId), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.segments[segmentId] = [0, 0]
+
+    def append(self, body: bytes):
+        """
+        Appends a stored body to the active segment, starting a new segment if it is full. This is blocking.
+        The body isn't live until its entry is recorded.
+
+        Parameters:
+        body (bytes): The body as it is stored.
+
+        Returns:
+        segmentId (int): The segment the body was written to.
+        offset (int): Where in the segment the body starts.
+        """
+        with self.lock:
+            size = self.segments[self.activeSegment][0]
+            if size > 0 and size + len(body) > self.segmentBytes:
+                self.openSegment(self.activeSegment + 1)
+                size = 0
+
+            segmentId = self.activeSegment
+            view = memoryview(body)
+            while view:
+                written = os.write(self.activeFd, view)
+                view = view[written:]
+
+            # Counted as dead until its entry is recorded, so a body that never makes it into the index is reclaimed
+            self.segments[segmentId][0] += len(body)
+            self.segments[segmentId][1] += len(body)
+            self.unrecorded[segmentId] = self.unrecorded.get(segmentId, 0) + 1
+            self.appends += 1
+            return segmentId, size
+
+    def read(self, entry: CacheEntry) -> bytes:
+        """
+        Reads a body out of its segment with pread. This is blocking, so it is meant to be run in a thread.
+
+        Parameters:
+        entry (CacheEntry): The entry of a body stored in a segment.
+
+        Returns:
+        body (bytes): The body as it is stored.
+        """
+        fd = self.readers.get(entry.segment)
+        if fd is None:
+            fd = os.open(entry.path, os.O_RDONLY)
+            with self.lock:
+                if entry.segment in self.readers:
+                    os.close(fd)
+                    fd = self.readers[entry.segment]
+                else:
+                    self.readers[entry.segment] = fd
+
+        body = os.pread(fd, entry.size, entry.offset)
+        if len(body) != entry.size:
+            raise OSError(f"Segment {entry.path} is shorter than its index entry")
+        return body
+
+    def writeJournal(self, record: dict):
+        """
+        Appends a record to the journal in a single write. The caller holds the lock.
+
+        Parameters:
+        record (dict): The record to append.
+        """
+        os.write(self.journalFd, (json.dumps(record, separators=(',', ':')) + "\n").encode("utf-8"))
+        self.journalRecords += 1
+
+    @staticmethod
+    def putRecord(entry: CacheEntry) -> dict:
+        """
+        Builds the journal record for an entry.
+
+        Parameters:
+        entry (CacheEntry): The entry to record.
+
+        Returns:
+        record (dict): The 'put' record.
+        """
+        return {
+            "op": "put",
+            "key": entry.key,
+            "segment": entry.segment,
+            "offset": entry.offset,
+            "size": entry.size,
+            "storedTime": entry.storedTime,
+            "headers": entry.headers,
+            "storedEncoding": entry.storedEncoding,
+            "identitySize": entry.identitySize,
+        }
+
+    def record(self, entry: CacheEntry):
+        """
+        Records a new or refreshed entry in the journal, this takes the place of the '.meta' file. This is blocking.
+        If it replaces a body stored somewhere else, the old body becomes dead space.
+
+        Parameters:
+        entry (CacheEntry): The entry that was just added to the index.
+        """
+        with self.lock:
+            self.settleMove(entry.key)
+            previous = self.live.get(entry.key)
+            self.live[entry.key] = entry
+            self.writeJournal(self.putRecord(entry))
+
+            # A 304 refresh records the same body again, anything else is a body that was just appended
+            if previous is not None and (previous.segment, previous.offset, previous.path) == (entry.segment, entry.offset, entry.path):
+                return
+            if previous is not None:
+                self.markDead(previous)
+            if entry.segment is not None and entry.segment in self.segments:
+                self.segments[entry.segment][1] -= entry.size
+                self.unrecorded[entry.segment] = max(0, self.unrecorded.get(entry.segment, 0) - 1)
+
+    def abandon(self, segmentId: int):
+        """
+        Gives up on a body that was appended but will never be recorded, for example because its key was purged meanwhile.
+        Its bytes were already counted as dead, so this only lets its segment be compacted.
+
+        Parameters:
+        segmentId (int): The segment the body was appended to.
+        """
+        with self.lock:
+            if segmentId in self.unrecorded:
+                self.unrecorded[segmentId] = max(0, self.unrecorded[segmentId] - 1)
+
+    def forget(self, entry: CacheEntry):
+        """
+        Removes an entry's body from the store. This is blocking.
+        A body in a segment becomes dead space, a plain file is deleted.
+
+        Parameters:
+        entry (CacheEntry): The entry that was removed from the index.
+        """
+        with self.lock:
+            self.settleMove(entry.key)
+            current = self.live.get(entry.key)
+            if current is None or (current.segment, current.offset, current.path) != (entry.segment, entry.offset, entry.path):
+                return
+            del self.live[entry.key]
+            self.writeJournal({"op": "del", "key": entry.key})
+            self.markDead(entry)
+
+    def settleMove(self, key: str):
+        """
+        Journals a body the compactor moved, if it is still live, so the key's live entry is the one the index has. The caller holds the lock.
+
+        Parameters:
+        key (str): The cache key.
+        """
+        move = self.moving.pop(key, None)
+        if move is None:
+            return
+        previous, entry = move
+        if self.live.get(key) is not previous or entry.segment not in self.segments:
+            return
+        self.live[key] = entry
+        self.writeJournal({"op": "move", "key": key, "segment": entry.segment, "offset": entry.offset})
+        self.segments[entry.segment][1] -= entry.size
+        self.movedBytes += entry.size
+
+    def markDead(self, entry: CacheEntry):
+        """
+        Counts a body that is no longer live as dead space, or deletes it if it is a plain file. The caller holds the lock.
+
+        Parameters:
+        entry (CacheEntry): The entry whose body is no longer live.
+        """
+        if entry.segment is None:
+            entry.path.unlink(missing_ok=True)
+        elif entry.segment in self.segments:
+            self.segments[entry.segment][1] += entry.size
+
+    def compactable(self) -> list:
+        """
+        Finds the sealed segments with enough dead space to be worth compacting, the deadest first.
+
+        Returns:
+        segmentIds (list): The ids of the segments to compact.
+        """
+        with self.lock:
+            # An empty segment left behind by a restart is all dead space
+            candidates = [(dead / size if size else 1.0, segmentId) for segmentId, (size, dead) in self.segments.items()
+                          if segmentId != self.activeSegment and self.unrecorded.get(segmentId, 0) == 0]
+        candidates = [(deadFraction, segmentId) for deadFraction, segmentId in candidates if deadFraction >= self.compactThreshold]
+        return [segmentId for _, segmentId in sorted(candidates, reverse=True)]
+
+    def copyLive(self, segmentId: int) -> list:
+        """
+        Copies the live bodies out of a segment into the active segment. This is blocking, so it is meant to be run in a thread.
+        The entries aren't changed, the compactor swaps in entries for the copies on the event loop.
+
+        Parameters:
+        segmentId (int): The segment being compacted.
+
+        Returns:
+        copies (list): (key, old offset, size, new segment, new offset) for every body that was copied.
+        """
+        with self.lock:
+            liveEntries = sorted((entry for entry in self.live.values() if entry.segment == segmentId), key=lambda entry: entry.offset)
+
+        copies = []
+        if not liveEntries:
+            return copies
+        with open(self.segmentPath(segmentId), 'rb') as segment:
+            for entry in liveEntries:
+                body = os.pread(segment.fileno(), entry.size, entry.offset)
+                if len(body) != entry.size:
+                    continue
+                newSegment, newOffset = self.append(body)
+                copies.append((entry.key, entry.offset, entry.size, newSegment, newOffset))
+        return copies
+
+    def commitMoves(self, segmentId: int, copies: list):
+        """
+        Journals the bodies the compactor moved and retires the compacted segment. This is blocking.
+        A copy whose entry changed while it was being copied is left as dead space in the new segment.
+        The journal is flushed to disk without holding the lock, so appends and reads aren't held up behind the fsync.
+
+        Parameters:
+        segmentId (int): The segment that was compacted.
+        copies (list): The copies returned by copyLive.
+        """
+        with self.lock:
+            for key, _, _, newSegment, _ in copies:
+                self.unrecorded[newSegment] -= 1
+                self.settleMove(key)
+            journalFd = self.journalFd
+
+        # Journal the moves before the old segment can go, a crash before this still finds the bodies where the journal says
+        # Only the compactor replaces the journal, so the descriptor stays open until we are done with it
+        os.fsync(journalFd)
+
+        with self.lock:
+            size, _ = self.segments.pop(segmentId)
+            self.unrecorded.pop(segmentId, None)
+            self.retired.append((segmentId, self.readers.pop(segmentId, None)))
+            self.compactions += 1
+            self.bytesReclaimed += size
+
+            if self.journalRecords > 2 * len(self.live) + JOURNAL_SLACK:
+                self.rewriteJournal()
+
+    def releaseRetired(self):
+        """
+        Closes and deletes the segments compacted on the previous pass. This is blocking.
+        """
+        with self.lock:
+            retired, self.retired = self.retired, []
+        for segmentId, fd in retired:
+            try:
+                if fd is not None:
+                    os.close(fd)
+                self.segmentPath(segmentId).unlink(missing_ok=True)
+            except OSError as e:
+                logging.error(f"ERROR: Failed to delete a compacted segment! {e}")
+
+    def rewriteJournal(self):
+        """
+        Replaces the journal with a 'put' record for every live entry. The caller holds the lock, or is loading the store.
+        """
+        journalPath = self.directory / JOURNAL_NAME
+        tempPath = journalPath.with_name(f"{JOURNAL_NAME}.{os.getpid()}.tmp")
+        with open(tempPath, 'w', encoding="utf-8") as journal:
+            for entry in self.live.values():
+                journal.write(json.dumps(self.putRecord(entry), separators=(',', ':')) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(tempPath, journalPath)
+
+        if self.journalFd is not None:
+            os.close(self.journalFd)
+        self.journalFd = os.open(journalPath, os.O_WRONLY | os.O_APPEND)
+        self.journalRecords = len(self.live)
+
+    def stats(self) -> dict:
+        """
+        Returns the counters for the segment store.
+
+        Returns:
+        stats (dict): The number of segments, their total and dead bytes, the live entries, journal records and compactor counters.
+        """
+        with self.lock:
+            totalBytes = sum(size for size, _ in self.segments.values())
+            deadBytes = sum(dead for _, dead in self.segments.values())
+        return {
+            "segments": len(self.segments),
+            "bytes": totalBytes,
+            "deadBytes": deadBytes,
+            "entries": len(self.live),
+            "journalRecords": self.journalRecords,
+            "appends": self.appends,
+            "compactions": self.compactions,
+            "movedBytes": self.movedBytes,
+            "bytesReclaimed": self.bytesReclaimed,
+            "loadTime": self.loadTime,
+        }
+
+
+class SegmentCompactor:
+    """
+    Reclaims the dead space in the segment store in the background.
+    Each pass copies the live bodies out of sealed segments that are mostly dead, swaps in entries pointing at the copies and deletes the old segments on the next pass.
+    The copying happens in a worker thread, only swapping the entries happens on the event loop.
+    """
+
+    def __init__(self, cacheIndex: CacheIndex, segments: SegmentStore, interval: float = 30.0):
+        """
+        Parameters:
+        cacheIndex (CacheIndex): The index whose entries point into the segments.
+        segments (SegmentStore): The store being compacted.
+        interval (float): How many seconds we wait between passes.
+        """
+        self.cacheIndex = cacheIndex
+        self.segments = segments
+        self.interval = interval
+        self.passes = 0
+
+    async def compact(self) -> int:
+        """
+        Runs one compaction pass.
+
+        Returns:
+        compacted (int): How many segments were compacted.
+        """
+        self.passes += 1
+        await asyncio.to_thread(self.segments.releaseRetired)
+
+        segmentIds = self.segments.compactable()
+        for segmentId in segmentIds:
+            copies = await asyncio.to_thread(self.segments.copyLive, segmentId)
+
+            # Swap in an entry for each copy, unless it was replaced or removed while we were copying
+            # The old entries are left as they are, a read that already looked one up finishes from the old segment
+            for key, oldOffset, _, newSegment, newOffset in copies:
+                entry = self.cacheIndex.lookup(key)
+                if entry is not None and (entry.segment, entry.offset) == (segmentId, oldOffset):
+                    moved = entry.movedTo(self.segments.segmentPath(newSegment), newSegment, newOffset)
+                    self.segments.moving[key] = (entry, moved)
+                    self.cacheIndex.replace(moved)
+
+            await asyncio.to_thread(self.segments.commitMoves, segmentId, copies)
+
+        if segmentIds:
+            logging.info(f"Segment compaction rewrote {len(segmentIds)} segments")
+        return len(segmentIds)
+
+    async def run(self):
+        """
+        Runs a compaction pass every interval seconds, forever. This is started as a background task by the proxy.
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.compact()
+            except Exception as e:
+                logging.error(f"ERROR: Segment compaction failed! {e}")
@@ -0,0 +1,146 @@
+# Maslin Farrell
+# Computer Networks Project 1
+import asyncio
+import logging
+import multiprocessing
+import signal
+import time
+
+from multiprocessing.connection import wait
+
+from Proxy import Proxy
+
+
+class WorkerSupervisor:
+    """
+    Runs the proxy in several worker processes that all listen on the same port with SO_REUSEPORT.
+    The kernel spreads incoming connections between the workers so the proxy can use every core.
+    All workers share the disk cache directory, only worker 0 runs the evictor so the quota is enforced in one place.
+    The supervisor waits on the workers and restarts any that exit.
+    """
+
+    def __init__(self, workers: int, listeningPort: int, proxyOptions: dict = None, restartDelay: float = 1.0):
+        """
+        Parameters:
+        workers (int): How many worker processes to run.
+        listeningPort (int): The port every worker listens on.
+        proxyOptions (dict): Keyword arguments passed to each worker's Proxy.
+        restartDelay (float): How many seconds we wait before restarting a worker that exited, so a worker that crashes on startup doesn't spin.
+        """
+        if workers < 1:
+            raise ValueError("The number of workers must be at least 1")
+
+        self.workers = workers
+        self.listeningPort = listeningPort
+        self.proxyOptions = proxyOptions if proxyOptions is not None else {}
+        self.restartDelay = restartDelay
+
+        # Maps the worker id to its running process
+        self.processes = {}
+        self.restarts = 0
+        self.stopping = False
+
+    @staticmethod
+    def runWorker(workerId: int, listeningPort: int, proxyOptions: dict):
+        """
+        The entry point of a worker process.
+
+        Parameters:
+        workerId (int): The id of this worker, worker 0 runs the evictor.
+        listeningPort (int): The port every worker listens on.
+        proxyOptions (dict): Keyword arguments passed to the Proxy.
+        """
+        # The supervisor's SIGTERM handler is inherited when forking, a worker just exits on SIGTERM
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        # Each worker gets its own stats port, the shared port would hand the request to a random worker
+        if proxyOptions.get("statsPort") is not None:
+            proxyOptions = {**proxyOptions, "statsPort": proxyOptions["statsPort"] + workerId}
+
+        # The workers share the cache directory, so only worker 0 warms it
+        if workerId != 0:
+            proxyOptions = {**proxyOptions, "warmUrls": None}
+
+        try:
+            proxy = Proxy(sharedCache=True, **proxyOptions)
+            asyncio.run(proxy.server(listeningPort, reusePort=True, runEvictor=workerId == 0))
+        except KeyboardInterrupt:
+            # The supervisor is shutting everything down
+            pass
+
+    def startWorker(self, workerId: int):
+        """
+        Starts a worker process.
+
+        Parameters:
+        workerId (int): The id of the worker to start.
+        """
+        process = multiprocessing.Process(target=self.runWorker, args=(workerId, self.listeningPort, self.proxyOptions),
+                                          name=f"proxy-worker-{workerId}", daemon=True)
+        process.start()
+        self.processes[workerId] = process
+        print(f"Started proxy worker {workerId} (pid {process.pid}) on port {self.listeningPort}")
+
+    def run(self):
+        """
+        Starts every worker and restarts any that exit, until we are interrupted with Ctrl+c or SIGTERM.
+        """
+        # Treat SIGTERM like Ctrl+c so the workers are stopped with us
+        signal.signal(signal.SIGTERM, self.handleTerminate)
+
+        for workerId in range(self.workers):
+            self.startWorker(workerId)
+
+        try:
+            while not self.stopping:
+                # Block until at least one worker exits
+                sentinels = {process.sentinel: workerId for workerId, process in self.processes.items()}
+                for sentinel in wait(list(sentinels)):
+                    workerId = sentinels[sentinel]
+                    process = self.processes[workerId]
+                    process.join()
+                    logging.error(f"ERROR: Proxy worker {workerId} (pid {process.pid}) exited with code {process.exitcode}, restarting it")
+
+                    time.sleep(self.restartDelay)
+                    self.restarts += 1
+                    self.startWorker(workerId)
+
+        except KeyboardInterrupt:
+            print("\nServer interrupted by user (Ctrl+c). Stopping the workers.")
+        finally:
+            self.stop()
+
+    @staticmethod
+    def handleTerminate(signum, frame):
+        """
+        Signal handler for SIGTERM.
+
+        Parameters:
+        signum (int): The signal number.
+        frame (frame): The frame that was running when the signal arrived.
+        """
+        raise KeyboardInterrupt
+
+    def stop(self):
+        """
+        Stops every worker process.
+        """
+        self.stopping = True
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes.values():
+            process.join()
+
+    def stats(self) -> dict:
+        """
+        Returns the counters for the supervisor.
+
+        Returns:
+        stats (dict): How many workers we run, how many are alive and how many times a worker was restarted.
+        """
+        return {
+            "workers": self.workers,
+            "alive": sum(1 for process in self.processes.values() if process.is_alive()),
+            "restarts": self.restarts,
+        }
@@ -0,0 +1,437 @@
+# Maslin Farrell
+# Computer Networks Project 1
+#
+# Load tests the proxy against a local stand-in origin and reports requests/sec, latency percentiles, hit ratio and memory use.
+# The origin, the proxy and the load generator each run in their own process so they don't steal CPU from each other's event loop.
+#
+# Scenarios:
+# - all-miss: every request is for a new object, so every request goes to the origin
+# - all-hit: a small set of objects is warmed first, so every request is a cache hit
+# - zipf: keys are drawn from a Zipf distribution over a large key space, like real traffic
+# - large: a few large objects are warmed first, then downloaded over and over
+#
+# Example usage: python3 benchmarks/LoadBenchmark.py --scenarios all-hit zipf --concurrency 64 --duration 10 --json
+import argparse
+import asyncio
+import bisect
+import itertools
+import json
+import logging
+import multiprocessing
+import random
+import socket
+import sys
+import tempfile
+import time
+import zlib
+
+from pathlib import Path
+
+# The proxy lives in the folder above this one
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from Proxy import Proxy
+from QueueLogging import startQueueLogging
+
+
+SCENARIOS = ("all-miss", "all-hit", "zipf", "large")
+
+# The stand-in origin's name, the proxy resolves it through its hosts override so no real DNS is involved
+ORIGIN_HOST = "origin.bench"
+
+
+def runOrigin(port: int, latency: float, errorRate: float, ready):
+    """
+    Runs the stand-in origin server. Every path looks like '/obj/<key>/<size>' and returns size bytes.
+    A fraction of the keys, picked by their hash so it is the same on every run, answer 404 instead.
+
+    Parameters:
+    port (int): The port the origin listens on.
+    latency (float): How many seconds the origin waits before answering, to stand in for a real origin's distance and work.
+    errorRate (float): The fraction of keys that answer 404.
+    ready (Event): Set once the origin is listening.
+    """
+    block = bytes(range(256)) * 256
+
+    async def handleClient(reader, writer):
+        try:
+            while True:
+                requestLine = await reader.readline()
+                if not requestLine:
+                    break
+                while (await reader.readline()).strip():
+                    pass
+
+                path = requestLine.split()[1].decode("latin-1")
+                try:
+                    _, _, key, size = path.split('/')
+                    size = int(size)
+                except ValueError:
+                    key, size = path, 0
+
+                if latency:
+                    await asyncio.sleep(latency)
+
+                if zlib.crc32(key.encode("utf-8")) % 10000 < errorRate * 10000:
+                    writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+                else:
+                    writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\nContent-Length: {size}\r\n"
+                                 f"Cache-Control: max-age=86400\r\n\r\n".encode("utf-8"))
+                    remaining = size
+                    while remaining > 0:
+                        writer.write(block[:remaining])
+                        remaining -= len(block)
+                        await writer.drain()
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def main():
+        server = await asyncio.start_server(handleClient, '127.0.0.1', port)
+        async with server:
+            ready.set()
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+
+def runProxy(port: int, statsPort: int, cacheDir: str, memoryCacheBytes: int):
+    """
+    Runs Proxy.server in its own process with an empty cache.
+
+    Parameters:
+    port (int): The port the proxy listens on.
+    statsPort (int): The port the proxy serves its stats on.
+    cacheDir (str): The cache directory for this run.
+    memoryCacheBytes (int): The byte budget for the memory tier.
+    """
+    # Only log warnings and errors, logging every request would turn the benchmark into a stdout benchmark
+    startQueueLogging(logging.WARNING)
+    proxy = Proxy(memoryCacheBytes=memoryCacheBytes, cacheDir=cacheDir, statsPort=statsPort,
+                  maxRequestsPerConnection=1000000, hosts={ORIGIN_HOST: "127.0.0.1"})
+    asyncio.run(proxy.server(port))
+
+
+def waitForPort(port: int, timeout: float = 10.0):
+    """
+    Waits until something is listening on a local port.
+
+    Parameters:
+    port (int): The port to wait for.
+    timeout (float): How many seconds to wait before giving up.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def fetchStats(statsPort: int) -> dict:
+    """
+    Reads the proxy's stats from its stats endpoint.
+
+    Parameters:
+    statsPort (int): The port the proxy serves its stats on.
+
+    Returns:
+    stats (dict): The decoded stats.
+    """
+    with socket.create_connection(("127.0.0.1", statsPort)) as statsSocket:
+        statsSocket.sendall(b"GET /stats HTTP/1.1\r\n\r\n")
+        response = b''
+        while True:
+            data = statsSocket.recv(65536)
+            if not data:
+                break
+            response += data
+    return json.loads(response.partition(b"\r\n\r\n")[2])
+
+
+def peakMemory(pid: int) -> dict:
+    """
+    Reads a process's current and peak resident memory from /proc. This only works on Linux.
+
+    Parameters:
+    pid (int): The process to look at.
+
+    Returns:
+    memory (dict): The current and peak resident set size in KB, None if they couldn't be read.
+    """
+    memory = {"rssKB": None, "peakRssKB": None}
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    memory["rssKB"] = int(line.split()[1])
+                elif line.startswith("VmHWM:"):
+                    memory["peakRssKB"] = int(line.split()[1])
+    except OSError:
+        pass
+    return memory
+
+
+class KeyGenerator:
+    """
+    Produces the object URLs each scenario requests.
+    """
+
+    def __init__(self, scenario: str, originPort: int, keys: int, objectSize: int, largeSize: int, zipfExponent: float):
+        """
+        Parameters:
+        scenario (str): One of SCENARIOS.
+        originPort (int): The port of the stand-in origin.
+        keys (int): How many distinct objects the all-hit and zipf scenarios use.
+        objectSize (int): The size of the objects in bytes.
+        largeSize (int): The size of the objects in the large scenario in bytes.
+        zipfExponent (float): The exponent of the Zipf distribution, higher is more skewed.
+        """
+        self.scenario = scenario
+        self.originPort = originPort
+        self.keys = keys if scenario != "large" else 4
+        self.size = objectSize if scenario != "large" else largeSize
+        self.counter = itertools.count()
+        self.random = random.Random(5510)
+
+        # Cumulative Zipf weights so each draw is a single bisect
+        if scenario == "zipf":
+            self.cumulativeWeights = list(itertools.accumulate(1.0 / (rank ** zipfExponent) for rank in range(1, self.keys + 1)))
+
+    def url(self, key) -> str:
+        """
+        Builds the URL for an object.
+
+        Parameters:
+        key: The object's key.
+
+        Returns:
+        url (str): The absolute URL the client asks the proxy for.
+        """
+        return f"http://{ORIGIN_HOST}:{self.originPort}/obj/{self.scenario}-{key}/{self.size}"
+
+    def warmupUrls(self) -> list:
+        """
+        Returns the URLs to request once before measuring, so hit scenarios start with a warm cache.
+
+        Returns:
+        urls (list): Every object of the all-hit and large scenarios, nothing for the others.
+        """
+        if self.scenario in ("all-hit", "large"):
+            return [self.url(key) for key in range(self.keys)]
+        return []
+
+    def next(self) -> str:
+        """
+        Returns the URL for the next request.
+
+        Returns:
+        url (str): The absolute URL the client asks the proxy for.
+        """
+        if self.scenario == "all-miss":
+            return self.url(next(self.counter))
+        if self.scenario == "zipf":
+            draw = self.random.random() * self.cumulativeWeights[-1]
+            return self.url(bisect.bisect_left(self.cumulativeWeights, draw))
+        return self.url(self.random.randrange(self.keys))
+
+
+async def sendRequest(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, url: str):
+    """
+    Sends one request over a keep-alive connection and reads the whole response.
+
+    Parameters:
+    reader (StreamReader): The connection to the proxy.
+    writer (StreamWriter): The connection to the proxy.
+    url (str): The URL to request.
+
+    Returns:
+    status (str): The status code.
+    cacheHit (bool): True if the proxy said the response came from its cache.
+    received (int): The number of body bytes received.
+    """
+    writer.write(f"GET {url} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n".encode("utf-8"))
+    await writer.drain()
+
+    statusLine = await reader.readline()
+    if not statusLine:
+        raise ConnectionError("Proxy closed the connection")
+    status = statusLine.split()[1].decode("latin-1")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode("latin-1").partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    received = 0
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            received += size
+            if size == 0:
+                break
+    else:
+        remaining = int(headers.get("content-length", 0))
+        received = remaining
+        while remaining > 0:
+            chunk = await reader.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                raise ConnectionError("Proxy closed the connection in the middle of a body")
+            remaining -= len(chunk)
+
+    return status, headers.get("cache-hit") == "1", received
+
+
+async def runClients(proxyPort: int, keyGenerator: KeyGenerator, concurrency: int, duration: float) -> dict:
+    """
+    Drives the proxy with concurrent keep-alive clients for a fixed duration.
+
+    Parameters:
+    proxyPort (int): The port the proxy listens on.
+    keyGenerator (KeyGenerator): Produces the URLs to request.
+    concurrency (int): How many client connections run at once.
+    duration (float): How many seconds to run for.
+
+    Returns:
+    result (dict): The requests/sec, latency percentiles, hit ratio, error count and bytes received.
+    """
+    # Warm the cache for the hit scenarios on a single connection
+    warmupUrls = keyGenerator.warmupUrls()
+    if warmupUrls:
+        reader, writer = await asyncio.open_connection('127.0.0.1', proxyPort)
+        for url in warmupUrls:
+            await sendRequest(reader, writer, url)
+        writer.close()
+
+    latencies = []
+    statuses = {}
+    hits = 0
+    errors = 0
+    received = 0
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        nonlocal hits, errors, received
+        reader, writer = await asyncio.open_connection('127.0.0.1', proxyPort)
+        try:
+            while time.perf_counter() < deadline:
+                startTime = time.perf_counter()
+                try:
+                    status, cacheHit, size = await sendRequest(reader, writer, keyGenerator.next())
+                except (ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+                    # Reconnect and keep going, the failure is counted
+                    errors += 1
+                    writer.close()
+                    reader, writer = await asyncio.open_connection('127.0.0.1', proxyPort)
+                    continue
+                latencies.append(time.perf_counter() - startTime)
+                statuses[status] = statuses.get(status, 0) + 1
+                hits += cacheHit
+                received += size
+        finally:
+            writer.close()
+
+    startTime = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - startTime
+
+    latencies.sort()
+
+    def percentile(fraction):
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000 if latencies else 0.0
+
+    return {
+        "requests": len(latencies),
+        "requestsPerSecond": len(latencies) / elapsed if elapsed else 0.0,
+        "p50Ms": percentile(0.5),
+        "p90Ms": percentile(0.9),
+        "p99Ms": percentile(0.99),
+        "maxMs": latencies[-1] * 1000 if latencies else 0.0,
+        "hitRatio": hits / len(latencies) if latencies else 0.0,
+        "statuses": statuses,
+        "errors": errors,
+        "throughputMBps": received / (1024 ** 2) / elapsed if elapsed else 0.0,
+    }
+
+
+def runScenario(scenario: str, args) -> dict:
+    """
+    Runs one scenario against a fresh origin and a fresh proxy with an empty cache.
+
+    Parameters:
+    scenario (str): One of SCENARIOS.
+    args (Namespace): The command line arguments.
+
+    Returns:
+    result (dict): The scenario's settings, the client side results, the proxy's memory use and its own stats.
+    """
+    originReady = multiprocessing.Event()
+    origin = multiprocessing.Process(target=runOrigin, args=(args.origin_port, args.origin_latency_ms / 1000, args.error_rate, originReady), daemon=True)
+    origin.start()
+
+    with tempfile.TemporaryDirectory() as cacheDir:
+        proxy = multiprocessing.Process(target=runProxy, args=(args.port, args.port + 1, cacheDir, args.memory_cache_mb * 1024 * 1024), daemon=True)
+        proxy.start()
+        try:
+            originReady.wait(10)
+            waitForPort(args.port)
+            waitForPort(args.port + 1)
+
+            keyGenerator = KeyGenerator(scenario, args.origin_port, args.keys, args.object_size, args.large_size_mb * 1024 * 1024, args.zipf_exponent)
+            result = asyncio.run(runClients(args.port, keyGenerator, args.concurrency, args.duration))
+
+            proxyStats = fetchStats(args.port + 1)
+            memory = peakMemory(proxy.pid)
+        finally:
+            proxy.terminate()
+            origin.terminate()
+            proxy.join()
+            origin.join()
+
+    return {
+        "scenario": scenario,
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "objectSize": keyGenerator.size,
+        "keys": keyGenerator.keys,
+        "originLatencyMs": args.origin_latency_ms,
+        **result,
+        "proxyMemory": memory,
+        "proxyStats": proxyStats,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the proxy against a local stand-in origin.")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS), help="which scenarios to run")
+    parser.add_argument("--concurrency", type=int, default=32, help="how many client connections run at once")
+    parser.add_argument("--duration", type=float, default=5.0, help="how many seconds each scenario runs for")
+    parser.add_argument("--keys", type=int, default=1000, help="how many distinct objects the all-hit and zipf scenarios use")
+    parser.add_argument("--object-size", type=int, default=8192, help="size of the objects in bytes")
+    parser.add_argument("--large-size-mb", type=int, default=16, help="size of the objects in the large scenario in MB")
+    parser.add_argument("--zipf-exponent", type=float, default=1.0, help="exponent of the Zipf distribution")
+    parser.add_argument("--origin-latency-ms", type=float, default=0.0, help="how long the origin waits before answering")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of keys the origin answers with 404")
+    parser.add_argument("--memory-cache-mb", type=int, default=64, help="byte budget for the proxy's memory tier in MB")
+    parser.add_argument("--port", type=int, default=18540, help="port the proxy listens on, its stats are served on the next port up")
+    parser.add_argument("--origin-port", type=int, default=18550, help="port the stand-in origin listens on")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = [runScenario(scenario, args) for scenario in args.scenarios]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            print(f"{result['scenario']:>8}: {result['requestsPerSecond']:8.0f} req/s, p50 {result['p50Ms']:.2f}ms, p99 {result['p99Ms']:.2f}ms, "
+                  f"hit ratio {result['hitRatio']:.2f}, {result['errors']} errors, peak RSS {result['proxyMemory']['peakRssKB']} KB")
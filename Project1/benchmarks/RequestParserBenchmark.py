@@ -0,0 +1,188 @@
+# Maslin Farrell
+# Computer Networks Project 1
+#
+# Measures how long the proxy takes to parse a client request head, with the incremental RequestParser
+# and with the line-by-line StreamReader parsing it replaced, for a few request shapes and ways of arriving.
+#
+# Example usage: python3 benchmarks/RequestParserBenchmark.py --requests 200000 --json
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from pathlib import Path
+
+# The proxy lives in the folder above this one
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from RequestParser import RequestParser
+
+
+# A request typed into telnet, just the request line
+MINIMAL_REQUEST = b"GET http://zhiju.me/networks/valid.html HTTP/1.1\r\n\r\n"
+
+# A request with the headers a browser sends
+BROWSER_REQUEST = (
+    b"GET http://zhiju.me/networks/valid.html HTTP/1.1\r\n"
+    b"Host: zhiju.me\r\n"
+    b"User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0\r\n"
+    b"Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n"
+    b"Accept-Language: en-US,en;q=0.5\r\n"
+    b"Accept-Encoding: gzip, deflate\r\n"
+    b"Connection: keep-alive\r\n"
+    b"Referer: http://zhiju.me/networks/\r\n"
+    b"Cookie: session=0123456789abcdef0123456789abcdef; theme=dark; seen=1\r\n"
+    b"Upgrade-Insecure-Requests: 1\r\n"
+    b"If-None-Match: \"5f3c1a2b-2a\"\r\n"
+    b"If-Modified-Since: Mon, 01 Jan 2024 00:00:00 GMT\r\n"
+    b"Cache-Control: max-age=0\r\n"
+    b"\r\n"
+)
+
+REQUESTS = {"minimal": MINIMAL_REQUEST, "browser": BROWSER_REQUEST}
+
+# How many requests a pipelining client sends in one go
+PIPELINE_DEPTH = 10
+
+# The size of the pieces a request arrives in when it is split across several TCP segments
+SEGMENT_SIZE = 64
+
+
+def segmentsFor(head: bytes, arrival: str) -> list:
+    """
+    Splits the bytes of a request the way they reach the proxy.
+
+    Parameters:
+    head (bytes): A single request head.
+    arrival (str): 'whole' for one read, 'segmented' for SEGMENT_SIZE pieces, 'pipelined' for PIPELINE_DEPTH requests in one read.
+
+    Returns:
+    segments (list): The reads the proxy sees.
+    requests (int): How many requests the reads hold.
+    """
+    if arrival == "segmented":
+        return [head[i:i + SEGMENT_SIZE] for i in range(0, len(head), SEGMENT_SIZE)], 1
+    if arrival == "pipelined":
+        return [head * PIPELINE_DEPTH], PIPELINE_DEPTH
+    return [head], 1
+
+
+def benchmarkParser(segments: list, requestsPerRound: int, rounds: int) -> float:
+    """
+    Times the incremental RequestParser on the same reads over and over, with a new parser for every connection.
+
+    Parameters:
+    segments (list): The reads the proxy sees for one round.
+    requestsPerRound (int): How many requests the reads hold.
+    rounds (int): How many times to parse the reads.
+
+    Returns:
+    seconds (float): The total time taken.
+    """
+    startTime = time.perf_counter()
+    for _ in range(rounds):
+        parser = RequestParser()
+        parsed = 0
+        for segment in segments:
+            parser.feed(segment)
+            while parser.nextRequest() is not None:
+                parsed += 1
+        assert parsed == requestsPerRound
+    return time.perf_counter() - startTime
+
+
+async def readLineByLine(reader: asyncio.StreamReader):
+    """
+    The parsing the proxy did before RequestParser, one readline per line of the head.
+
+    Parameters:
+    reader (StreamReader): StreamReader object holding the request.
+
+    Returns:
+    uri (list): The split request line.
+    headers (dict): The request headers with lower-cased names.
+    """
+    requestLine = b''
+    while not requestLine.strip():
+        requestLine = await reader.readline()
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode("latin-1").partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return requestLine.decode("utf-8").split(), headers
+
+
+async def benchmarkReadline(segments: list, requestsPerRound: int, rounds: int) -> float:
+    """
+    Times the line-by-line parsing on the same reads over and over, with a new StreamReader for every connection.
+
+    Parameters:
+    segments (list): The reads the proxy sees for one round.
+    requestsPerRound (int): How many requests the reads hold.
+    rounds (int): How many times to parse the reads.
+
+    Returns:
+    seconds (float): The total time taken.
+    """
+    startTime = time.perf_counter()
+    for _ in range(rounds):
+        reader = asyncio.StreamReader()
+        for segment in segments:
+            reader.feed_data(segment)
+        reader.feed_eof()
+        for _ in range(requestsPerRound):
+            await readLineByLine(reader)
+    return time.perf_counter() - startTime
+
+
+def runCase(shape: str, arrival: str, totalRequests: int) -> dict:
+    """
+    Times both parsers for one request shape and way of arriving.
+
+    Parameters:
+    shape (str): The request shape, one of REQUESTS.
+    arrival (str): How the request arrives, see segmentsFor.
+    totalRequests (int): How many requests each parser parses.
+
+    Returns:
+    result (dict): The cost per request of each parser in microseconds and how much faster RequestParser is.
+    """
+    segments, requestsPerRound = segmentsFor(REQUESTS[shape], arrival)
+    rounds = max(1, totalRequests // requestsPerRound)
+    parsed = rounds * requestsPerRound
+
+    parserSeconds = benchmarkParser(segments, requestsPerRound, rounds)
+    readlineSeconds = asyncio.run(benchmarkReadline(segments, requestsPerRound, rounds))
+
+    return {
+        "shape": shape,
+        "arrival": arrival,
+        "headBytes": len(REQUESTS[shape]),
+        "requests": parsed,
+        "parserMicrosPerRequest": parserSeconds / parsed * 1e6,
+        "readlineMicrosPerRequest": readlineSeconds / parsed * 1e6,
+        "speedup": readlineSeconds / parserSeconds if parserSeconds else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the cost of parsing a client request head.")
+    parser.add_argument("--requests", type=int, default=100000, help="how many requests each parser parses per case")
+    parser.add_argument("--shapes", nargs="+", choices=list(REQUESTS), default=list(REQUESTS), help="which request shapes to parse")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = [runCase(shape, arrival, args.requests) for shape in args.shapes for arrival in ("whole", "segmented", "pipelined")]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            print(f"{result['shape']:>8} {result['arrival']:>9} ({result['headBytes']} bytes): "
+                  f"RequestParser {result['parserMicrosPerRequest']:.2f}us/request, "
+                  f"readline {result['readlineMicrosPerRequest']:.2f}us/request, {result['speedup']:.1f}x")
@@ -0,0 +1,188 @@
+# Maslin Farrell
+# Computer Networks Project 1
+#
+# Compares the two disk cache layouts for many small objects: a file per URL with a '.meta' file next to it,
+# and small bodies packed into segment files with a journal. It reports how long it takes to store the objects,
+# to load the index at startup, and to read random objects back, and how many files each layout needs.
+#
+# Example usage: python3 benchmarks/SegmentStoreBenchmark.py --objects 50000 --json
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+# The proxy lives in the folder above this one
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from CacheIndex import CacheIndex
+from SegmentStore import SegmentStore
+
+
+HEADERS = {"cache-control": "max-age=86400", "content-type": "text/html"}
+
+
+def makeObjects(count: int, minSize: int, maxSize: int) -> list:
+    """
+    Builds the cache keys and bodies to store, the same ones every run.
+
+    Parameters:
+    count (int): How many objects to build.
+    minSize (int): The smallest body in bytes.
+    maxSize (int): The largest body in bytes.
+
+    Returns:
+    objects (list): (cache key, body) pairs.
+    """
+    generator = random.Random(1530)
+    return [(f"bench.local/objects/{i}.html", b"x" * generator.randint(minSize, maxSize)) for i in range(count)]
+
+
+def storeFiles(cacheDir: str, objects: list) -> float:
+    """
+    Stores the objects the way the files storage engine does, a body and a '.meta' file per URL.
+
+    Parameters:
+    cacheDir (str): The cache directory.
+    objects (list): (cache key, body) pairs.
+
+    Returns:
+    seconds (float): How long storing took.
+    """
+    cacheIndex = CacheIndex(cacheDir)
+    startTime = time.perf_counter()
+    for key, body in objects:
+        path = cacheIndex.pathFor(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(body)
+        entry = cacheIndex.add(key, len(body), HEADERS)
+        entry.metaPath.write_bytes(CacheIndex.serializeMetadata(key, entry))
+    return time.perf_counter() - startTime
+
+
+def storeSegments(cacheDir: str, objects: list) -> float:
+    """
+    Stores the objects the way the segments storage engine does, appended to segments and recorded in the journal.
+
+    Parameters:
+    cacheDir (str): The cache directory.
+    objects (list): (cache key, body) pairs.
+
+    Returns:
+    seconds (float): How long storing took.
+    """
+    segments = SegmentStore(Path(cacheDir) / "segments")
+    cacheIndex = CacheIndex(cacheDir, segments)
+    cacheIndex.build()
+    startTime = time.perf_counter()
+    for key, body in objects:
+        segment, offset = segments.append(body)
+        segments.record(cacheIndex.add(key, len(body), HEADERS, segment=segment, offset=offset))
+    return time.perf_counter() - startTime
+
+
+def loadIndex(cacheDir: str, useSegments: bool) -> CacheIndex:
+    """
+    Loads the index the way the proxy does at startup.
+
+    Parameters:
+    cacheDir (str): The cache directory.
+    useSegments (bool): Load it from the segment store's journal instead of scanning the directory.
+
+    Returns:
+    cacheIndex (CacheIndex): The loaded index, its buildTime says how long loading took.
+    """
+    cacheIndex = CacheIndex(cacheDir, SegmentStore(Path(cacheDir) / "segments") if useSegments else None)
+    cacheIndex.build()
+    return cacheIndex
+
+
+def readRandom(cacheIndex: CacheIndex, objects: list, reads: int) -> float:
+    """
+    Reads random objects back from the disk, without the memory tier.
+
+    Parameters:
+    cacheIndex (CacheIndex): The loaded index.
+    objects (list): (cache key, body) pairs.
+    reads (int): How many objects to read.
+
+    Returns:
+    seconds (float): How long the reads took.
+    """
+    generator = random.Random(1531)
+    keys = [generator.choice(objects)[0] for _ in range(reads)]
+    startTime = time.perf_counter()
+    for key in keys:
+        entry = cacheIndex.lookup(key)
+        if entry.segment is not None:
+            cacheIndex.segments.read(entry)
+        else:
+            with open(entry.path, 'rb') as file:
+                file.read()
+    return time.perf_counter() - startTime
+
+
+def countFiles(cacheDir: str) -> int:
+    """
+    Counts the files under a cache directory, each one costs an inode.
+
+    Parameters:
+    cacheDir (str): The cache directory.
+
+    Returns:
+    files (int): The number of files.
+    """
+    return sum(len(files) for _, _, files in os.walk(cacheDir))
+
+
+def runLayout(name: str, objects: list, reads: int) -> dict:
+    """
+    Stores, loads and reads the objects with one layout in a fresh cache directory.
+
+    Parameters:
+    name (str): 'files' or 'segments'.
+    objects (list): (cache key, body) pairs.
+    reads (int): How many random objects to read back.
+
+    Returns:
+    result (dict): The timings and the number of files for the layout.
+    """
+    with tempfile.TemporaryDirectory() as cacheDir:
+        useSegments = name == "segments"
+        storeSeconds = storeSegments(cacheDir, objects) if useSegments else storeFiles(cacheDir, objects)
+        cacheIndex = loadIndex(cacheDir, useSegments)
+        assert len(cacheIndex.entries) == len(objects)
+        readSeconds = readRandom(cacheIndex, objects, reads)
+        return {
+            "layout": name,
+            "objects": len(objects),
+            "files": countFiles(cacheDir),
+            "storeMicrosPerObject": storeSeconds / len(objects) * 1e6,
+            "loadMillis": cacheIndex.buildTime * 1000,
+            "readMicrosPerObject": readSeconds / reads * 1e6,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the files and segments cache layouts for small objects.")
+    parser.add_argument("--objects", type=int, default=20000, help="how many objects to store")
+    parser.add_argument("--min-size", type=int, default=500, help="the smallest body in bytes")
+    parser.add_argument("--max-size", type=int, default=8000, help="the largest body in bytes")
+    parser.add_argument("--reads", type=int, default=20000, help="how many random objects to read back")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    objects = makeObjects(args.objects, args.min_size, args.max_size)
+    results = [runLayout(name, objects, args.reads) for name in ("files", "segments")]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            print(f"{result['layout']:>8}: {result['objects']} objects in {result['files']} files, "
+                  f"store {result['storeMicrosPerObject']:.1f}us/object, load index {result['loadMillis']:.1f}ms, "
+                  f"read {result['readMicrosPerObject']:.1f}us/object")
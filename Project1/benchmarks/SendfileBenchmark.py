@@ -0,0 +1,161 @@
+# Maslin Farrell
+# Computer Networks Project 1
+#
+# Measures how much CPU the proxy spends per GB served for cache hits that are too big for the memory tier,
+# once with the old read-into-memory path and once with the sendfile path.
+#
+# Example usage: python3 benchmarks/SendfileBenchmark.py --size-mb 256 --requests 8
+import argparse
+import asyncio
+import json
+import multiprocessing
+import socket
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+# The proxy lives in the folder above this one
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from CacheIndex import CacheEntry, CacheIndex
+from Proxy import Proxy
+
+
+CACHE_KEY = "bench.local/large.bin"
+
+
+def createCachedFile(cacheDir: str, sizeBytes: int):
+    """
+    Writes a large file straight into a cache directory along with metadata that keeps it fresh for the whole run.
+
+    Parameters:
+    cacheDir (str): The cache directory the proxy will be started with.
+    sizeBytes (int): The size of the cached body.
+    """
+    cacheIndex = CacheIndex(cacheDir)
+    path = cacheIndex.pathFor(CACHE_KEY)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    block = bytes(range(256)) * 4096
+    with open(path, 'wb') as file:
+        remaining = sizeBytes
+        while remaining > 0:
+            file.write(block[:remaining])
+            remaining -= len(block)
+
+    entry = CacheEntry(path, sizeBytes, time.time(), {"cache-control": "max-age=86400", "content-type": "application/octet-stream"})
+    entry.metaPath.write_bytes(CacheIndex.serializeMetadata(CACHE_KEY, entry))
+
+
+def runServer(cacheDir: str, port: int, useSendfile: bool, pipe):
+    """
+    Runs the proxy in its own process and reports the CPU time it used once the parent says the downloads are done.
+
+    Parameters:
+    cacheDir (str): The cache directory holding the large file.
+    port (int): The port the proxy listens on.
+    useSendfile (bool): Whether the proxy serves the file with sendfile.
+    pipe (Connection): Used to tell the parent we are ready and to send back the CPU time.
+    """
+    # Keep the memory tier empty so every request is served from the disk cache
+    proxy = Proxy(memoryCacheBytes=0, cacheDir=cacheDir, useSendfile=useSendfile)
+
+    async def main():
+        await asyncio.to_thread(proxy.cacheIndex.build)
+        server = await asyncio.start_server(proxy.handleClient, '127.0.0.1', port)
+        async with server:
+            pipe.send("ready")
+            startTime = time.process_time()
+            await asyncio.to_thread(pipe.recv)
+            pipe.send(time.process_time() - startTime)
+
+    asyncio.run(main())
+
+
+def download(port: int, requests: int) -> int:
+    """
+    Downloads the large file from the proxy over one keep-alive connection, throwing the body away.
+
+    Parameters:
+    port (int): The port the proxy listens on.
+    requests (int): How many times to download the file.
+
+    Returns:
+    received (int): The total number of body bytes received.
+    """
+    received = 0
+    with socket.create_connection(("127.0.0.1", port)) as clientSocket:
+        stream = clientSocket.makefile('rb')
+        for _ in range(requests):
+            clientSocket.sendall(f"GET http://{CACHE_KEY} HTTP/1.1\r\nHost: bench.local\r\n\r\n".encode("utf-8"))
+
+            # Read the head to find the body length, then read and discard the body
+            contentLength = 0
+            while True:
+                line = stream.readline()
+                if line in (b"\r\n", b""):
+                    break
+                if line.lower().startswith(b"content-length:"):
+                    contentLength = int(line.split(b":", 1)[1])
+
+            remaining = contentLength
+            while remaining > 0:
+                chunk = stream.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    raise ConnectionError("Proxy closed the connection in the middle of a body")
+                remaining -= len(chunk)
+            received += contentLength
+    return received
+
+
+def runMode(cacheDir: str, port: int, useSendfile: bool, requests: int) -> dict:
+    """
+    Starts the proxy, downloads the file and collects the results for one mode.
+
+    Returns:
+    result (dict): The bytes served, the proxy's CPU time and its CPU time per GB.
+    """
+    parentPipe, childPipe = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=runServer, args=(cacheDir, port, useSendfile, childPipe))
+    server.start()
+    try:
+        parentPipe.recv()
+        wallStart = time.perf_counter()
+        received = download(port, requests)
+        wallTime = time.perf_counter() - wallStart
+        parentPipe.send("done")
+        cpuTime = parentPipe.recv()
+    finally:
+        server.terminate()
+        server.join()
+
+    gigabytes = received / (1024 ** 3)
+    return {
+        "mode": "sendfile" if useSendfile else "read",
+        "bytesServed": received,
+        "cpuSeconds": cpuTime,
+        "cpuSecondsPerGB": cpuTime / gigabytes if gigabytes else 0.0,
+        "throughputMBps": received / (1024 ** 2) / wallTime if wallTime else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare proxy CPU per GB for cache hits with and without sendfile.")
+    parser.add_argument("--size-mb", type=int, default=256, help="size of the cached file in MB")
+    parser.add_argument("--requests", type=int, default=8, help="how many times the file is downloaded in each mode")
+    parser.add_argument("--port", type=int, default=18530, help="port the proxy listens on")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cacheDir:
+        createCachedFile(cacheDir, args.size_mb * 1024 * 1024)
+        results = [runMode(cacheDir, args.port, useSendfile, args.requests) for useSendfile in (False, True)]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            print(f"{result['mode']:>8}: {result['bytesServed'] / (1024 ** 3):.2f} GB served, "
+                  f"{result['cpuSeconds']:.2f}s CPU, {result['cpuSecondsPerGB']:.3f}s CPU/GB, {result['throughputMBps']:.0f} MB/s")